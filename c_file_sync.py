@@ -3,18 +3,30 @@
 # This source code is licensed under the Apache License, Version 2.0, found in the
 # LICENSE file in the root directory of this source tree.
 
-from m9lib import uCommand, uCommandRegistry, uStringFormat, uCSV, uCSVFormat, uTimer
+from m9lib import uCommand, uCommandRegistry, uStringFormat, uTimer, uLoggerLevel
 
 from folder_section import *
 from folder_scan import *
 from folder_set import *
+from scan_cache import *
+from copy_engine import *
+from csv_writer import *
+from folder_watch import *
+from sync_journal import *
+from sync_metrics import *
+from rule_profile import *
+from stage_profile import *
+from sync_snapshot import *
 
 import shutil
+from collections import deque
 
 # Your command class name must match the section name in your config file
 #   and be registered for uControl to create an instance of your command
 #   object.
 class FileSyncCommand(uCommand):
+    # folder for stage profiles when Profile is not configured, such as from the command line
+    ProfilePath:str = None
     
     def __init__(self):
         super().__init__()
@@ -29,6 +41,9 @@ class FileSyncCommand(uCommand):
         self._tsm = uStringFormat.String("{TSM}")
 
         # initialize settings
+        SyncUtils.ResetPaths()
+        RuleProfile.Active = None
+        self.metrics = SyncMetrics()
         self.config_error_count = 0
         self.exclude_folder_rules = []
 
@@ -57,10 +72,25 @@ class FileSyncCommand(uCommand):
         else:
             self.target_path = SyncUtils.NormalizePath(self.target_path)
 
+        # a snapshot keeps history in previous snapshots, so CleanPath is optional
+        self.snapshot = None
+        self.snapshot_mode = self.GetBoolParam("Snapshot", False)
+        self.LogParam("Snapshot", self.snapshot_mode)
+        self.snapshot_name = self.GetParam("SnapshotName", "{YMD}-{TSM}")
+        self.keep_snapshots = self.GetIntParam("KeepSnapshots", 0)
+        if self.snapshot_mode:
+            if self.mode not in ["SYNC", "SYNCREVIEW"]:
+                self.__config_warning(f"Snapshot requires SYNC or SYNCREVIEW mode")
+            self.LogParam("SnapshotName", self.snapshot_name)
+            if isinstance(self.keep_snapshots, int) is False or self.keep_snapshots<0:
+                self.__config_warning(f"KeepSnapshots must be a number of snapshots, or 0 to keep all snapshots")
+            else:
+                self.LogParam("KeepSnapshots", self.keep_snapshots)
+
         self.LogParam("CleanPath")
         self.clean_path = self.GetParam("CleanPath")
         if self.clean_path is None:
-            if self.mode in ["SYNC", "BACKUP"]:
+            if self.mode in ["SYNC", "BACKUP"] and self.snapshot_mode is False:
                 self.__config_warning(f"CleanPath must specify a location for removed files")
         elif uFolder.ConfirmFolder(self.clean_path, self.mode=="SYNC") is False:
             if self.mode in ["SYNC", "BACKUP"]:
@@ -92,10 +122,113 @@ class FileSyncCommand(uCommand):
         self.disable_mover = self.GetBoolParam("DisableMover", False)
         self.LogParam("DisableMover", self.disable_mover)
 
+        compare_mode = self.GetParam("CompareMode", "SIZE").upper()
+        self.compare_mode = CompareMode.SIZE
+        if compare_mode in CompareMode.__members__:
+            self.compare_mode = CompareMode[compare_mode]
+            self.LogParam("CompareMode", compare_mode)
+        else:
+            self.__config_warning(f"CompareMode must be one of: {','.join(CompareMode.__members__)}")
+
+        self.copy_workers = self.GetIntParam("CopyWorkers", 1)
+        if isinstance(self.copy_workers, int) is False or self.copy_workers<1:
+            self.__config_warning(f"CopyWorkers must be a number greater than zero")
+        else:
+            self.LogParam("CopyWorkers", self.copy_workers)
+
+        copy_method = self.GetParam("CopyMethod", "AUTO").upper()
+        self.copy_method = CopyMethod.AUTO
+        if copy_method in CopyMethod.__members__:
+            self.copy_method = CopyMethod[copy_method]
+            self.LogParam("CopyMethod", copy_method)
+        else:
+            self.__config_warning(f"CopyMethod must be one of: {','.join(CopyMethod.__members__)}")
+
+        self.scan_workers = self.GetIntParam("ScanWorkers", 1)
+        if isinstance(self.scan_workers, int) is False or self.scan_workers<1:
+            self.__config_warning(f"ScanWorkers must be a number greater than zero")
+        else:
+            self.LogParam("ScanWorkers", self.scan_workers)
+
         self.LogParam("OutputCSV")
         self.output_csv = self.GetParam("OutputCSV")
         self.output_csv = self.__string_format(self.output_csv)
 
+        self.delta_threshold = None
+        delta_threshold = self.GetParam("DeltaThreshold")
+        if delta_threshold:
+            self.delta_threshold = uStringFormat.ParseBytes(delta_threshold)
+            if self.delta_threshold is False:
+                self.__config_warning(f"DeltaThreshold must be a size in bytes, or as kb, mb, gb, tb")
+            else:
+                self.LogParam("DeltaThreshold")
+
+        self.store_path = None
+        self.object_store = self.GetBoolParam("ObjectStore", False)
+        self.LogParam("ObjectStore", self.object_store)
+        if self.object_store:
+            if self.target_path is None:
+                self.__config_warning(f"ObjectStore requires a TargetPath")
+            else:
+                self.store_path = SyncUtils.NormalizePath(os.path.join(self.target_path, ObjectStore.FolderName))
+            if self.delta_threshold:
+                self.LogWarning(f"DeltaThreshold is not used with ObjectStore")
+
+        self.profile_rules = self.GetBoolParam("ProfileRules", False)
+        self.LogParam("ProfileRules", self.profile_rules)
+
+        self.profile_path = self.GetParam("Profile", FileSyncCommand.ProfilePath)
+        self.LogParam("Profile", self.profile_path)
+        if self.profile_path is not None:
+            self.profile_path = self.__string_format(self.profile_path)
+
+        self.LogParam("Metrics")
+        self.metrics_path = self.GetParam("Metrics")
+        if self.metrics_path is not None:
+            self.metrics_path = self.__string_format(self.metrics_path)
+
+        self.LogParam("ScanCache")
+        self.scan_cache = self.GetParam("ScanCache")
+        if self.scan_cache is not None:
+            self.scan_cache = self.__string_format(self.scan_cache)
+        self.trust_scan_cache = self.GetBoolParam("TrustScanCache", False)
+        self.LogParam("TrustScanCache", self.trust_scan_cache)
+
+        self.LogParam("Journal")
+        self.journal_path = self.GetParam("Journal")
+        if self.journal_path is not None:
+            uFolder.ConfirmFolder(os.path.dirname(os.path.abspath(self.journal_path)))
+
+        self.resume = self.GetBoolParam("Resume", False)
+        self.LogParam("Resume", self.resume)
+        if self.resume:
+            if self.mode not in ["SYNC", "BACKUP"]:
+                self.__config_warning(f"Resume requires SYNC or BACKUP mode")
+            if self.journal_path is None:
+                self.__config_warning(f"Resume requires a Journal")
+        if self.snapshot_mode and (self.journal_path is not None or self.resume):
+            self.__config_warning(f"Journal and Resume are not used with Snapshot; a partial snapshot is discarded by the next run")
+
+        self.watch = self.GetBoolParam("Watch", False)
+        self.LogParam("Watch", self.watch)
+        self.watch_delay = 2.0
+        if self.watch:
+            if self.mode not in ["SYNC", "BACKUP"]:
+                self.__config_warning(f"Watch requires SYNC or BACKUP mode")
+            elif self.snapshot_mode:
+                self.__config_warning(f"Watch is not used with Snapshot")
+            elif FolderWatch.IsSupported() is False:
+                self.__config_warning(f"Watch requires Linux inotify")
+            watch_delay = self.GetParam("WatchDelay")
+            if watch_delay:
+                try:
+                    self.watch_delay = float(watch_delay)
+                    if self.watch_delay<0:
+                        raise ValueError()
+                    self.LogParam("WatchDelay", self.watch_delay)
+                except ValueError:
+                    self.__config_warning(f"WatchDelay must be a number of seconds")
+
         sections = []
         if self.source_folders is not None:
             for source_id in self.source_folders:
@@ -106,9 +239,27 @@ class FileSyncCommand(uCommand):
                     sections.append(section)
 
         SyncUtils.Logger = self.GetLogger()
+        FolderTree.Reset()
         self.folderscan = FolderScan()
+        self.folderscan.SetCompareMode(self.compare_mode)
+        self.folderscan.SetScanWorkers(self.scan_workers)
+        self.folderscan.SetMetrics(self.metrics)
+        if self.profile_path is not None:
+            try:
+                self.metrics.SetProfiler(StageProfiler(self.profile_path, self._tsm))
+            except OSError as e:
+                self.__config_warning(f"Unable to create Profile folder: {str(e)}")
+        if self.profile_rules:
+            # rules are counted in this process, so folders are not scanned by worker processes
+            if self.scan_workers>1:
+                self.LogWarning(f"ProfileRules scans folders in a single process; ScanWorkers is ignored")
+                self.folderscan.SetScanWorkers(1)
+            RuleProfile.Active = RuleProfile()
+        self.metrics.SetInfo('mode', self.mode)
+        self.store = ObjectStore(self.target_path) if self.store_path is not None and self.mode in ["SYNC", "BACKUP"] else None
 
         folder:FolderSection = None
+        folders = []
         for section in sections:
             folder = FolderSection (section)
             if folder.IsValid() is False:
@@ -116,13 +267,22 @@ class FileSyncCommand(uCommand):
             elif folder.PathExists() is False:
                 self.__config_warning(f"Folder path does not exist: {folder.GetPath()}")
             else:
-                self.folderscan.AddFolder(folder)
+                folders.append(folder)
+        self.folderscan.AddFolders(folders)
 
         if self.config_error_count > 0:
             self.LogError(f"There were {self.config_error_count} configuration failures. Please correct configuration and run again.")
             return "Configuration failure"
         
-        # establish target folders
+        # establish target folders; snapshot source folders are compared to the previous snapshot
+        base_path = self.target_path
+        if self.snapshot_mode and self.target_path is not None:
+            self.snapshot = SyncSnapshot(self.target_path, self.__string_format(self.snapshot_name))
+            base_path = self.snapshot.GetComparePath()
+            self.metrics.SetInfo('snapshot', self.snapshot.GetPath())
+            self.LogMessage(f"Snapshot: {self.snapshot.GetPath()}")
+            self.LogMessage(f"Previous snapshot: {self.snapshot.GetPrevious() or 'None'}")
+
         if self.target_path is not None:
             self.GetLogger().WriteSubHeader("Source Folders")
             top_count=0
@@ -131,7 +291,7 @@ class FileSyncCommand(uCommand):
                     top_count += 1
 
             for folder in self.folderscan.GetFolders():
-                target_path = self.target_path
+                target_path = base_path
                 parent:FolderSection = folder.GetParent()
                 if parent:
                     while True:
@@ -149,6 +309,15 @@ class FileSyncCommand(uCommand):
                 self.LogMessage(f"[+BLUE][SourceFolder:{folder.GetId()}]: [+][+CYAN]{folder.GetPath()} => {target_path}[+]")
             self.GetLogger().WriteSubDivider()
 
+        # an interrupted synchronization is completed without scanning folders
+        if self.resume:
+            with self.metrics.Stage('sync'):
+                resumed = self.__resume_synchronization()
+            if resumed is False:
+                return self.__write_metrics("Failed to resume synchronization")
+            if resumed is True:
+                return self.__write_metrics("Success")
+
         if self.exclude_folder_rules:
             if self.target_path:
                 self.exclude_folder_rules.append(self.target_path)
@@ -156,40 +325,135 @@ class FileSyncCommand(uCommand):
                 self.exclude_folder_rules.append(self.clean_path)
             self.folderscan.SetGlobalExclude(self.exclude_folder_rules)
 
-        # scan folders    
-        sf_ret = self.folderscan.ScanFolders()
-        if sf_ret is False:
-            self.LogError("Fatal error while scanning folders")
-            return "Failed to scan folders"
-        
+        if self.scan_cache:
+            uFolder.ConfirmFolder(os.path.dirname(os.path.abspath(self.scan_cache)))
+            try:
+                FolderTree.SetCache(ScanCache(self.scan_cache), self.trust_scan_cache)
+            except Exception as e:
+                self.LogWarning(f"Unable to open scan cache, performing a full scan: {str(e)}")
+
+        # the clean folder is walked at the same time as source and target folders
+        if self.mode in ["SYNC", "SYNCREVIEW"] and self.disable_mover is False and self.clean_path is not None and os.path.isdir(self.clean_path):
+            self.folderscan.AddScanPath(self.clean_path)
+
+        # scan folders; the scan cache is committed even when scanning fails
         skip_files = None
         skip_folders = None
-        if self.skip_files:
-            skip_files,skip_folders = self.__calc_skip_files()
-
         remove_files = None
         remove_folders = None
-        if self.mode in ["SYNC", "SYNCREVIEW"]:
-            remove_files,remove_folders = self.__calc_remove_files()
-            if self.disable_mover is False:
-                self.__calc_mover_files(remove_files)
+        try:
+            sf_ret = self.folderscan.ScanFolders()
+            if sf_ret is False:
+                self.LogError("Fatal error while scanning folders")
+                return self.__write_metrics("Failed to scan folders")
+
+            if self.skip_files:
+                with self.metrics.Stage('skip'):
+                    skip_files,skip_folders = self.__calc_skip_files()
+
+            if self.mode in ["SYNC", "SYNCREVIEW"]:
+                with self.metrics.Stage('remove'):
+                    remove_files,remove_folders = self.__calc_remove_files()
+                if self.disable_mover is False:
+                    with self.metrics.Stage('mover'):
+                        self.__calc_mover_files(remove_files)
+        finally:
+            self.__close_scan_cache()
+
+        self.__record_scan_metrics()
         
         # generate csv output
-        self.__generate_csv(skip_files, skip_folders, remove_files, remove_folders)
+        with self.metrics.Stage('csv'):
+            self.__generate_csv(skip_files, skip_folders, remove_files, remove_folders)
 
         # write summary
-        self.__write_summary(skip_files, remove_files)
+        with self.metrics.Stage('summary'):
+            self.__write_summary(skip_files, remove_files)
 
         if self.mode in ["SYNC", "BACKUP"]:
-            self.__perform_synchronization(self.mode, remove_files)
+            with self.metrics.Stage('sync'):
+                self.__perform_synchronization(self.mode, remove_files)
+
+        if self.profile_rules:
+            RuleProfile.Active.WriteReport(self.GetLogger())
+            RuleProfile.Active = None
+
+        if self.watch:
+            self.__write_metrics("Success")
+            self.__watch_folders()
 
         # Return True, "Success", or a failure string.
-        return "Success"
+        return self.__write_metrics("Success")
     
+    def __record_scan_metrics(self):
+        # records files found by status for each folder section, and folder walks of each snapshot
+        folder:FolderSection = None
+        for folder in self.folderscan.GetFolders():
+            store = folder.GetScanStore()
+            self.metrics.Set('files', store.GetFileCount(), folder.GetId())
+            for stat in ['NEW', 'MOD', 'SAME']:
+                count, size = store.GetTotals(stat)
+                self.metrics.Set(f"files_{stat.lower()}", count, folder.GetId())
+                self.metrics.Set(f"bytes_{stat.lower()}", size, folder.GetId())
+            tree = FolderTree.Trees.get(folder.GetPath())
+            if tree is not None:
+                for name, value in tree.GetStats().items():
+                    self.metrics.Set(name, value, folder.GetId())
+
+        for tree in FolderTree.Trees.values():
+            for name, value in tree.GetStats().items():
+                self.metrics.Add(name, value)
+
+    def __record_copy_metrics(self, Engine:CopyEngine):
+        self.metrics.Add('files_copied', Engine.GetCopiedFiles())
+        self.metrics.Add('bytes_copied', Engine.GetCopiedBytes())
+        self.metrics.Add('files_moved', Engine.GetMovedFiles())
+        self.metrics.Add('files_cleaned', Engine.GetCleanedFiles())
+        self.metrics.Add('files_linked', Engine.GetLinkedFiles())
+        self.metrics.Add('retries', Engine.GetRetryCount())
+        delta_files, delta_bytes = Engine.GetDeltaStats()
+        self.metrics.Add('delta_files', delta_files)
+        self.metrics.Add('delta_bytes', delta_bytes)
+        for method, (files, size) in Engine.GetMethodCounts().items():
+            self.metrics.Add(f"files_copied_{method.name.lower()}", files)
+            self.metrics.Add(f"bytes_copied_{method.name.lower()}", size)
+        if self.store is not None:
+            # totals of the object store, for every engine of the run
+            for name, value in self.store.GetStats().items():
+                self.metrics.Set(f"store_{name}", value)
+
+    def __write_metrics(self, Result:str)->str:
+        # writes the metrics record when configured, and reports stage profiles; returns Result
+        if self.metrics.profiler is not None:
+            self.LogMessage(f"{len(self.metrics.profiler.GetFiles())} stage profile files written: {self.profile_path}")
+        if self.metrics_path is not None:
+            self.metrics.SetInfo('result', Result)
+            sync_seconds = self.metrics.GetStageSeconds('sync')
+            if sync_seconds>0:
+                self.metrics.Set('copy_bytes_per_second', self.metrics.GetValue('bytes_copied')/sync_seconds)
+            try:
+                uFolder.ConfirmFolder(os.path.dirname(os.path.abspath(self.metrics_path)))
+                self.metrics.Write(self.metrics_path)
+                self.LogDetails(f"Metrics written: {self.metrics_path}")
+            except Exception as e:
+                self.LogWarning(f"Unable to write metrics: {str(e)}")
+        return Result
+
     def __config_warning(self, in_message):
         self.config_error_count += 1
         self.LogWarning(in_message)
 
+    def __close_scan_cache(self):
+        cache:ScanCache = FolderTree.Cache
+        if cache is not None:
+            FolderTree.SetCache(None)
+            hits, misses = cache.GetStats()
+            self.LogMessage(f"Scan cache: {hits} folders unchanged, {misses} folders listed")
+            try:
+                cache.Close()
+            except Exception as e:
+                self.LogWarning(f"Unable to update scan cache: {str(e)}")
+
     def __calc_skip_files(self):
         # generate a list of skipped source files, organized by folder
         skip_files = {}
@@ -203,19 +467,15 @@ class FileSyncCommand(uCommand):
         for folder in self.folderscan.GetFolders():
             if folder.GetParent() is None:
                 source_path = folder.GetPath()
-                all_files = uFolder.FindFiles(source_path, Recurse=True)
-                all_files = uFolder.OrganizeFilesByPath(all_files)
-                for folder_files in all_files:
-                    folder_path = folder_files[0]
+                for folder_path, folder_files in FolderTree.GetTree(source_path).WalkFiles(source_path):
                     if self.__ignore_path(folder_path) is False:
-                        results = folder.GetScanResults(SourceFolder=folder_path)
-                        for file in folder_files[1]:
-                            if results == None or self.__file_in_tuple_list(file, results) is False:
+                        names = folder.GetScanNames(SourceFolder=folder_path)
+                        for file, fstat in folder_files.items():
+                            if names is None or file not in names:
                                 if folder_path not in skip_files:
                                     skip_files[folder_path] = []
                                     skip_folders[folder_path] = folder.GetId()
-                                filepath = os.path.join(folder_path, file)
-                                skip_files[folder_path].append((file, os.path.getsize(filepath), 'SKIP'))
+                                skip_files[folder_path].append((file, fstat[0], 'SKIP'))
 
         SyncUtils.Logger.WriteLine(f"[+GREEN]=== Completed skipped file scan ({timer.GetElapsedString()})[+]")
 
@@ -234,19 +494,15 @@ class FileSyncCommand(uCommand):
         for folder in self.folderscan.GetFolders():
             if folder.GetParent() is None:
                 target_path = folder.GetTargetPath()
-                all_files = uFolder.FindFiles(target_path, Recurse=True)
-                all_files = uFolder.OrganizeFilesByPath(all_files)
-                for folder_files in all_files:
-                    folder_path = folder_files[0]
+                for folder_path, folder_files in FolderTree.GetTree(target_path).WalkFiles(target_path):
                     if self.__ignore_path(folder_path, IncludeTarget=True) is False:
-                        results = folder.GetScanResults(TargetFolder=folder_path)
-                        for file in folder_files[1]:
-                            if results == None or self.__file_in_tuple_list(file, results) is False:
+                        names = folder.GetScanNames(TargetFolder=folder_path)
+                        for file, fstat in folder_files.items():
+                            if names is None or file not in names:
                                 if folder_path not in remove_files:
                                     remove_files[folder_path] = []
                                     remove_folders[folder_path] = folder.GetId()
-                                filepath = os.path.join(folder_path, file)
-                                remove_files[folder_path].append((file, os.path.getsize(filepath), 'REMOVE'))
+                                remove_files[folder_path].append((file, fstat[0], 'REMOVE'))
 
         SyncUtils.Logger.WriteLine(f"[+GREEN]=== Completed removed file scan ({timer.GetElapsedString()})[+]")
 
@@ -261,13 +517,8 @@ class FileSyncCommand(uCommand):
             SyncUtils.Logger.WriteLine(f"[+GREEN]=== Scanning clean folder ...[+]")
 
             clean_path = self.clean_path
-            all_files = uFolder.FindFiles(clean_path, Recurse=True)
-            all_files = uFolder.OrganizeFilesByPath(all_files)
-            for folder_files in all_files:
-                clean_files[folder_files[0]] = []
-                for file in folder_files[1]:
-                    filepath = os.path.join(folder_files[0], file)
-                    clean_files[folder_files[0]].append((file, os.path.getsize(filepath), 'CLEAN'))
+            for folder_path, folder_files in FolderTree.GetTree(clean_path).WalkFiles(clean_path):
+                clean_files[folder_path] = [(file, fstat[0], 'CLEAN') for file, fstat in folder_files.items()]
 
             SyncUtils.Logger.WriteLine(f"[+GREEN]=== Completed clean file scan ({timer.GetElapsedString()})[+]")
 
@@ -277,65 +528,70 @@ class FileSyncCommand(uCommand):
         # updates scan results when a file has been moved
         if isinstance(remove_files, dict) and self.disable_mover is False:
             clean_files = self.__calc_clean_files()
-            clean_files_folders = list(clean_files.keys())
 
-            remove_files_folders = list(remove_files.keys())
-            if len(remove_files_folders)>0:
+            if len(remove_files)>0:
                 timer = uTimer()
                 SyncUtils.Logger.WriteLine(f"[+GREEN]=== Scanning for misplaced files ...[+]")
 
+                # candidates are matched by (name, size), in folder order and then file order
+                remove_index = self.__index_files(remove_files, 'REMOVE')
+                clean_index = self.__index_files(clean_files, 'CLEAN')
+
                 for folder in self.folderscan.folders:
                     results = folder.GetScanResults()
                     for folder in results:
-                        for file_index in range(len(folder['files'])):
+                        for file_index, file in enumerate(folder['files']):
                             # first search in removed files
-                            file = folder['files'][file_index]
-                            if file[2]=='NEW':
-                                find_file = (file[0],file[1],'REMOVE')
-                                for remove_folder in remove_files_folders:
-                                    try:
-                                        index = remove_files[remove_folder].index(find_file)
-                                        self.LogDetails(f"Found missing file \"{file[0]}\": {os.path.join(remove_folder,file[0])}")
-                                        remove_files[remove_folder][index] = (file[0],file[1],'MOVE', folder['target'])
-                                        folder['files'][file_index] = (file[0],file[1],"*MOVE")
-                                        break
-                                    except:
-                                        pass
+                            if file[2]!='NEW':
+                                continue
+
+                            key = (file[0],file[1])
+                            candidates = remove_index.get(key)
+                            if candidates:
+                                remove_folder, index = candidates.popleft()
+                                self.LogDetails(f"Found missing file \"{file[0]}\": {os.path.join(remove_folder,file[0])}")
+                                remove_files[remove_folder][index] = (file[0],file[1],'MOVE', folder['target'])
+                                folder['files'].SetStatus(file_index, "*MOVE")
+                                continue
 
                             # then search in clean files
-                            file = folder['files'][file_index]
-                            if file[2]=='NEW':
-                                find_file = (file[0],file[1],'CLEAN')
-                                for clean_folder in clean_files_folders:
-                                    try:
-                                        index = clean_files[clean_folder].index(find_file)
-                                        self.LogDetails(f"Found missing file \"{file[0]}\": {os.path.join(clean_folder,file[0])}")
-                                        clean_files[clean_folder][index] = (file[0],file[1],'*CLEAN')
-                                        folder['files'][file_index] = (file[0],file[1],"*MOVE")
-                                        if clean_folder not in remove_files:
-                                            remove_files[clean_folder] = []
-                                            remove_files_folders.append(clean_folder)
-                                        remove_files[clean_folder].append((file[0],file[1],'MOVE', folder['target']))
-                                        break
-                                    except:
-                                        pass
+                            candidates = clean_index.get(key)
+                            if candidates:
+                                clean_folder, index = candidates.popleft()
+                                self.LogDetails(f"Found missing file \"{file[0]}\": {os.path.join(clean_folder,file[0])}")
+                                clean_files[clean_folder][index] = (file[0],file[1],'*CLEAN')
+                                folder['files'].SetStatus(file_index, "*MOVE")
+                                if clean_folder not in remove_files:
+                                    remove_files[clean_folder] = []
+                                remove_files[clean_folder].append((file[0],file[1],'MOVE', folder['target']))
 
                 SyncUtils.Logger.WriteLine(f"[+GREEN]=== Completed misplaced file scan ({timer.GetElapsedString()})[+]")
         pass
+
+    def __index_files(self, in_files:dict, in_stat:str)->dict:
+        # returns {(name, size): deque([(folder, index)])} for files of the specified stat
+        index = {}
+        for folder, files in in_files.items():
+            for file_index in range(len(files)):
+                file = files[file_index]
+                if file[2]==in_stat:
+                    key = (file[0],file[1])
+                    if key in index:
+                        index[key].append((folder, file_index))
+                    else:
+                        index[key] = deque([(folder, file_index)])
+        return index
     
     def __ignore_path(self, in_path, IncludeTarget=False):
-        if not IncludeTarget and self.target_path and SyncUtils.PathIsUnder(self.target_path, in_path, True):
+        # in_path is a folder of a snapshot of a normalized path
+        if not IncludeTarget and self.target_path and SyncUtils.PathIsUnder(self.target_path, in_path, True, Normalized=True):
+            return True
+        if self.clean_path and SyncUtils.PathIsUnder(self.clean_path, in_path, True, Normalized=True):
             return True
-        if self.clean_path and SyncUtils.PathIsUnder(self.clean_path, in_path, True):
+        if self.store_path and SyncUtils.PathIsUnder(self.store_path, in_path, True, Normalized=True):
             return True
         return False
 
-    def __file_in_tuple_list(self, in_file, in_list):
-        for tup in in_list:
-            if tup[0]==in_file:
-                return True
-        return False
-    
     def __generate_csv(self, skip_files:dict=None, skip_folders:dict=None, remove_files:dict=None, remove_folders:dict=None):
         if self.output_csv is not None:
             timer = uTimer()
@@ -344,31 +600,38 @@ class FileSyncCommand(uCommand):
             filepath = uStringFormat.String(self.output_csv)
             uFolder.ConfirmFolder(os.path.dirname(filepath))
             self.LogMessage(f"Writing CSV output: {filepath}")
-            format = uCSVFormat()
-            format.SetColumns("Source, File, Size, Status, Source, Target")
-            csv = uCSV(format)
-            folder:FolderSection = None
-            for folder in self.folderscan.folders:
-                results = folder.GetScanResults()
-                for result_folder in results:
-                    for file in result_folder['files']:
-                        if file[2].startswith('*') is False:
-                            self.__csv_addrow(csv, [folder.GetId(), file[0], file[1], file[2] if len(file)>2 else "", result_folder['folder'], result_folder['target']])
-
-            if skip_files:
-                for skip_folder in list(skip_files.keys()):
-                    for file in skip_files[skip_folder]:
-                        self.__csv_addrow(csv, [skip_folders[skip_folder] if (skip_folders is not None and skip_folder in skip_folders) else "", file[0], file[1], file[2] if len(file)>2 else "", skip_folder, ""])
-
-            if remove_files:
-                for remove_folder in list(remove_files.keys()):
-                    for file in remove_files[remove_folder]:
-                        self.__csv_addrow(csv, [remove_folders[remove_folder] if (remove_folders is not None and remove_folder in remove_folders) else "", file[0], file[1], file[2] if len(file)>2 else "", remove_folder, file[3] if len(file)>3 else ""])
-
-            ret = csv.WriteFile(filepath)
-            if ret is False:
-                self.LogError(f"Failed writing CSV output: {filepath}")
-            else:
+            csv = None
+            ret = False
+            try:
+                csv = CSVStreamWriter(filepath, ["Source", "File", "Size", "Status", "Source", "Target"])
+                folder:FolderSection = None
+                for folder in self.folderscan.folders:
+                    results = folder.GetScanResults()
+                    for result_folder in results:
+                        for file in result_folder['files']:
+                            if file[2].startswith('*') is False:
+                                csv.WriteRow([folder.GetId(), file[0], file[1], file[2] if len(file)>2 else "", result_folder['folder'], result_folder['target']])
+
+                if skip_files:
+                    for skip_folder in list(skip_files.keys()):
+                        for file in skip_files[skip_folder]:
+                            csv.WriteRow([skip_folders[skip_folder] if (skip_folders is not None and skip_folder in skip_folders) else "", file[0], file[1], file[2] if len(file)>2 else "", skip_folder, ""])
+
+                if remove_files:
+                    for remove_folder in list(remove_files.keys()):
+                        for file in remove_files[remove_folder]:
+                            csv.WriteRow([remove_folders[remove_folder] if (remove_folders is not None and remove_folder in remove_folders) else "", file[0], file[1], file[2] if len(file)>2 else "", remove_folder, file[3] if len(file)>3 else ""])
+
+                ret = csv.Close()
+            except Exception as e:
+                self.LogError(f"Failed writing CSV output: {filepath}: {str(e)}")
+                if csv is not None:
+                    try:
+                        csv.Close()
+                    except Exception:
+                        pass
+
+            if ret is not False:
                 self.LogMessage(f"Wrote {ret} rows to CSV output")
 
             SyncUtils.Logger.WriteLine(f"[+GREEN]=== Wrote CSV file ({timer.GetElapsedString()})[+]")
@@ -377,11 +640,6 @@ class FileSyncCommand(uCommand):
         
         return None
     
-    def __csv_addrow(self, csv:uCSV, row:list):
-        row = [f"\"{r}\"" if (isinstance(r, str) and ',' in r) else r for r in row]
-        if csv.AddRow(row) is False:
-            pass
-    
     def __write_summary(self, skip_files:dict=None, remove_files:dict=None):
         all_folders = 0
         all_files = 0
@@ -396,16 +654,16 @@ class FileSyncCommand(uCommand):
         for stat in all_stats:
             sum_stat[stat] = {'files':0, 'size':0}
 
+        # scan results are totaled by the scan store
         folder:FolderSection = None
         for folder in self.folderscan.folders:
-            results = folder.GetScanResults()
-            for folder in results:
-                all_folders += 1
-                for file in folder['files']:
-                    all_files += 1
-                    if len(file)>2 and file[2] in all_stats:
-                        sum_stat[file[2]]['files'] += 1
-                        sum_stat[file[2]]['size'] += file[1]
+            all_folders += len(folder.GetScanResults())
+            store = folder.GetScanStore()
+            all_files += store.GetFileCount()
+            for stat in all_stats:
+                count, size = store.GetTotals(stat)
+                sum_stat[stat]['files'] += count
+                sum_stat[stat]['size'] += size
 
         if skip_files:
             for remove_folder in list(skip_files.keys()):
@@ -433,18 +691,21 @@ class FileSyncCommand(uCommand):
                 self.LogMessage(f"[+{color}]- [+BLUE]{stat}[+{color}]: {sum_stat[stat]['files']} files; {uStringFormat.Bytes(sum_stat[stat]['size'])}[+]")
 
     def __perform_synchronization(self, Mode:str, RemoveFiles:dict):
+        if self.snapshot is not None:
+            return self.__perform_snapshot(RemoveFiles)
+
+        journal:SyncJournal = None
+        engine:CopyEngine = None
         try:
             timer = uTimer()
             source_folder:FolderSection = None
             total_file_size = 0
             total_file_count = 0
             for source_folder in self.folderscan.folders:
-                results = source_folder.GetScanResults()
-                for folder in results:
-                    for file in folder['files']:
-                        if file[2] in ['NEW', 'MOD']:
-                            total_file_count += 1
-                            total_file_size += file[1]
+                for stat in ['NEW', 'MOD']:
+                    count, size = source_folder.GetScanStore().GetTotals(stat)
+                    total_file_count += count
+                    total_file_size += size
 
             total_move_file_count = 0
             total_remove_file_count = 0
@@ -457,82 +718,62 @@ class FileSyncCommand(uCommand):
                             case 'REMOVE':
                                 total_remove_file_count += 1
 
+            copy_tasks = self.__copy_tasks() if total_file_count>0 else []
+            move_tasks = []
+            clean_tasks = []
+            if total_move_file_count+total_remove_file_count>0:
+                move_tasks = self.__remove_tasks(RemoveFiles, CopyAction.MOVE)
+                clean_tasks = self.__remove_tasks(RemoveFiles, CopyAction.CLEAN)
+
+            # every planned operation is journaled before the first operation is performed
+            if self.journal_path is not None:
+                copy_tasks, move_tasks, clean_tasks = list(copy_tasks), list(move_tasks), list(clean_tasks)
+                journal = SyncJournal(self.journal_path)
+                journal.Start({'mode':Mode, 'target':self.target_path, 'clean':self.clean_path}, copy_tasks+move_tasks+clean_tasks)
+
             if total_file_count+total_move_file_count+total_remove_file_count==0:
                 self.LogMessage(f"[+GREEN]=== No files found to synchronize[+]")
+                self.__prune_object_store()
+                if journal is not None:
+                    journal.Complete()
                 return True
 
             self.LogMessage(f"[+GREEN]=== Performing {Mode} operation[+]")
             self.LogMessage(f"{total_file_count} files to copy")
             self.LogMessage(f"Copying {uStringFormat.Bytes(total_file_size).replace(' ', '')} total bytes")
             target_device = os.path.splitdrive(self.target_path)[0]
-            _,_,bytes_free = shutil.disk_usage(target_device)
+            _,_,bytes_free = shutil.disk_usage(target_device or self.target_path)
             self.LogMessage(f"Target device is {target_device} ({uStringFormat.Bytes(bytes_free).replace(' ', '')} bytes free)")
             if total_file_size>(bytes_free*0.95):
                 self.LogError(f"Not enough space on device to continue {Mode} operation")
                 return False
 
+            engine = CopyEngine(self, Workers=self.copy_workers, CleanFile=self.__clean_file, DeltaThreshold=self.delta_threshold, Method=self.copy_method, Store=self.store)
             if total_file_count>0:
-                progress_size = 0
-                progress_step = 20
-                progress_next = progress_step
-                for source_folder in self.folderscan.folders:
-                    results = source_folder.GetScanResults()
-                    for folder in results:
-                        for file in folder['files']:
-                            if file[2]=='MOD':
-                                self.__clean_file(folder['target'], file[0])
-
-                            if file[2] in ['NEW', 'MOD']:
-                                source_file = os.path.join(folder['folder'], file[0])
-                                target_file = os.path.join(folder['target'], file[0])
-                                self.LogDetails(f"Copying source file: {source_file}")
-                                if uFolder.ConfirmFolder(folder['target'], True) is False:
-                                    self.LogError(f"Unable to create target folder: {folder['target']}")
-                                retry = 9
-                                while retry>0:
-                                    try:
-                                        shutil.copyfile(source_file, target_file)
-                                        progress_size += file[1]
-                                        if (progress_size*100)/total_file_size>progress_next:
-                                            print(f"{progress_next}%..")
-                                            progress_next += progress_step
-                                        break
-                                    except Exception as e:
-                                        self.LogError(f"Unexpected failure while copying \"{os.path.basename(source_file)}\" (retry={10-retry}): {str(e)}")
-                                    retry -= 1
-                                if retry==0:
-                                    self.LogError(f"Unable to copy file after retries:{source_file}")
-                                    return False
+                if engine.Run(copy_tasks, total_file_size, self.__journal_done(journal, 0)) is False:
+                    return False
+
+            delta_files, delta_bytes = engine.GetDeltaStats()
+            if delta_files>0:
+                self.LogMessage(f"{delta_files} files copied as a delta ({uStringFormat.Bytes(delta_bytes).replace(' ', '')} rewritten)")
+            if self.store is not None:
+                store_stats = self.store.GetStats()
+                self.LogMessage(f"{store_stats['linked_files']} files linked to stored contents ({uStringFormat.Bytes(store_stats['linked_bytes']).replace(' ', '')} not copied)")
 
             if total_move_file_count+total_remove_file_count>0:
-                for folder in list(RemoveFiles.keys()):
-                    for file in RemoveFiles[folder]:
-                        if file[2]=='MOVE':
-                            source_file = os.path.join(folder, file[0])
-                            target_file = os.path.join(file[3], file[0])
-                            if uFolder.ConfirmFolder(file[3], True) is False:
-                                self.LogError(f"Unable to create target folder: {file[3]}")
-                                self.LogError(f"=== {timer.GetElapsedString()}")
-                                return False
-                            else:
-                                self.LogDetails(f"Moving misplaced file: {source_file}")
-                                try:
-                                    shutil.move(source_file, target_file)
-                                except Exception as e:
-                                    self.LogError(f"Failed to move misplaced file:{source_file}: {str(e)}")
-                                    self.LogError(f"=== {timer.GetElapsedString()}")
-                                    return False
-                        elif file[2]=='REMOVE':
-                            if self.__clean_file(folder, file[0]) is False:
-                                self.LogError(f"Failed attempting to clean file: {os.path.join(folder, file[0])}")
-                                self.LogError(f"=== {timer.GetElapsedString()}")
-                                return False
+                # misplaced files are moved before any files are cleaned
+                first_id = len(copy_tasks) if journal is not None else 0
+                for tasks in [move_tasks, clean_tasks]:
+                    if engine.Run(tasks, Completed=self.__journal_done(journal, first_id)) is False:
+                        self.LogError(f"=== {timer.GetElapsedString()}")
+                        return False
+                    if journal is not None:
+                        first_id += len(tasks)
                             
-            # remove empty folders
-            for source_folder in self.folderscan.folders:
-                empty_folders = uFolder.DestroyEmptyFolders(source_folder.GetTargetPath())
-                for folder in empty_folders:
-                    self.LogDetails(f"Destroyed empty folder: {folder}")
+            self.__prune_object_store()
+            self.__destroy_empty_folders()
+            if journal is not None:
+                journal.Complete()
 
             self.LogMessage(f"[+GREEN]=== Completed {Mode} operation ({timer.GetElapsedString()})[+]")
 
@@ -541,18 +782,341 @@ class FileSyncCommand(uCommand):
             self.LogError(f"=== {timer.GetElapsedString()}")
             return False
 
+        finally:
+            if journal is not None:
+                journal.Close()
+            if engine is not None:
+                self.__record_copy_metrics(engine)
+
         return True
+
+    def __perform_snapshot(self, RemoveFiles:dict)->bool:
+        # writes a new snapshot, then renames it when complete and expires the oldest snapshots
+        engine:CopyEngine = None
+        try:
+            timer = uTimer()
+            for path in self.snapshot.DiscardPartial():
+                self.LogWarning(f"Removed partial snapshot of an interrupted run: {path}")
+
+            tasks = list(self.__snapshot_tasks(RemoveFiles))
+            copy_tasks = [task for task in tasks if task[0]==CopyAction.COPY]
+            total_file_size = sum([task[3] for task in copy_tasks])
+            self.LogMessage(f"[+GREEN]=== Performing SNAPSHOT operation[+]")
+            self.LogMessage(f"{len(copy_tasks)} files to copy; {len(tasks)-len(copy_tasks)} files to link from previous snapshot")
+            self.LogMessage(f"Copying {uStringFormat.Bytes(total_file_size).replace(' ', '')} total bytes")
+            target_device = os.path.splitdrive(self.target_path)[0]
+            _,_,bytes_free = shutil.disk_usage(target_device or self.target_path)
+            if total_file_size>(bytes_free*0.95):
+                self.LogError(f"Not enough space on device to continue SNAPSHOT operation")
+                return False
+
+            engine = CopyEngine(self, Workers=self.copy_workers, Method=self.copy_method, Store=self.store)
+            if engine.Run(tasks, total_file_size) is False:
+                self.LogError(f"=== {timer.GetElapsedString()}")
+                return False
+
+            self.snapshot.Complete()
+            if self.keep_snapshots>0:
+                for path in self.snapshot.Expire(self.keep_snapshots):
+                    self.LogMessage(f"Removed expired snapshot: {path}")
+            self.__prune_object_store()
+            self.LogMessage(f"[+GREEN]=== Completed SNAPSHOT operation: {self.snapshot.GetPath()} ({timer.GetElapsedString()})[+]")
+
+        except Exception as e:
+            self.LogError(f"Unexpected failure: {str(e)}")
+            self.LogError(f"=== {timer.GetElapsedString()}")
+            return False
+
+        finally:
+            if engine is not None:
+                self.__record_copy_metrics(engine)
+
+        return True
+
+    def __snapshot_tasks(self, RemoveFiles:dict):
+        # yields copy engine tasks of a new snapshot: NEW and MOD files are copied, and SAME and misplaced files are linked
+        source_folder:FolderSection = None
+        for source_folder in self.folderscan.folders:
+            results = source_folder.GetScanResults()
+            for folder in results:
+                target = self.snapshot.MapPath(folder['target'])
+                for file in folder['files']:
+                    if file[2] in ['NEW', 'MOD']:
+                        yield (CopyAction.COPY, os.path.join(folder['folder'], file[0]), os.path.join(target, file[0]), file[1])
+                    elif file[2]=='SAME':
+                        yield (CopyAction.LINK, os.path.join(folder['target'], file[0]), os.path.join(target, file[0]), file[1])
+
+        if RemoveFiles is not None:
+            for folder in list(RemoveFiles.keys()):
+                for file in RemoveFiles[folder]:
+                    if file[2]=='MOVE':
+                        yield (CopyAction.LINK, os.path.join(folder, file[0]), os.path.join(self.snapshot.MapPath(file[3]), file[0]), file[1])
+
+    def __resume_synchronization(self)->bool|None:
+        # performs operations of an interrupted synchronization that were not completed; returns None when there is nothing to resume
+        journal = SyncJournal(self.journal_path)
+        try:
+            if journal.Load() is False or journal.IsComplete():
+                self.LogMessage(f"No interrupted synchronization to resume: {self.journal_path}")
+                return None
+        except Exception as e:
+            self.LogWarning(f"Unable to read journal, performing a full synchronization: {str(e)}")
+            return None
+
+        plan = journal.GetPlan()
+        if plan.get('target')!=self.target_path or plan.get('clean')!=self.clean_path:
+            self.LogError(f"Journal was written for a different TargetPath or CleanPath: {self.journal_path}")
+            return False
+
+        timer = uTimer()
+        engine:CopyEngine = None
+        try:
+            journal.Reopen()
+            pending = journal.GetPendingTasks()
+            phases = {CopyAction.COPY:[], CopyAction.MOVE:[], CopyAction.CLEAN:[]}
+            for task_id, task in pending:
+                task = (CopyAction(task[0]), task[1], task[2], task[3])
+                if self.__task_performed(task, journal.GetStartTime()):
+                    journal.TaskDone(task_id)
+                else:
+                    phases[CopyAction.COPY if task[0]==CopyAction.MODIFY else task[0]].append((task_id, task))
+
+            total_file_size = sum([task[3] for _, task in phases[CopyAction.COPY]])
+            self.LogMessage(f"[+GREEN]=== Resuming {plan.get('mode')} operation[+]")
+            self.LogMessage(f"{len(pending)} of {journal.GetTaskCount()} operations were not completed")
+            self.LogMessage(f"{len(phases[CopyAction.COPY])} files to copy")
+            self.LogMessage(f"Copying {uStringFormat.Bytes(total_file_size).replace(' ', '')} total bytes")
+            target_device = os.path.splitdrive(self.target_path)[0]
+            _,_,bytes_free = shutil.disk_usage(target_device or self.target_path)
+            if total_file_size>(bytes_free*0.95):
+                self.LogError(f"Not enough space on device to continue {plan.get('mode')} operation")
+                return False
+
+            # copies, then moves, then cleans, as planned
+            engine = CopyEngine(self, Workers=self.copy_workers, CleanFile=self.__clean_file, DeltaThreshold=self.delta_threshold, Method=self.copy_method, Store=self.store)
+            for action, tasks in phases.items():
+                task_ids = [task_id for task_id, _ in tasks]
+                size = total_file_size if action==CopyAction.COPY else 0
+                if engine.Run([task for _, task in tasks], size, lambda index: journal.TaskDone(task_ids[index])) is False:
+                    self.LogError(f"=== {timer.GetElapsedString()}")
+                    return False
+
+            self.__prune_object_store()
+            self.__destroy_empty_folders()
+            journal.Complete()
+            self.LogMessage(f"[+GREEN]=== Completed {plan.get('mode')} operation ({timer.GetElapsedString()})[+]")
+
+        except Exception as e:
+            self.LogError(f"Unexpected failure: {str(e)}")
+            self.LogError(f"=== {timer.GetElapsedString()}")
+            return False
+
+        finally:
+            journal.Close()
+            if engine is not None:
+                self.__record_copy_metrics(engine)
+
+        return True
+
+    def __task_performed(self, Task:tuple, StartTime:float)->bool:
+        # returns True when a pending journal operation was already performed, or can no longer be performed
+        action, source_file, target_file, _ = Task
+        match action:
+            case CopyAction.COPY | CopyAction.MODIFY:
+                if os.path.isfile(source_file) is False:
+                    self.LogWarning(f"Source file no longer exists: {source_file}")
+                    return True
+                # a target file written since the synchronization started, with the size of the source file, was copied
+                return os.path.isfile(target_file) and os.path.getmtime(target_file)>=StartTime and os.path.getsize(target_file)==os.path.getsize(source_file)
+            case CopyAction.MOVE:
+                if os.path.exists(source_file):
+                    return False
+                if os.path.exists(target_file) is False:
+                    self.LogWarning(f"File to move no longer exists: {source_file}")
+                return True
+            case CopyAction.CLEAN:
+                return os.path.exists(target_file) is False
+        return False
+
+    def __journal_done(self, Journal:SyncJournal, FirstId:int):
+        # returns a CopyEngine completion callback that records journal operations from FirstId
+        if Journal is None:
+            return None
+        return lambda index: Journal.TaskDone(FirstId+index)
+
+    def __prune_object_store(self):
+        # removes stored contents that are no longer linked from a target or clean file
+        if self.store is not None:
+            files, size = self.store.Prune()
+            self.metrics.Add('store_pruned_objects', files)
+            self.metrics.Add('store_pruned_bytes', size)
+            if files>0:
+                self.LogMessage(f"Removed {files} unlinked objects from object store ({uStringFormat.Bytes(size).replace(' ', '')})")
+
+    def __destroy_empty_folders(self):
+        source_folder:FolderSection = None
+        for source_folder in self.folderscan.folders:
+            empty_folders = uFolder.DestroyEmptyFolders(source_folder.GetTargetPath())
+            for folder in empty_folders:
+                self.LogDetails(f"Destroyed empty folder: {folder}")
     
-    def __clean_file(self, TargetFolder, FileName):
+    def __copy_tasks(self):
+        # yields copy engine tasks for NEW and MOD files
+        source_folder:FolderSection = None
+        for source_folder in self.folderscan.folders:
+            results = source_folder.GetScanResults()
+            for folder in results:
+                for file in folder['files']:
+                    if file[2] in ['NEW', 'MOD']:
+                        action = CopyAction.MODIFY if file[2]=='MOD' else CopyAction.COPY
+                        yield (action, os.path.join(folder['folder'], file[0]), os.path.join(folder['target'], file[0]), file[1])
+
+    def __remove_tasks(self, RemoveFiles:dict, Action:CopyAction):
+        # yields copy engine tasks for MOVE or REMOVE files
+        for folder in list(RemoveFiles.keys()):
+            for file in RemoveFiles[folder]:
+                if file[2]=='MOVE' and Action==CopyAction.MOVE:
+                    yield (Action, os.path.join(folder, file[0]), os.path.join(file[3], file[0]), file[1])
+                elif file[2]=='REMOVE' and Action==CopyAction.CLEAN:
+                    yield (Action, None, os.path.join(folder, file[0]), file[1])
+
+    def __watch_folders(self):
+        # synchronizes changed source folders until interrupted
+        watch = FolderWatch(Delay=self.watch_delay)
+        top_folders = [folder for folder in self.folderscan.GetFolders() if folder.GetParent() is None]
+
+        # target folders were changed by synchronization, and are walked again
+        target_paths = [folder.GetTargetPath() for folder in top_folders if folder.GetTargetPath() is not None]
+        self.__walk_folders(target_paths)
+
+        for folder in top_folders:
+            watch.AddTree(folder.GetPath())
+        if len(watch.GetFailures())>0:
+            self.LogWarning(f"Unable to watch {len(watch.GetFailures())} folders; increase fs.inotify.max_user_watches")
+
+        self.LogMessage(f"[+GREEN]=== Watching {watch.GetWatchCount()} folders for changes[+]")
+        try:
+            while True:
+                batch = watch.Wait()
+                if batch is not None:
+                    changed, structure, overflow = batch
+                    if overflow:
+                        # subfolders created while events were missed are not yet watched
+                        self.LogWarning("Folder changes were missed; walking all source and target folders")
+                        for folder in top_folders:
+                            watch.AddTree(folder.GetPath())
+                        self.__walk_folders([folder.GetPath() for folder in top_folders] + target_paths)
+                    self.__sync_changes(changed, structure, overflow)
+        except KeyboardInterrupt:
+            self.LogMessage(f"[+GREEN]=== Stopped watching folders[+]")
+        finally:
+            watch.Close()
+
+    def __walk_folders(self, in_paths:list):
+        # discards snapshots of paths and the folders under them, then walks the paths again at the same time
+        for path in in_paths:
+            FolderTree.DiscardTree(path, Recurse=True)
+        scheduler = ScanScheduler()
+        scheduler.Start(in_paths)
+        scheduler.Join()
+
+    def __sync_changes(self, Changed:set, Structure:set, Overflow:bool):
+        # scans changed source folders, then copies NEW and MOD files and cleans removed files of those folders
+        timer = uTimer()
+        changed = set([path for path in Changed if self.__ignore_path(path) is False])
+        structure = set([path for path in Structure if self.__ignore_path(path) is False])
+        if Overflow:
+            # source and target folders were walked again by __watch_folders()
+            changed = set([folder.GetPath() for folder in self.folderscan.GetFolders()])
+            structure = set(changed)
+        else:
+            for path in sorted(changed):
+                if FolderTree.RefreshFolder(path):
+                    structure.add(path)
+        if len(changed)==0:
+            return
+
+        self.LogMessage(f"[+GREEN]=== Synchronizing {len(changed)} changed folders[+]")
+
+        # folder sections are scanned again; a change in subfolders evaluates folder rules again
+        results = []
+        folder:FolderSection = None
+        for folder in self.folderscan.GetFolders():
+            folder_changed = set([path for path in changed if self.__section_of(path) is folder])
+            if len(folder_changed)>0:
+                folder_structure = any([self.__section_of(path) is folder for path in structure])
+                results.extend(self.folderscan.RescanFolders(folder, folder_changed, folder_structure))
+
+        # target files that are not in a changed source folder are removed
+        # when subfolders changed, target folders under the changed folder are checked
+        remove_files = {}
+        if self.mode=="SYNC":
+            check_folders = {}
+            for result in results:
+                if result['target'] is not None and (Overflow or result['folder'] in changed or result['folder'] in structure):
+                    check_folders[result['target']] = check_folders.get(result['target'], False) or Overflow or result['folder'] in structure
+            for path in structure:
+                section = self.__section_of(path)
+                if section is not None and section.GetTargetPath() is not None:
+                    relpath = os.path.relpath(path, section.GetPath())
+                    check_folders[section.GetTargetPath() if relpath=='.' else os.path.join(section.GetTargetPath(), relpath)] = True
+
+            for target_path, recurse in check_folders.items():
+                tree = FolderTree.GetTree(target_path)
+                target_folders = tree.WalkFiles(target_path) if recurse else [(target_path, tree.FindFiles(target_path))]
+                for folder_path, folder_files in target_folders:
+                    if folder_path in remove_files or self.__ignore_path(folder_path, IncludeTarget=True):
+                        continue
+                    section = self.__section_of(folder_path, Target=True)
+                    names = None if section is None else section.GetScanNames(TargetFolder=folder_path)
+                    files = [(name, fstat[0], 'REMOVE') for name, fstat in folder_files.items() if names is None or name not in names]
+                    if len(files)>0:
+                        remove_files[folder_path] = files
+
+        tasks = []
+        for result in results:
+            for file in result['files']:
+                if file[2] in ['NEW', 'MOD']:
+                    action = CopyAction.MODIFY if file[2]=='MOD' else CopyAction.COPY
+                    tasks.append((action, os.path.join(result['folder'], file[0]), os.path.join(result['target'], file[0]), file[1]))
+
+        engine = CopyEngine(self, Workers=self.copy_workers, CleanFile=self.__clean_file, DeltaThreshold=self.delta_threshold, Method=self.copy_method, Store=self.store)
+        success = engine.Run(tasks, sum([task[3] for task in tasks]))
+        if success:
+            success = engine.Run(self.__remove_tasks(remove_files, CopyAction.CLEAN))
+
+        # target folders are listed again, so that the next scan compares to copied files
+        for result in results:
+            if result['target'] is not None:
+                FolderTree.RefreshFolder(result['target'])
+
+        remove_count = sum([len(files) for files in remove_files.values()])
+        if success:
+            self.LogMessage(f"[+GREEN]=== Completed: {len(tasks)} files copied, {remove_count} files cleaned ({timer.GetElapsedString()})[+]")
+        else:
+            self.LogError(f"=== {timer.GetElapsedString()}")
+
+    def __section_of(self, in_path, Target=False)->FolderSection|None:
+        # returns the folder section that scans a source folder, or that copies to a target folder
+        section = None
+        for folder in self.folderscan.GetFolders():
+            path = folder.GetTargetPath() if Target else folder.GetPath()
+            if path is not None and SyncUtils.PathIsUnder(path, in_path, SameIsUnder=True, Normalized=True):
+                if section is None or len(path)>len(section.GetTargetPath() if Target else section.GetPath()):
+                    section = folder
+        return section
+
+    def __clean_file(self, TargetFolder, FileName, Messages:list):
+        # called by CopyEngine workers; messages are added to Messages as (level, message), and logged in task order
         if self.clean_path is None:
-            self.LogError(f"CleanPath was not configured")
+            Messages.append((uLoggerLevel.ERROR, f"CleanPath was not configured"))
             return False
 
         rel_path = os.path.relpath(TargetFolder, self.target_path)
         clean_path = os.path.join(self.clean_path, rel_path)
         confirmed = uFolder.ConfirmFolder(clean_path,Create=True)
         if confirmed is False:
-            self.LogError(f"Unable to create clean folder: {clean_path}")
+            Messages.append((uLoggerLevel.ERROR, f"Unable to create clean folder: {clean_path}"))
         clean_file = os.path.join(clean_path, FileName)
         sext = os.path.splitext(clean_file)
         if os.path.exists(clean_file):
@@ -561,11 +1125,11 @@ class FileSyncCommand(uCommand):
             while os.path.exists(clean_file):
                 index += 1
                 clean_file = f"{sext[0]}-{index:03d}{sext[1]}"
-            self.LogDetails(f"Clean file exists, using temporary filename: {clean_file}")
+            Messages.append((uLoggerLevel.DETAILS, f"Clean file exists, using temporary filename: {clean_file}"))
         target_file = os.path.join(TargetFolder, FileName)
-        self.LogDetails(f"Cleaning target file: {target_file}")
+        Messages.append((uLoggerLevel.DETAILS, f"Cleaning target file: {target_file}"))
         shutil.move(target_file, clean_file)
-        return True
+        return clean_file
     
     def __string_format(self, inString):
         inString = inString.replace("{YMD}", self._ymd)
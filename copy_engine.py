@@ -0,0 +1,338 @@
+# Copyright (c) 2025 M. Fairbanks
+#
+# This source code is licensed under the Apache License, Version 2.0, found in the
+# LICENSE file in the root directory of this source tree.
+
+from m9lib import uCommand, uLoggerLevel
+
+import os, errno, shutil, threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from enum import IntEnum
+
+from file_copy import *
+from object_store import *
+
+'''
+A CopyEngine performs file operations of a synchronization on a pool of worker threads.
+
+A task is a tuple of (action, source file, target file, size):
+- COPY: copy source file to target file, with retry
+- MODIFY: clean the existing target file, then copy source file to target file
+  - With a delta threshold, a large file is written from the cleaned file, rewriting only blocks that differ from the source file;
+    with a reflink of the cleaned file, blocks are rewritten in place, and otherwise matching ranges are copied from the cleaned file
+- File data is copied by a FileCopier, with the fastest method available, such as a reflink or copy_file_range
+- With an object store, a copied file is stored once by content and the target file is a hardlink; delta copies are not used
+- MOVE: move source file to target file
+- CLEAN: move target file to the clean path; source file is not used
+- LINK: hardlink target file to source file, such as a file of a previous snapshot; copied when a hardlink is not supported
+
+Results are consumed in task order, so log messages, completion callbacks and the reported failure do not depend on worker timing.
+When a task fails, no further tasks are started and Run() returns False once running tasks complete.
+'''
+
+class CopyAction(IntEnum):
+    COPY = 1        # copy source to target
+    MODIFY = 2      # clean target, then copy source to target
+    MOVE = 3        # move source to target
+    CLEAN = 4       # move target to clean path
+    LINK = 5        # hardlink target to source
+
+class CopyEngine:
+    BlockSize = 1024*1024
+
+    def __init__(self, Command:uCommand, Workers:int=1, Retries:int=9, CleanFile=None, DeltaThreshold:int=None, Method:CopyMethod=CopyMethod.AUTO, Store:ObjectStore=None):
+        # messages are logged through Command
+        # CleanFile(TargetFolder, FileName, Messages)->str|bool moves a target file to the clean path, returning the clean file path
+        # messages of CleanFile are added to Messages as (level, message), and logged with the messages of the task
+        # MOD files of at least DeltaThreshold bytes are copied as a delta of the cleaned file
+        self.command = Command
+        self.workers = max(1, Workers)
+        self.retries = Retries
+        self.clean_file = CleanFile
+        self.delta_threshold = DeltaThreshold
+        self.copier = FileCopier(Method)
+        self.store = Store
+        self.progress_lock = threading.Lock()
+        self.clean_lock = threading.Lock()
+        self.total_size = 0
+        self.progress_size = 0
+        self.progress_step = 20
+        self.progress_next = self.progress_step
+        self.copied_files = 0
+        self.copied_bytes = 0
+        self.moved_files = 0
+        self.cleaned_files = 0
+        self.linked_files = 0
+        self.retry_count = 0
+        self.delta_files = 0
+        self.delta_bytes = 0
+        self.method_counts = {}     # CopyMethod: [files, bytes]
+
+    def GetCopiedFiles(self)->int:
+        return self.copied_files
+
+    def GetCopiedBytes(self)->int:
+        return self.copied_bytes
+
+    def GetMovedFiles(self)->int:
+        return self.moved_files
+
+    def GetCleanedFiles(self)->int:
+        return self.cleaned_files
+
+    def GetLinkedFiles(self)->int:
+        return self.linked_files
+
+    def GetRetryCount(self)->int:
+        return self.retry_count
+
+    def GetDeltaStats(self)->tuple:
+        # returns (files copied as a delta, bytes written by delta copies)
+        return (self.delta_files, self.delta_bytes)
+
+    def GetMethodCounts(self)->dict:
+        # returns {CopyMethod: (files, bytes)} of files copied with each method
+        return {method:tuple(counts) for method, counts in self.method_counts.items()}
+
+    def Run(self, Tasks, TotalSize:int=0, Completed=None)->bool:
+        # performs tasks; returns False after the first failure
+        # Completed(Index) is called with the position of each task that succeeds, in task order
+        self.total_size = TotalSize
+        if self.workers==1:
+            for index, task in enumerate(Tasks):
+                if self.__report(self.__perform(task), index, Completed) is False:
+                    return False
+            return True
+
+        success = True
+        pending = deque()
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for index, task in enumerate(Tasks):
+                if len(pending)>=self.workers*4:
+                    future, future_index = pending.popleft()
+                    if self.__report(future.result(), future_index, Completed) is False:
+                        success = False
+                        break
+                pending.append((executor.submit(self.__perform, task), index))
+
+            if success is False:
+                for future, _ in pending:
+                    future.cancel()
+
+            for future, index in pending:
+                if future.cancelled() is False and self.__report(future.result(), index, Completed) is False:
+                    success = False
+
+        return success
+
+    def __report(self, in_result, in_index, in_completed)->bool:
+        # logs messages of a completed task, in task order
+        success, messages = in_result
+        for level, message in messages:
+            match level:
+                case uLoggerLevel.DETAILS:
+                    self.command.LogDetails(message)
+                case uLoggerLevel.WARNING:
+                    self.command.LogWarning(message)
+                case uLoggerLevel.ERROR:
+                    self.command.LogError(message)
+                case _:
+                    self.command.LogMessage(message)
+        if success and in_completed is not None:
+            in_completed(in_index)
+        return success
+
+    def __perform(self, in_task)->tuple:
+        # returns (success, [(level, message)])
+        action, source_file, target_file, size = in_task
+        messages = []
+        try:
+            match action:
+                case CopyAction.COPY | CopyAction.MODIFY:
+                    basis_file = None
+                    if action==CopyAction.MODIFY:
+                        with self.clean_lock:
+                            clean_file = self.clean_file(os.path.dirname(target_file), os.path.basename(target_file), messages)
+                        if self.delta_threshold is not None and self.store is None and size>=self.delta_threshold and isinstance(clean_file, str):
+                            basis_file = clean_file
+                    messages.append((uLoggerLevel.DETAILS, f"Copying source file: {source_file}"))
+                    if CopyEngine.ConfirmFolder(os.path.dirname(target_file)) is False:
+                        messages.append((uLoggerLevel.ERROR, f"Unable to create target folder: {os.path.dirname(target_file)}"))
+                    if basis_file is not None and self.__delta_file(source_file, basis_file, target_file, size, messages):
+                        return (True, messages)
+                    return (self.__copy_file(source_file, target_file, size, messages), messages)
+                case CopyAction.MOVE:
+                    if CopyEngine.ConfirmFolder(os.path.dirname(target_file)) is False:
+                        messages.append((uLoggerLevel.ERROR, f"Unable to create target folder: {os.path.dirname(target_file)}"))
+                        return (False, messages)
+                    messages.append((uLoggerLevel.DETAILS, f"Moving misplaced file: {source_file}"))
+                    try:
+                        shutil.move(source_file, target_file)
+                    except Exception as e:
+                        messages.append((uLoggerLevel.ERROR, f"Failed to move misplaced file:{source_file}: {str(e)}"))
+                        return (False, messages)
+                    with self.progress_lock:
+                        self.moved_files += 1
+                case CopyAction.LINK:
+                    if CopyEngine.ConfirmFolder(os.path.dirname(target_file)) is False:
+                        messages.append((uLoggerLevel.ERROR, f"Unable to create target folder: {os.path.dirname(target_file)}"))
+                        return (False, messages)
+                    try:
+                        method = self.copier.Link(source_file, target_file)
+                    except Exception as e:
+                        messages.append((uLoggerLevel.ERROR, f"Failed to link file:{source_file}: {str(e)}"))
+                        return (False, messages)
+                    if method is None:
+                        with self.progress_lock:
+                            self.linked_files += 1
+                    else:
+                        messages.append((uLoggerLevel.DETAILS, f"Copied file that could not be linked: {source_file}"))
+                        self.__progress(size, method)
+                case CopyAction.CLEAN:
+                    with self.clean_lock:
+                        cleaned = self.clean_file(os.path.dirname(target_file), os.path.basename(target_file), messages)
+                    if cleaned is False:
+                        messages.append((uLoggerLevel.ERROR, f"Failed attempting to clean file: {target_file}"))
+                        return (False, messages)
+                    with self.progress_lock:
+                        self.cleaned_files += 1
+        except Exception as e:
+            messages.append((uLoggerLevel.ERROR, f"Unexpected failure: {str(e)}"))
+            return (False, messages)
+
+        return (True, messages)
+
+    def __copy_file(self, in_source, in_target, in_size, in_messages)->bool:
+        for attempt in range(1, self.retries+1):
+            try:
+                if self.store is None:
+                    method = self.copier.Copy(in_source, in_target)
+                else:
+                    method = self.store.StoreFile(in_source, in_target, self.copier)
+                self.__progress(in_size, method)
+                return True
+            except Exception as e:
+                in_messages.append((uLoggerLevel.ERROR, f"Unexpected failure while copying \"{os.path.basename(in_source)}\" (retry={attempt}): {str(e)}"))
+                with self.progress_lock:
+                    self.retry_count += 1
+
+        in_messages.append((uLoggerLevel.ERROR, f"Unable to copy file after retries:{in_source}"))
+        return False
+
+    def __delta_file(self, in_source, in_basis, in_target, in_size, in_messages)->bool:
+        # writes the target file from the basis file, rewriting only blocks that differ from the source file
+        try:
+            if self.copier.Clone(in_basis, in_target):
+                method = CopyMethod.REFLINK
+                changed, size = self.__rewrite_blocks(in_source, in_target)
+            else:
+                method, changed, size = self.__merge_blocks(in_source, in_basis, in_target)
+            self.__progress(in_size, method)
+            with self.progress_lock:
+                self.delta_files += 1
+                self.delta_bytes += changed
+            in_messages.append((uLoggerLevel.DETAILS, f"Delta copy rewrote {changed} of {size} bytes ({method.name}): {in_target}"))
+            return True
+        except Exception as e:
+            in_messages.append((uLoggerLevel.WARNING, f"Delta copy failed, copying entire file \"{os.path.basename(in_source)}\": {str(e)}"))
+        return False
+
+    def __rewrite_blocks(self, in_source, in_target)->tuple:
+        # the target file is a reflink of the basis file; blocks that differ from the source file are rewritten in place
+        # returns (bytes rewritten, size)
+        offset = 0
+        changed = 0
+        with open(in_source, 'rb') as source, open(in_target, 'r+b') as target:
+            while True:
+                block = source.read(CopyEngine.BlockSize)
+                if len(block)==0:
+                    break
+                if target.read(len(block))!=block:
+                    target.seek(offset)
+                    target.write(block)
+                    changed += len(block)
+                offset += len(block)
+            target.truncate(offset)
+        return (changed, offset)
+
+    def __merge_blocks(self, in_source, in_basis, in_target)->tuple:
+        # writes a new target file from blocks of the source file that differ, and ranges of the basis file that match
+        # matching ranges are copied with copy_file_range where available, so the file system may share or copy them
+        # without reading them again; otherwise matching blocks are written as read
+        # returns (method, bytes rewritten, size)
+        use_range = CopyMethod.COPY_FILE_RANGE in self.copier.methods
+        offset = 0
+        changed = 0
+        match_start = 0
+        with open(in_source, 'rb') as source, open(in_basis, 'rb') as basis, open(in_target, 'wb') as target:
+            while True:
+                block = source.read(CopyEngine.BlockSize)
+                if len(block)==0:
+                    break
+                same = basis.read(len(block))==block
+                if same is False:
+                    changed += len(block)
+                if use_range is False:
+                    target.write(block)
+                elif same is False:
+                    use_range = CopyEngine.__copy_range(basis, target, match_start, offset-match_start)
+                    target.write(block)
+                    match_start = offset+len(block)
+                offset += len(block)
+            if use_range:
+                use_range = CopyEngine.__copy_range(basis, target, match_start, offset-match_start)
+        return (CopyMethod.COPY_FILE_RANGE if use_range else CopyMethod.COPYFILE, changed, offset)
+
+    @staticmethod
+    def __copy_range(in_basis, in_target, in_offset, in_length)->bool:
+        # appends a range of the basis file to the target file; returns False when copy_file_range was not supported,
+        # in which case the range is copied by reading it
+        if in_length==0:
+            return True
+        in_target.flush()
+        copied = 0
+        try:
+            while copied<in_length:
+                count = os.copy_file_range(in_basis.fileno(), in_target.fileno(), in_length-copied, in_offset+copied, in_offset+copied)
+                if count==0:
+                    raise OSError(errno.EIO, "Basis file ended during copy")
+                copied += count
+            in_target.seek(in_offset+in_length)
+            return True
+        except OSError as e:
+            if e.errno not in FileCopier.Unsupported:
+                raise
+        position = in_basis.tell()
+        in_basis.seek(in_offset+copied)
+        in_target.seek(in_offset+copied)
+        remaining = in_length-copied
+        while remaining>0:
+            block = in_basis.read(min(CopyEngine.BlockSize, remaining))
+            in_target.write(block)
+            remaining -= len(block)
+        in_basis.seek(position)
+        return False
+
+    def __progress(self, in_size, in_method=None):
+        with self.progress_lock:
+            self.copied_files += 1
+            self.copied_bytes += in_size
+            if in_method is not None:
+                counts = self.method_counts.setdefault(in_method, [0, 0])
+                counts[0] += 1
+                counts[1] += in_size
+            self.progress_size += in_size
+            if self.total_size>0:
+                while (self.progress_size*100)/self.total_size>self.progress_next:
+                    print(f"{self.progress_next}%..")
+                    self.progress_next += self.progress_step
+
+    @staticmethod
+    def ConfirmFolder(Folderpath)->bool:
+        # creates a folder; safe when several workers create the same folder
+        try:
+            os.makedirs(Folderpath, exist_ok=True)
+            return True
+        except OSError:
+            return False
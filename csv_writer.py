@@ -0,0 +1,64 @@
+# Copyright (c) 2025 M. Fairbanks
+#
+# This source code is licensed under the Apache License, Version 2.0, found in the
+# LICENSE file in the root directory of this source tree.
+
+import gzip
+
+'''
+A CSVStreamWriter writes CSV rows to disk as they are produced, rather than collecting a report in memory.
+
+Rows are held in a buffer of at most BufferRows rows.  Output format matches uCSV.WriteFile():
+- A header row of column names
+- Values are converted with str() and joined by commas
+- A string value containing a comma is wrapped in double quotes
+
+A filepath ending in ".gz" is written with gzip compression.
+'''
+
+class CSVStreamWriter:
+    def __init__(self, Filepath:str, Columns:list, BufferRows:int=1000):
+        self.filepath = Filepath
+        self.column_count = len(Columns)
+        self.buffer_rows = max(1, BufferRows)
+        self.buffer = []
+        self.row_count = 0
+        if Filepath.lower().endswith(".gz"):
+            self.file = gzip.open(Filepath, 'wt', encoding='utf-8')
+        else:
+            self.file = open(Filepath, 'w', encoding='utf-8')
+        self.__write_lines([",".join(Columns)])
+
+    def GetFilepath(self)->str:
+        return self.filepath
+
+    def GetRowCount(self)->int:
+        return self.row_count
+
+    def WriteRow(self, Row:list)->bool:
+        # returns False if the row does not match the column count
+        if len(Row)!=self.column_count:
+            return False
+        self.buffer.append(",".join([f"\"{r}\"" if (isinstance(r, str) and ',' in r) else str(r) for r in Row]))
+        self.row_count += 1
+        if len(self.buffer)>=self.buffer_rows:
+            self.Flush()
+        return True
+
+    def Flush(self):
+        if len(self.buffer)>0:
+            self.__write_lines(self.buffer)
+            self.buffer = []
+
+    def Close(self)->int:
+        # returns the number of rows written
+        if self.file is not None:
+            try:
+                self.Flush()
+            finally:
+                self.file.close()
+                self.file = None
+        return self.row_count
+
+    def __write_lines(self, in_lines):
+        self.file.write("\n".join(in_lines) + "\n")
@@ -0,0 +1,104 @@
+# Copyright (c) 2025 M. Fairbanks
+#
+# This source code is licensed under the Apache License, Version 2.0, found in the
+# LICENSE file in the root directory of this source tree.
+
+import os, hashlib, mmap, threading
+from concurrent.futures import ThreadPoolExecutor
+from enum import IntEnum
+
+'''
+CompareMode determines how a source file is compared to an existing target file:
+- SIZE: files are the same when the size is the same
+- MTIME: files are the same when the size is the same and the source file is not newer than the target file
+- HASH: files are the same when the size and content hash are the same
+
+A FileHasher computes content hashes on a pool of worker threads.  Hashes are cached by (path, size, mtime, inode),
+so a file is hashed at most once while it is unchanged.  When a ScanCache is provided, hashes are kept between runs.
+'''
+
+class CompareMode(IntEnum):
+    SIZE = 1        # compare size
+    MTIME = 2       # compare size and modification time
+    HASH = 3        # compare size and content hash
+
+class FileHasher:
+    BufferSize = 1024*1024
+    MmapSize = 16*1024*1024
+    MtimeTolerance = 2.0    # seconds; FAT file systems store modification time in 2 second units
+
+    def __init__(self, Workers:int=None, Cache=None):
+        self.workers = Workers if Workers else min(8, os.cpu_count() or 1)
+        self.cache = Cache
+        self.hashes = {}
+        self.lock = threading.Lock()
+        self.hashed_files = 0
+        self.hashed_bytes = 0
+
+    def GetStats(self)->tuple:
+        # returns (files hashed, bytes hashed); cached hashes are not counted
+        return (self.hashed_files, self.hashed_bytes)
+
+    def HashFiles(self, Filepaths:list)->dict:
+        # returns {filepath: digest}; digest is None when a file could not be read
+        filepaths = list(dict.fromkeys(Filepaths))
+        if self.workers==1 or len(filepaths)<2:
+            return {f:self.GetHash(f) for f in filepaths}
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            digests = executor.map(self.GetHash, filepaths)
+            return dict(zip(filepaths, digests))
+
+    def GetHash(self, Filepath:str)->str|None:
+        try:
+            stat = os.stat(Filepath)
+        except OSError:
+            return None
+
+        key = (Filepath, stat.st_size, stat.st_mtime_ns, stat.st_ino)
+        with self.lock:
+            if key in self.hashes:
+                return self.hashes[key]
+        if self.cache is not None:
+            digest = self.cache.GetHash(*key)
+            if digest is not None:
+                with self.lock:
+                    self.hashes[key] = digest
+                return digest
+
+        digest = FileHasher.HashFile(Filepath, stat.st_size)
+        if digest is not None:
+            with self.lock:
+                self.hashes[key] = digest
+                self.hashed_files += 1
+                self.hashed_bytes += stat.st_size
+            if self.cache is not None:
+                self.cache.SetHash(*key, digest)
+        return digest
+
+    @staticmethod
+    def HashFile(Filepath:str, Size:int=None)->str|None:
+        # large files are mapped into memory; hashlib releases the GIL while hashing
+        try:
+            if Size is None:
+                Size = os.path.getsize(Filepath)
+            h = hashlib.blake2b(digest_size=20)
+            with open(Filepath, 'rb') as file:
+                if Size>=FileHasher.MmapSize:
+                    with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                        h.update(mm)
+                else:
+                    buffer = bytearray(FileHasher.BufferSize)
+                    view = memoryview(buffer)
+                    while True:
+                        n = file.readinto(buffer)
+                        if n==0:
+                            break
+                        h.update(view[:n])
+            return h.hexdigest()
+        except (OSError, ValueError):
+            return None
+
+    @staticmethod
+    def IsNewer(SourceMtime:float, TargetMtime:float)->bool:
+        return SourceMtime > TargetMtime + FileHasher.MtimeTolerance
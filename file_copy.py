@@ -0,0 +1,131 @@
+# Copyright (c) 2025 M. Fairbanks
+#
+# This source code is licensed under the Apache License, Version 2.0, found in the
+# LICENSE file in the root directory of this source tree.
+
+import os, errno, shutil, threading
+from enum import IntEnum
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+'''
+A FileCopier copies file data with the fastest primitive available for each source and target.
+
+Methods are tried in this order, starting from the configured method:
+- REFLINK: FICLONE ioctl; the target shares the blocks of the source, on Btrfs, XFS and other file systems with reflinks
+- COPY_FILE_RANGE: data is copied by the kernel, or by the file system or server where supported
+- SENDFILE: data is copied by the kernel, without userspace buffers
+- COPYFILE: shutil.copyfile
+
+When a method is not supported for a pair of devices, such as a reflink between file systems, the next method is
+used, and the method is not tried again for that pair of devices.  REFLINK, COPY_FILE_RANGE and SENDFILE are
+available on Linux; other systems use COPYFILE.  As with shutil.copyfile, only file data is copied.
+
+Link() creates a hardlink, and copies the file when a hardlink is not supported, such as when a file has too many links.
+Clone() creates a reflink only, and does not copy data when a reflink is not supported.
+'''
+
+class CopyMethod(IntEnum):
+    AUTO = 0                # fastest available
+    REFLINK = 1             # FICLONE, then COPY_FILE_RANGE, SENDFILE, COPYFILE
+    COPY_FILE_RANGE = 2     # os.copy_file_range, then SENDFILE, COPYFILE
+    SENDFILE = 3            # os.sendfile, then COPYFILE
+    COPYFILE = 4            # shutil.copyfile
+
+class FileCopier:
+    FICLONE = getattr(fcntl, 'FICLONE', 0x40049409)
+    ChunkSize = 1024*1024*1024
+    Unsupported = {errno.ENOSYS, errno.ENOTTY, errno.EXDEV, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOTSUP}
+    LinkUnsupported = {errno.EMLINK, errno.EXDEV, errno.EPERM, errno.EOPNOTSUPP, errno.ENOTSUP}
+
+    def __init__(self, Method:CopyMethod=CopyMethod.AUTO):
+        self.methods = [method for method in CopyMethod if method!=CopyMethod.AUTO and method>=Method and FileCopier.IsAvailable(method)]
+        self.lock = threading.Lock()
+        self.unsupported = set()    # (method, source device, target device)
+
+    def Copy(self, Source:str, Target:str)->CopyMethod:
+        # copies file data; returns the method used
+        if self.methods[0]==CopyMethod.COPYFILE:
+            shutil.copyfile(Source, Target)
+            return CopyMethod.COPYFILE
+
+        with open(Source, 'rb') as source:
+            source_stat = os.fstat(source.fileno())
+            if os.path.exists(Target) and os.path.samestat(source_stat, os.stat(Target)):
+                raise shutil.SameFileError(f"{Source} and {Target} are the same file")
+            with open(Target, 'wb') as target:
+                devices = (source_stat.st_dev, os.fstat(target.fileno()).st_dev)
+                for method in self.methods:
+                    if method==CopyMethod.COPYFILE:
+                        break
+                    if (method, *devices) in self.unsupported:
+                        continue
+                    try:
+                        self.__copy(method, source.fileno(), target.fileno())
+                        return method
+                    except OSError as e:
+                        if e.errno not in FileCopier.Unsupported or os.fstat(target.fileno()).st_size>0:
+                            raise
+                        with self.lock:
+                            self.unsupported.add((method, *devices))
+                        os.lseek(source.fileno(), 0, os.SEEK_SET)
+
+        shutil.copyfile(Source, Target)
+        return CopyMethod.COPYFILE
+
+    def Clone(self, Source:str, Target:str)->bool:
+        # creates Target as a reflink of Source; returns False when a reflink is not supported, without copying data
+        if CopyMethod.REFLINK not in self.methods:
+            return False
+        with open(Source, 'rb') as source, open(Target, 'wb') as target:
+            devices = (os.fstat(source.fileno()).st_dev, os.fstat(target.fileno()).st_dev)
+            if (CopyMethod.REFLINK, *devices) in self.unsupported:
+                return False
+            try:
+                self.__copy(CopyMethod.REFLINK, source.fileno(), target.fileno())
+                return True
+            except OSError as e:
+                if e.errno not in FileCopier.Unsupported:
+                    raise
+                with self.lock:
+                    self.unsupported.add((CopyMethod.REFLINK, *devices))
+        return False
+
+    def Link(self, Source:str, Target:str)->CopyMethod|None:
+        # links Target to Source; returns None when linked, or the method used to copy Source
+        try:
+            os.link(Source, Target)
+            return None
+        except OSError as e:
+            if e.errno not in FileCopier.LinkUnsupported:
+                raise
+        return self.Copy(Source, Target)
+
+    def __copy(self, in_method, in_source, in_target):
+        match in_method:
+            case CopyMethod.REFLINK:
+                fcntl.ioctl(in_target, FileCopier.FICLONE, in_source)
+            case CopyMethod.COPY_FILE_RANGE:
+                while os.copy_file_range(in_source, in_target, FileCopier.ChunkSize)>0:
+                    pass
+            case CopyMethod.SENDFILE:
+                offset = 0
+                while True:
+                    sent = os.sendfile(in_target, in_source, offset, FileCopier.ChunkSize)
+                    if sent==0:
+                        break
+                    offset += sent
+
+    @staticmethod
+    def IsAvailable(Method:CopyMethod)->bool:
+        match Method:
+            case CopyMethod.REFLINK:
+                return fcntl is not None and os.name=="posix" and os.uname().sysname=="Linux"
+            case CopyMethod.COPY_FILE_RANGE:
+                return hasattr(os, 'copy_file_range')
+            case CopyMethod.SENDFILE:
+                return hasattr(os, 'sendfile') and os.uname().sysname=="Linux"
+        return True
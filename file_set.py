@@ -7,8 +7,10 @@ from m9lib import uFolder, uStringFormat
 
 from sync_utils import *
 from folder_set import *
+from folder_tree import *
+from rule_profile import *
 
-import re, fnmatch
+import re, fnmatch, time
 from enum import IntEnum
 
 '''
@@ -36,6 +38,202 @@ class FileSetCondition(IntEnum):
     SIZE_LT = 7     # file size less than or equal to
     PARENT = 8      # parent folder name
 
+class FileRule:
+    # a compiled file rule; all conditions must be satisfied
+    # folder conditions (TAG, NTAG, NO_TAG, PARENT) are tested once per folder, then name and size conditions per file
+
+    def __init__(self, Index:int, Conditions:list):
+        self.index = Index
+        self.conditions = Conditions
+        self.valid = True
+        self.name_patterns = []
+        self.parent_patterns = []
+        self.tags_required = set()
+        self.tags_excluded = set()
+        self.no_tag = False
+        self.size_gt = None
+        self.size_lt = None
+        self.tests = []         # (condition text, folder condition, test), for profiling
+
+        for part in Conditions:
+            match part['cond']:
+                case FileSetCondition.MASK:
+                    self.name_patterns.append(SyncUtils.MaskPattern(part['mask']))
+                    self.tests.append((part['mask'], False, lambda name, size, test=re.compile(self.name_patterns[-1]): test.match(name)))
+                case FileSetCondition.REGEX:
+                    if part['regex'].groups==0 and part['regex'].flags==re.UNICODE:
+                        self.name_patterns.append(f"(?:{part['regex'].pattern})")
+                    else:
+                        self.name_patterns.append(part['regex'])
+                    self.tests.append((f"REGEX:{part['regex'].pattern}", False, lambda name, size, test=part['regex']: test.match(name)))
+                case FileSetCondition.TAG:
+                    self.tags_required.add(part['tag'])
+                    self.tests.append((f"TAG:{part['tag']}", True, lambda parent, tags, tag=part['tag']: tag in tags))
+                case FileSetCondition.NTAG:
+                    self.tags_excluded.add(part['tag'])
+                    self.tests.append((f"NTAG:{part['tag']}", True, lambda parent, tags, tag=part['tag']: tag not in tags))
+                case FileSetCondition.NO_TAG:
+                    self.no_tag = True
+                    self.tests.append(("NO_TAG", True, lambda parent, tags: len(tags)==0))
+                case FileSetCondition.PARENT:
+                    self.parent_patterns.append(re.compile(SyncUtils.MaskPattern(part['name'])))
+                    self.tests.append((f"PARENT:{part['name']}", True, lambda parent, tags, test=self.parent_patterns[-1]: test.match(parent)))
+                case FileSetCondition.SIZE_GT:
+                    self.size_gt = part['bytes'] if self.size_gt is None else max(self.size_gt, part['bytes'])
+                    self.tests.append((f"SIZE_GT:{part['bytes']}", False, lambda name, size, limit=part['bytes']: size is not None and size is not False and size>limit))
+                case FileSetCondition.SIZE_LT:
+                    self.size_lt = part['bytes'] if self.size_lt is None else min(self.size_lt, part['bytes'])
+                    self.tests.append((f"SIZE_LT:{part['bytes']}", False, lambda name, size, limit=part['bytes']: size is not None and size is not False and size<=limit))
+                case _: # unknown condition
+                    self.valid = False
+
+        self.text = "|".join([test[0] for test in self.tests])
+
+        self.tags_required = frozenset(self.tags_required)
+        self.tags_excluded = frozenset(self.tags_excluded)
+        self.name_tests = [p if isinstance(p, re.Pattern) else re.compile(p) for p in self.name_patterns]
+
+    def HasSizeConditions(self)->bool:
+        return self.size_gt is not None or self.size_lt is not None
+
+    def IsMergeable(self)->bool:
+        # a rule tested by a single name pattern can be merged with other rules into one regular expression
+        return len(self.name_patterns)==1 and isinstance(self.name_patterns[0], str) and self.HasSizeConditions() is False
+
+    def TestFolder(self, ParentName:str, Tags:set)->bool:
+        if self.valid is False:
+            return False
+        if self.no_tag and len(Tags)>0:
+            return False
+        if self.tags_required and self.tags_required.issubset(Tags) is False:
+            return False
+        if self.tags_excluded and self.tags_excluded.isdisjoint(Tags) is False:
+            return False
+        for parent in self.parent_patterns:
+            if parent.match(ParentName) is None:
+                return False
+        return True
+
+    def TestFile(self, Name:str, Size:int|None)->bool:
+        for name_test in self.name_tests:
+            if name_test.match(Name) is None:
+                return False
+        if self.size_gt is not None and (Size is None or Size is False or Size<=self.size_gt):
+            return False
+        if self.size_lt is not None and (Size is None or Size is False or Size>self.size_lt):
+            return False
+        return True
+
+    def ProfileFolder(self, ParentName:str, Tags:set, Stats:dict, Profile:RuleProfile)->bool:
+        # TestFolder(), evaluating and timing one condition at a time
+        if self.valid is False:
+            return False
+        for text, folder_test, test in self.tests:
+            if folder_test:
+                start = time.perf_counter()
+                matched = bool(test(ParentName, Tags))
+                Profile.AddCondition(Stats, text, matched, time.perf_counter()-start)
+                if matched is False:
+                    Profile.AddRule(Stats, False)
+                    return False
+        return True
+
+    def ProfileFile(self, Name:str, Size:int|None, Stats:dict, Profile:RuleProfile)->bool:
+        # TestFile(), evaluating and timing one condition at a time
+        for text, folder_test, test in self.tests:
+            if folder_test is False:
+                start = time.perf_counter()
+                matched = bool(test(Name, Size))
+                Profile.AddCondition(Stats, text, matched, time.perf_counter()-start)
+                if text.startswith("SIZE_"):
+                    Profile.AddSizeTest()
+                if matched is False:
+                    Profile.AddRule(Stats, False)
+                    return False
+        Profile.AddRule(Stats, True)
+        return True
+
+class FileRuleSet:
+    # a compiled list of file rules
+
+    def __init__(self, Rules:list, Kind:str="file rule"):
+        self.kind = Kind
+        self.rules = [FileRule(index, conditions) for index, conditions in enumerate(Rules)]
+        self.has_size = any([rule.HasSizeConditions() for rule in self.rules])
+        self.merged = {}
+
+    def HasSizeConditions(self)->bool:
+        return self.has_size
+
+    def GetMatcher(self, FolderPath:str, Tags:set):
+        # returns a FileRuleMatcher for files in a folder
+        parent = os.path.basename(FolderPath).lower()
+        if RuleProfile.Active is not None:
+            return ProfiledRuleMatcher(self.rules, self.kind, parent, Tags, RuleProfile.Active)
+
+        rules = [rule for rule in self.rules if rule.TestFolder(parent, Tags)]
+        mergeable = tuple([rule.index for rule in rules if rule.IsMergeable()])
+        if len(mergeable)<2:
+            return FileRuleMatcher(rules, None)
+
+        if mergeable not in self.merged:
+            try:
+                pattern = "|".join([f"(?P<r{index}>{self.rules[index].name_patterns[0]})" for index in mergeable])
+                self.merged[mergeable] = re.compile(pattern)
+            except re.error:
+                self.merged[mergeable] = None
+
+        return FileRuleMatcher(rules, self.merged[mergeable])
+
+class FileRuleMatcher:
+    # tests files against the rules that apply to a folder
+
+    def __init__(self, Rules:list, Merged:re.Pattern|None):
+        self.rules = Rules
+        self.merged = Merged
+        if Merged is None:
+            self.others = Rules
+            self.by_group = {}
+        else:
+            self.others = [rule for rule in Rules if rule.IsMergeable() is False]
+            self.by_group = {f"r{rule.index}":rule for rule in Rules if rule.IsMergeable()}
+
+    def Test(self, Name:str, Size:int|None):
+        # returns the conditions of the first rule satisfied, or False
+        first = None
+        if self.merged is not None:
+            m = self.merged.match(Name)
+            if m is not None:
+                first = self.by_group[m.lastgroup]
+
+        for rule in self.others:
+            if first is not None and rule.index>first.index:
+                break
+            if rule.TestFile(Name, Size):
+                return rule.conditions
+
+        if first is not None:
+            return first.conditions
+        return False
+
+class ProfiledRuleMatcher:
+    # tests files against each rule in turn, counting and timing rules and conditions
+
+    def __init__(self, Rules:list, Kind:str, ParentName:str, Tags:set, Profile:RuleProfile):
+        self.profile = Profile
+        self.rules = []
+        for rule in Rules:
+            stats = Profile.GetRule(Kind, rule.text)
+            if rule.ProfileFolder(ParentName, Tags, stats, Profile):
+                self.rules.append((rule, stats))
+
+    def Test(self, Name:str, Size:int|None):
+        # returns the conditions of the first rule satisfied, or False
+        for rule, stats in self.rules:
+            if rule.ProfileFile(Name, Size, stats, self.profile):
+                return rule.conditions
+        return False
+
 class FileSetRules:
     def __init__(self, IncludeByDefault:bool=True, IncludeRules:uConfigSection|list=None, ExcludeRules:uConfigSection|list=None):
         # files are organized by folder [{path}]
@@ -53,6 +251,10 @@ class FileSetRules:
         if self.exclude_rules is False:
             return
 
+        # compile rules
+        self.include_set = FileRuleSet(self.include_rules, "file include")
+        self.exclude_set = FileRuleSet(self.exclude_rules, "file exclude")
+
         self.valid = True
 
     def IsValid(self)->bool:
@@ -149,115 +351,50 @@ class FileSetRules:
     def ScanFiles(self, inFolderPath, inFolderTags=None):
         # scans a folder, returning files that match the specified conditions
         # returns [(name, size)]
-        SyncUtils.Logger.WriteDetails(f"[+VIOLET]***** SCAN FILES: {inFolderPath}{'' if inFolderTags is None else ' [+RED]'+str(inFolderTags)+'[+]'}[+]")
+        SyncUtils.Logger.WriteDetails(f"[+VIOLET]***** SCAN FILES: {inFolderPath}{'' if inFolderTags is None else ' [+RED]'+str(set(inFolderTags))+'[+]'}[+]")
         if inFolderTags is None:
             inFolderTags = set()
-        log_rules = False
         ret_files = []
-        files = uFolder.FindFiles(inFolderPath)
-        for fname,_ in files:
-            if log_rules:
-                SyncUtils.Logger.WriteDetails(f"[+GREEN]*** FILE: {fname}[+]")
+        files = FolderTree.GetTree(inFolderPath).FindFiles(inFolderPath)
+
+        # folder conditions (tags, parent) are evaluated once for the folder
+        include_matcher = self.include_set.GetMatcher(inFolderPath, inFolderTags)
+        exclude_matcher = self.exclude_set.GetMatcher(inFolderPath, inFolderTags)
+        for fname,fstat in files.items():
             satisfied = self.include_by_default
             if self.include_by_default:
-                if log_rules:
-                    SyncUtils.Logger.WriteDetails(f"[+CYAN]+ Included by default[+]")
-                test = self.test_filter_rules(self.exclude_rules, fname, inFolderPath, inFolderTags)
-                if test:
-                    if log_rules:
-                        SyncUtils.Logger.WriteDetails(f"[+RED]- Excluded by rule: {test}[+]")
-                    satisfied = False
-                    test = self.test_filter_rules(self.include_rules, fname, inFolderPath, inFolderTags)
-                    if test:
-                        if log_rules:
-                            SyncUtils.Logger.WriteDetails(f"[+CYAN]+ Included by rule: {test}[+]")
-                        satisfied = True
+                if exclude_matcher.Test(fname, fstat[0]):
+                    satisfied = bool(include_matcher.Test(fname, fstat[0]))
             else:
-                if log_rules:
-                    SyncUtils.Logger.WriteDetails(f"[+RED]- Excluded by default[+]")
-                test = self.test_filter_rules(self.include_rules, fname, inFolderPath, inFolderTags)
-                if test:
-                    if log_rules:
-                        SyncUtils.Logger.WriteDetails(f"[+CYAN]+ Included by rule: {test}[+]")
-                    satisfied = True
-                    test = self.test_filter_rules(self.exclude_rules, fname, inFolderPath, inFolderTags)
-                    if test:
-                        if log_rules:
-                            SyncUtils.Logger.WriteDetails(f"[+RED]- Excluded by rule: {test}[+]")
-                        satisfied = False
+                if include_matcher.Test(fname, fstat[0]):
+                    satisfied = not exclude_matcher.Test(fname, fstat[0])
 
             if satisfied:
-                fsize = os.path.getsize(os.path.join(inFolderPath, fname))
-                ret_files.append((fname, fsize))
+                ret_files.append((fname, fstat[0]))
             pass
             
         SyncUtils.Logger.WriteDetails(f"[+BLUE]* {len(ret_files)} files found[+]")
         return ret_files
     
-    def test_filter_rules(self, filter_rules, file_name, path, tags:set=None):
-        if len(filter_rules)==0:
-            return False
-        
-        # returns true if any of the specified rules are satisfied
+    def test_filter_rules(self, filter_rules, file_name, path, tags:set=None, filesize=None):
+        # returns the first rule that is satisfied, or False
         # a rule is satisfied when all parts of the rule are satisfied
+        # filesize may be passed in when known, to avoid reading it from disk
+        if filter_rules is self.include_rules:
+            rule_set = self.include_set
+        elif filter_rules is self.exclude_rules:
+            rule_set = self.exclude_set
+        else:
+            rule_set = FileRuleSet(filter_rules)
 
-        filesize = None
+        if filesize is None and rule_set.HasSizeConditions():
+            filesize = self.__filesize(path, file_name)
 
-        for rule in filter_rules:
-            try:
-                if len(rule)>1 or rule[0]!="":
-                    success = True
-                    for part in rule:
-                        match part['cond']:
-                            case FileSetCondition.MASK:
-                                if fnmatch.fnmatch(file_name, part['mask']) is False:
-                                    success = False
-                                    break
-                            case FileSetCondition.REGEX:
-                                m = part['regex'].match(file_name)
-                                if part['regex'].match(file_name) is None:
-                                    success = False
-                                    break
-                            case FileSetCondition.TAG:
-                                if part['tag'] not in tags:
-                                    success = False
-                                    break
-                            case FileSetCondition.NTAG:
-                                if part['tag'] in tags:
-                                    success = False
-                                    break
-                            case FileSetCondition.NO_TAG:
-                                if len(tags)>0:
-                                    success = False
-                                    break
-                            case FileSetCondition.PARENT:
-                                if fnmatch.fnmatch(os.path.basename(path).lower(), part['name']) is False:
-                                    success = False
-                                    break
-                            case FileSetCondition.SIZE_GT:
-                                if filesize is None:
-                                    filesize = self.__filesize(path, file_name)
-                                if filesize is False or filesize<=part['bytes']:
-                                    success = False
-                                    break
-                            case FileSetCondition.SIZE_LT:
-                                if filesize is None:
-                                    filesize = self.__filesize(path, file_name)
-                                if filesize is False or filesize>part['bytes']:
-                                    success = False
-                                    break
-                            case _: # unknown condition
-                                success = False
-                                break
-
-                    if success:
-                        return rule
-            except:
-                pass
-        
-        return False       
+        return rule_set.GetMatcher(path, set() if tags is None else tags).Test(file_name, filesize)
 
     def __filesize(self, path, name):
+        if RuleProfile.Active is not None:
+            RuleProfile.Active.AddStatCall()
         try:
             return os.path.getsize(os.path.join(path, name))
         except:
@@ -7,20 +7,25 @@ from m9lib import uControl, uLoggerLevel
 
 from c_file_sync import *
 
-import sys,os
+import sys,os,argparse
 
-config_file = "sync-files.ini"
-if len(sys.argv)>1:
-    config_file = sys.argv[1]
-if os.path.isfile(config_file) is False:
-    print(f'Configuration file not found: {config_file}')
-    exit (-1)
+# the guard is required for worker processes (ScanWorkers) on Windows
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Synchronize files as configured")
+    parser.add_argument("config", nargs="?", default="sync-files.ini", help="configuration file")
+    parser.add_argument("--profile", metavar="FOLDER", help="write cProfile and tracemalloc files of each stage to FOLDER (see Profile)")
+    args = parser.parse_args()
+    config_file = args.config
+    FileSyncCommand.ProfilePath = args.profile
+    if os.path.isfile(config_file) is False:
+        print(f'Configuration file not found: {config_file}')
+        exit (-1)
 
-uControl.PrintFailures()
-control = uControl("FileSync", config_file) # use this line if a custom uControl is not desired
-control.GetLogger().SetWriteLevel(Level=uLoggerLevel.DETAILS)
-control.GetLogger().SetPrint(Print=True, Level=uLoggerLevel.DETAILS, Color=True)
-control.Execute ()
+    uControl.PrintFailures()
+    control = uControl("FileSync", config_file) # use this line if a custom uControl is not desired
+    control.GetLogger().SetWriteLevel(Level=uLoggerLevel.DETAILS)
+    control.GetLogger().SetPrint(Print=True, Level=uLoggerLevel.DETAILS, Color=True)
+    control.Execute ()
 
 # Note the following about error messages.  There are three categories of error messages:
 # - System level uControl messages
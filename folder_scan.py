@@ -8,9 +8,28 @@ from m9lib import uTimer
 from folder_section import *
 from folder_set import *
 from file_set import *
+from sync_metrics import *
+from scan_cache import *
 
+import pathlib, multiprocessing, sqlite3
+from array import array
+from concurrent.futures import ProcessPoolExecutor
 from enum import Enum
 
+'''
+A FolderScan determines the folders and files of each source folder section.
+
+With more than one scan worker, top folders are scanned in parallel by a pool of processes.  A top folder is walked
+once, by its worker, and scanned together with its child folders.  Each worker returns compact results:
+- For each folder section, folders with tags, and the names and sizes of files found in each folder
+- Snapshots of the folders walked, as compact columns (see FolderTree.GetColumns()), used by later stages of the main process
+- Log messages, which are written by the main process in folder section order
+
+While workers scan source folders, the main process walks target folders and other scan paths.  Workers read the
+ScanCache, and folders they walk are added to the cache by the main process.  The main process compares scanned files
+to target files, so results are the same as a scan in a single process.
+'''
+
 class FolderScanStage(Enum):
     INIT = 0        # initialization
     HIERARCHY = 1   # calculated hierarchy
@@ -22,6 +41,10 @@ class FolderScan:
         self.stage = FolderScanStage.INIT
         self.folders = []
         self.global_exclude = None
+        self.compare_mode = CompareMode.SIZE
+        self.scan_workers = 1
+        self.scan_paths = []
+        self.metrics = SyncMetrics()
 
     def AddFolder(self, Folder:FolderSection):
         # adds a folder to the scan operation
@@ -29,23 +52,63 @@ class FolderScan:
             self.folders.append(Folder)
             self.__calculate_children()
 
+    def AddFolders(self, Folders:list):
+        # adds a list of FolderSection to the scan operation; the hierarchy is calculated once
+        if self.stage==FolderScanStage.INIT:
+            self.folders.extend(Folders)
+            self.__calculate_children()
+
     def __calculate_children(self):
         # determine folder hierarchy
-        # FolderUtils.Loggger.WriteLine(f"Scanning hierarchies...")
-        folder:FolderSection = None
-        for folder in self.folders:
-            folder.reset_children()
+        # - children of a folder are all folders under it, in the order folders were added
+        # - parent of a folder is the nearest folder above it; the first added when paths are the same
+        # sorting by path components places every folder directly before the folders under it
+        order = sorted(range(len(self.folders)), key=lambda x: pathlib.PurePath(self.folders[x].GetPath()).parts)
+        parts = [pathlib.PurePath(self.folders[x].GetPath()).parts for x in order]
+        parents = [None]*len(self.folders)
+        children = [[] for _ in self.folders]
 
-        for folder in self.folders:
-            for subfolder in self.folders:
-                if folder != subfolder:
-                    if subfolder.IsUnder(folder):
-                        folder.AddChild(subfolder)
+        stack = [] # (position in order) of folders above the current folder
+        for pos, x in enumerate(order):
+            while len(stack)>0 and parts[pos][:len(parts[stack[-1]])]!=parts[stack[-1]]:
+                stack.pop()
+            if len(stack)>0 and parts[stack[-1]]==parts[pos]:
+                parents[x] = parents[order[stack[-1]]]
+            else:
+                if len(stack)>0:
+                    parents[x] = order[stack[-1]]
+                stack.append(pos)
+
+        # folders under a folder follow it in sorted order
+        for pos, x in enumerate(order):
+            end = pos+1
+            while end<len(order) and parts[end][:len(parts[pos])]==parts[pos]:
+                end += 1
+            children[x] = sorted([order[y] for y in range(pos+1, end) if parts[y]!=parts[pos]])
+
+        for x, folder in enumerate(self.folders):
+            folder.set_hierarchy(None if parents[x] is None else self.folders[parents[x]], [self.folders[y] for y in children[x]])
 
     def SetGlobalExclude(self, ExcludeFolders:list):
         # adds a global exclude section
         self.global_exclude = ExcludeFolders
 
+    def SetCompareMode(self, Compare:CompareMode):
+        # determines how source files are compared to existing target files
+        self.compare_mode = Compare
+
+    def AddScanPath(self, Path:str):
+        # a path walked at the same time as source and target folders, such as the clean folder
+        self.scan_paths.append(Path)
+
+    def SetScanWorkers(self, Workers:int):
+        # number of processes used to scan top folders
+        self.scan_workers = max(1, Workers)
+
+    def SetMetrics(self, Metrics:SyncMetrics):
+        # stage times and folder section counts are recorded in Metrics
+        self.metrics = Metrics
+
     def GetFolders(self)->list:
         # list of FolderSection
         return self.folders
@@ -53,72 +116,307 @@ class FolderScan:
     def ScanFolders(self)->bool:
         if self.stage!=FolderScanStage.INIT:
             return False
-        
-        # types
-        folder:FolderSection = None
-        subfolder:FolderSection = None
 
-        timer1 = uTimer()
+        # walk each top folder once, together with target folders and other scan paths
+        # child folders share the snapshot of their parent
+        scheduler = ScanScheduler()
+        groups = self.__get_scan_groups()
+        if self.scan_workers>1 and len(groups)>1:
+            # worker processes scan folders and files; results are added by stage
+            with self.metrics.Stage('folder_scan'):
+                timer1 = uTimer()
+                self.__log_stage_start("folder scan")
+                scheduler.Start(self.__get_target_paths())
+                results = self.__scan_parallel(groups, scheduler)
+                if results is None:
+                    return False
+                self.__add_parallel_folders(results, timer1)
+            with self.metrics.Stage('file_scan'):
+                self.__add_parallel_files(results)
+        else:
+            with self.metrics.Stage('folder_scan'):
+                timer1 = uTimer()
+                self.__log_stage_start("folder scan")
+                scheduler.Start(self.__get_top_paths() + self.__get_target_paths())
+                scheduler.Join()
+                self.__scan_folder_sets(timer1)
+            with self.metrics.Stage('file_scan'):
+                self.__scan_file_sets()
+
+        if self.compare_mode==CompareMode.HASH:
+            with self.metrics.Stage('compare_content'):
+                self.__compare_content()
+
+        return True
+
+    def __log_stage_start(self, in_stage):
         SyncUtils.Logger.WriteLine("")
-        SyncUtils.Logger.WriteLine(f"[+GREEN]=== Performing folder scan...[+]")
+        SyncUtils.Logger.WriteLine(f"[+GREEN]=== Performing {in_stage}...[+]")
         SyncUtils.Logger.WriteLine(f"{len(self.folders)} folder sections")
 
-        # collect folder paths
+    def __scan_folder_sets(self, in_timer:uTimer):
+        # evaluates folder rules and tags of each folder section
         self.stage = FolderScanStage.HIERARCHY
         for folder in self.folders:
             SyncUtils.Logger.WriteLine(f"[+VIOLET]Scanning {folder.GetPath()}...[+]")
+            RuleProfile.SetSection(folder.GetId())
             timer2 = uTimer()
-            exclude_folders = []
-            # child folders are always excluded
-            for child in folder.GetChildren():
-                exclude_folders.append (child.GetPath())
-
-            # global exclude setting
-            if isinstance(self.global_exclude, list) and len(self.global_exclude)>0:
-                folder_set = FolderSet(folder.GetPath(), self.global_exclude, exclude_folders, ApplyTags=False)
-                exclude_folders.extend(folder_set.GetFolders())
-
-            # local exclude setting
-            exclude_folder_rules = folder.GetExcludeFolderRules()
-            if len(exclude_folder_rules)>0:
-                folder_set = FolderSet(folder.GetPath(), exclude_folder_rules, exclude_folders, ApplyTags=False)
-                exclude_folders.extend(folder_set.GetFolders())
-
-            # finalize folder set
-            final_set = FolderSet(folder.GetPath(), None, exclude_folders)
-
-            # apply folder tags
-            folder_tag_rules = folder.GetFolderTagRules()
-            final_set.ApplyFolderTags(folder_tag_rules)
+            final_set = scan_folder_set(folder.GetPath(), [child.GetPath() for child in folder.GetChildren()], self.global_exclude, folder.GetExcludeFolderRules(), folder.GetFolderTagRules())
 
             SyncUtils.Logger.WriteLine(f"- {timer2.GetElapsedString()}")
             SyncUtils.Logger.WriteLine(f"- {len(final_set.GetFolders())} folders")
 
             folder.SetScanFolders(final_set.GetFoldersWithTags())
+            self.metrics.Set('folder_scan_seconds', timer2.GetElapsedSeconds(), folder.GetId())
+            self.metrics.Set('folders', len(final_set.GetFolders()), folder.GetId())
 
-        SyncUtils.Logger.WriteLine(f"[+GREEN]=== Completed folder scan ({timer1.GetElapsedString()})[+]")
+        SyncUtils.Logger.WriteLine(f"[+GREEN]=== Completed folder scan ({in_timer.GetElapsedString()})[+]")
         self.stage = FolderScanStage.FOLDER_SCAN
 
+    def __scan_file_sets(self):
+        # evaluates file rules in the folders of each folder section, and compares files to target files
         timer1 = uTimer()
-        SyncUtils.Logger.WriteLine("")
-        SyncUtils.Logger.WriteLine(f"[+GREEN]=== Performing file scan...[+]")
-        SyncUtils.Logger.WriteLine(f"{len(self.folders)} folder sections")
+        self.__log_stage_start("file scan")
         scan_file_count = 0
         for folder in self.folders:
             timer2 = uTimer()
             SyncUtils.Logger.WriteLine(f"[+VIOLET]Scanning {folder.GetPath()}...[+]")
+            RuleProfile.SetSection(folder.GetId())
             scan_folders = folder.GetScanResults()
             SyncUtils.Logger.WriteLine(f"Scanning {len(scan_folders)} folders for files...")
             fileset_rules = FileSetRules(folder.GetDefaultSetting()=="INCLUDE", folder.GetIncludeFileRules(), folder.GetExcludeFileRules())
             for scan_dict in scan_folders:
                 scan_files = fileset_rules.ScanFiles(scan_dict['folder'], scan_dict['tags'])
-                folder.AddScanFiles(scan_dict['folder'], scan_files)
+                folder.AddScanFiles(scan_dict['folder'], scan_files, Compare=self.compare_mode)
                 scan_file_count += len(scan_files)
 
             SyncUtils.Logger.WriteLine(f"- {timer2.GetElapsedString()}")
-            SyncUtils.Logger.WriteLine(f"- {len(final_set.GetFolders())} folders")
+            SyncUtils.Logger.WriteLine(f"- {len(scan_folders)} folders")
             SyncUtils.Logger.WriteLine(f"- {scan_file_count} files")
+            self.metrics.Set('file_scan_seconds', timer2.GetElapsedSeconds(), folder.GetId())
 
         SyncUtils.Logger.WriteLine(f"[+GREEN]=== Completed file scan ({timer1.GetElapsedString()})[+]")
 
-        return True
+    def RescanFolders(self, Folder:FolderSection, Changed:set, Structure:bool=False)->list:
+        # scans folders of a folder section again after changes, returning scan results that were scanned again
+        # - Changed: source folders that changed; their target folders are listed again
+        # - Structure: subfolders were added or removed, so folder rules are evaluated again for the folder section
+        RuleProfile.SetSection(Folder.GetId())
+        if Structure:
+            known = set([result['folder'] for result in Folder.GetScanResults()])
+            final_set = scan_folder_set(Folder.GetPath(), [child.GetPath() for child in Folder.GetChildren()], self.global_exclude, Folder.GetExcludeFolderRules(), Folder.GetFolderTagRules())
+            Folder.SetScanFolders(final_set.GetFoldersWithTags())
+            results = Folder.GetScanResults()
+            changed = [result for result in results if result['folder'] in Changed or result['folder'] not in known]
+        else:
+            results = [Folder.GetScanRecord(path) for path in Changed]
+            results = [result for result in results if result is not None]
+            changed = results
+
+        for result in changed:
+            if result['target'] is not None:
+                FolderTree.RefreshFolder(result['target'])
+
+        fileset_rules = FileSetRules(Folder.GetDefaultSetting()=="INCLUDE", Folder.GetIncludeFileRules(), Folder.GetExcludeFileRules())
+        for result in results:
+            scan_files = fileset_rules.ScanFiles(result['folder'], result['tags'])
+            Folder.AddScanFiles(result['folder'], scan_files, Compare=self.compare_mode)
+
+        if self.compare_mode==CompareMode.HASH:
+            self.__compare_content(changed)
+
+        return results
+
+    def __get_scan_groups(self)->list:
+        # returns [[folder index]]; each group is a top folder, followed by its child folders
+        groups = {}
+        for x, folder in enumerate(self.folders):
+            if folder.GetParent() is None:
+                groups[id(folder)] = [x]
+        for x, folder in enumerate(self.folders):
+            top = folder
+            while top.GetParent() is not None:
+                top = top.GetParent()
+            if top is not folder:
+                groups[id(top)].append(x)
+        return list(groups.values())
+
+    def __get_top_paths(self)->list:
+        # paths of top folders
+        return [folder.GetPath() for folder in self.folders if folder.GetParent() is None]
+
+    def __get_target_paths(self)->list:
+        # target paths of top folders, and other scan paths
+        return [folder.GetTargetPath() for folder in self.folders if folder.GetParent() is None and folder.GetTargetPath() is not None] + self.scan_paths
+
+    def __scan_parallel(self, in_groups:list, in_scheduler:ScanScheduler)->dict|None:
+        # scans groups of folders in worker processes; returns {folder index: section result}, or None on failure
+        jobs = []
+        for group in in_groups:
+            sections = []
+            for x in group:
+                folder = self.folders[x]
+                sections.append({'index':x, 'path':folder.GetPath(), 'children':[child.GetPath() for child in folder.GetChildren()],
+                                 'exclude_folders':folder.GetExcludeFolderRules(), 'folder_tags':folder.GetFolderTagRules(),
+                                 'include_default':folder.GetDefaultSetting()=="INCLUDE",
+                                 'include_files':folder.GetIncludeFileRules(), 'exclude_files':folder.GetExcludeFileRules()})
+            jobs.append(sections)
+
+        SyncUtils.Logger.WriteLine(f"Scanning {len(jobs)} top folders with {min(self.scan_workers, len(jobs))} workers")
+        try:
+            # workers are spawned rather than forked, since scan threads, the scan cache lock and its SQLite connection
+            # may be in use while the pool starts
+            cache = FolderTree.Cache
+            cache_args = (None if cache is None else cache.GetFilepath(), FolderTree.TrustFiles)
+            with ProcessPoolExecutor(max_workers=min(self.scan_workers, len(jobs)), mp_context=multiprocessing.get_context("spawn"), initializer=init_scan_worker, initargs=cache_args) as executor:
+                group_results = list(executor.map(scan_folder_group, jobs, [self.global_exclude]*len(jobs)))
+        except Exception as e:
+            in_scheduler.Join()
+            SyncUtils.Logger.WriteError(f"Parallel folder scan failed: {str(e)}")
+            return None
+
+        # target folders are walked while workers scan source folders
+        in_scheduler.Join()
+
+        results = {}
+        for group_result in group_results:
+            for columns in group_result['trees']:
+                FolderTree.FromColumns(columns)
+            for section in group_result['sections']:
+                results[section['index']] = section
+        return results
+
+    def __add_parallel_folders(self, in_results:dict, in_timer:uTimer):
+        # adds folder scan results of worker processes, in folder order
+        self.stage = FolderScanStage.HIERARCHY
+        for x, folder in enumerate(self.folders):
+            SyncUtils.Logger.WriteLine(f"[+VIOLET]Scanning {folder.GetPath()}...[+]")
+            SyncLogBuffer.Replay(in_results[x]['folder_log'], SyncUtils.Logger)
+            SyncUtils.Logger.WriteLine(f"- {in_results[x]['folder_time']}")
+            SyncUtils.Logger.WriteLine(f"- {len(in_results[x]['folders'])} folders")
+            folder.SetScanFolders(in_results[x]['folders'])
+            self.metrics.Set('folder_scan_seconds', in_results[x]['folder_seconds'], folder.GetId())
+            self.metrics.Set('folders', len(in_results[x]['folders']), folder.GetId())
+
+        SyncUtils.Logger.WriteLine(f"[+GREEN]=== Completed folder scan ({in_timer.GetElapsedString()})[+]")
+        self.stage = FolderScanStage.FOLDER_SCAN
+
+    def __add_parallel_files(self, in_results:dict):
+        # adds file scan results of worker processes, in folder order
+        timer1 = uTimer()
+        self.__log_stage_start("file scan")
+        scan_file_count = 0
+        for x, folder in enumerate(self.folders):
+            SyncUtils.Logger.WriteLine(f"[+VIOLET]Scanning {folder.GetPath()}...[+]")
+            scan_folders = folder.GetScanResults()
+            SyncUtils.Logger.WriteLine(f"Scanning {len(scan_folders)} folders for files...")
+            SyncLogBuffer.Replay(in_results[x]['file_log'], SyncUtils.Logger)
+            for scan_dict, (names, sizes) in zip(scan_folders, in_results[x]['files']):
+                folder.AddScanFiles(scan_dict['folder'], zip(names, sizes), Compare=self.compare_mode)
+                scan_file_count += len(names)
+
+            SyncUtils.Logger.WriteLine(f"- {in_results[x]['file_time']}")
+            SyncUtils.Logger.WriteLine(f"- {len(scan_folders)} folders")
+            SyncUtils.Logger.WriteLine(f"- {scan_file_count} files")
+            self.metrics.Set('file_scan_seconds', in_results[x]['file_seconds'], folder.GetId())
+
+        SyncUtils.Logger.WriteLine(f"[+GREEN]=== Completed file scan ({timer1.GetElapsedString()})[+]")
+
+    def __compare_content(self, in_results:list=None):
+        # files of the same size are compared by content hash; files with different content are MOD
+        # in_results is a list of scan results to compare, or None for all scan results
+        timer = uTimer()
+        SyncUtils.Logger.WriteLine("")
+        SyncUtils.Logger.WriteLine(f"[+GREEN]=== Comparing file content...[+]")
+
+        if in_results is None:
+            in_results = [result for folder in self.folders for result in folder.GetScanResults()]
+
+        same_files = []
+        for result in in_results:
+            for file_index, file in enumerate(result['files']):
+                if file[2]=='SAME':
+                    same_files.append((result, file_index, os.path.join(result['folder'], file[0]), os.path.join(result['target'], file[0])))
+
+        hasher = FileHasher(Cache=FolderTree.Cache)
+        filepaths = []
+        for _,_,source_file,target_file in same_files:
+            filepaths.extend([source_file, target_file])
+        digests = hasher.HashFiles(filepaths)
+
+        mod_count = 0
+        for result, file_index, source_file, target_file in same_files:
+            if digests[source_file] is None or digests[source_file]!=digests[target_file]:
+                result['files'].SetStatus(file_index, 'MOD')
+                mod_count += 1
+
+        hashed_files, hashed_bytes = hasher.GetStats()
+        SyncUtils.Logger.WriteLine(f"{len(same_files)} files compared; {mod_count} files modified")
+        SyncUtils.Logger.WriteLine(f"{hashed_files} files hashed ({uStringFormat.Bytes(hashed_bytes)})")
+        SyncUtils.Logger.WriteLine(f"[+GREEN]=== Completed content comparison ({timer.GetElapsedString()})[+]")
+
+def scan_folder_set(Path:str, Children:list, GlobalExclude:list, ExcludeRules:list, TagRules:list)->"FolderSet":
+    # returns the folders of a source folder, with tags applied
+    exclude_folders = []
+    # child folders are always excluded
+    exclude_folders.extend(Children)
+
+    # global exclude setting
+    if isinstance(GlobalExclude, list) and len(GlobalExclude)>0:
+        folder_set = FolderSet(Path, GlobalExclude, exclude_folders, ApplyTags=False, Kind="global exclude")
+        exclude_folders.extend(folder_set.GetFolders())
+
+    # local exclude setting
+    if len(ExcludeRules)>0:
+        folder_set = FolderSet(Path, ExcludeRules, exclude_folders, ApplyTags=False)
+        exclude_folders.extend(folder_set.GetFolders())
+
+    # finalize folder set
+    final_set = FolderSet(Path, None, exclude_folders)
+
+    # apply folder tags
+    final_set.ApplyFolderTags(TagRules)
+    return final_set
+
+def init_scan_worker(CachePath:str=None, TrustFiles:bool=False):
+    # worker processes take their own snapshots, reading the scan cache of the main process without writing to it
+    FolderTree.Reset()
+    cache = None
+    if CachePath is not None:
+        try:
+            cache = ScanCache(CachePath, ReadOnly=True)
+        except sqlite3.Error:
+            cache = None
+    FolderTree.SetCache(cache, TrustFiles)
+    SyncUtils.ResetPaths()
+
+def scan_folder_group(Sections:list, GlobalExclude:list)->dict:
+    # worker process: scans folders and files of a top folder and its child folders
+    # returns a result for each section, and the snapshots walked as columns
+    # the top folder is walked once; child folders share its snapshot
+    FolderTree.Reset()
+    FolderTree.GetTree(Sections[0]['path'])
+    results = []
+    for section in Sections:
+        SyncUtils.Logger = SyncLogBuffer()
+        timer = uTimer()
+        final_set = scan_folder_set(section['path'], section['children'], GlobalExclude, section['exclude_folders'], section['folder_tags'])
+        folders = final_set.GetFoldersWithTags()
+        result = {'index':section['index'], 'folders':folders, 'folder_log':SyncUtils.Logger.GetMessages(), 'folder_time':timer.GetElapsedString(), 'folder_seconds':timer.GetElapsedSeconds()}
+
+        SyncUtils.Logger = SyncLogBuffer()
+        timer = uTimer()
+        fileset_rules = FileSetRules(section['include_default'], section['include_files'], section['exclude_files'])
+        result['files'] = [compact_files(fileset_rules.ScanFiles(fdict['folder'], fdict['tags'])) for fdict in folders]
+        result['file_log'] = SyncUtils.Logger.GetMessages()
+        result['file_time'] = timer.GetElapsedString()
+        result['file_seconds'] = timer.GetElapsedSeconds()
+        results.append(result)
+
+    trees = [tree.GetColumns() for tree in FolderTree.Trees.values()]
+    FolderTree.Reset()
+    return {'sections':results, 'trees':trees}
+
+def compact_files(Files:list)->tuple:
+    # returns ([name], array of sizes) of (name, size) tuples
+    return ([file[0] for file in Files], array('q', [file[1] for file in Files]))
@@ -8,6 +8,9 @@ from m9lib import uConfigSection
 import os
 
 from sync_utils import *
+from folder_tree import *
+from file_compare import *
+from scan_store import *
 
 class FolderSection:
     def __init__(self, Section:uConfigSection):
@@ -42,6 +45,9 @@ class FolderSection:
             self.exclude_file_rules = SyncUtils.CombineFileSetRules(Section.GetConfig(), Section.GetValue("ExcludeFiles"))
 
         self.scan_results = None
+        self.scan_store = ScanStore()
+        self.source_index = {}
+        self.target_index = {}
 
     def __repr__(self):
         return self.path
@@ -105,6 +111,11 @@ class FolderSection:
         self.parent = None
         self.children = []
 
+    def set_hierarchy(self, Parent, Children:list):
+        # parent and children calculated for a list of folders
+        self.parent = Parent
+        self.children = Children
+
     def SetTargetPath(self, TargetPath):
         self.target_path = TargetPath
 
@@ -115,8 +126,12 @@ class FolderSection:
 
     def SetScanFolders(self, Folders:list)->None:
         # expects list of {folder, tags}
+        # results are indexed by source folder and by target folder; the first result is used when folders repeat
         if isinstance(Folders, list):
             self.scan_results = Folders
+            self.scan_store = ScanStore()
+            self.source_index = {}
+            self.target_index = {}
             for fdict in self.scan_results:
                 if self.target_path is None:
                     fdict['target'] = None
@@ -126,38 +141,67 @@ class FolderSection:
                         fdict['target'] = self.target_path
                     else:
                         fdict['target'] = os.path.join(self.target_path, relpath)
+                self.source_index.setdefault(fdict['folder'], fdict)
+                if fdict['target'] is not None:
+                    self.target_index.setdefault(fdict['target'], fdict)
 
     def GetScanResults(self, SourceFolder=None, TargetFolder=None)->list:
         if SourceFolder:
-            for results in self.scan_results:
-                if results['folder'] == SourceFolder:
-                    return results['files']
-            return None
+            results = self.source_index.get(SourceFolder)
+            return None if results is None else results['files']
         elif TargetFolder:
-            for results in self.scan_results:
-                if results['target'] == TargetFolder:
-                    return results['files']
-            return None
+            results = self.target_index.get(TargetFolder)
+            return None if results is None else results['files']
         
         return self.scan_results
+
+    def GetScanRecord(self, SourceFolder)->dict|None:
+        # returns {folder, tags, target, files} for a scanned folder
+        return self.source_index.get(SourceFolder)
+
+    def GetScanStore(self)->ScanStore:
+        # files of scan results, with per-status totals
+        return self.scan_store
+
+    def GetScanNames(self, SourceFolder=None, TargetFolder=None)->set|None:
+        # returns the set of file names found in a scanned folder, or None if the folder was not scanned
+        if SourceFolder:
+            results = self.source_index.get(SourceFolder)
+        else:
+            results = self.target_index.get(TargetFolder)
+        if results is None:
+            return None
+        if 'names' not in results:
+            results['names'] = {file[0] for file in results['files']}
+        return results['names']
     
-    def AddScanFiles(self, Folder, Files, CalcStat=True):
+    def AddScanFiles(self, Folder, Files, CalcStat=True, Compare:CompareMode=CompareMode.SIZE):
+        # with CompareMode.HASH, files of the same size are SAME until content is compared by FolderScan
         if self.scan_results is not None:
-            for folder in self.scan_results:
-                if folder['folder']==Folder:
-                    if CalcStat is False:
-                        folder['files'] = Files
-                    else:
-                        files = []
-                        for file in Files:
-                            stat = 'NEW'
-                            target_filepath = os.path.join(folder['target'], file[0])
-                            if os.path.isfile(target_filepath):
-                                filesize = os.path.getsize(target_filepath)
-                                if file[1] == filesize:
-                                    stat = 'SAME'
-                                else:
-                                    stat = 'MOD'
-                            files.append((file[0], file[1], stat))
-                        folder['files'] = files
-                    return
+            folder = self.source_index.get(Folder)
+            if folder is not None:
+                folder.pop('names', None)
+                if isinstance(folder.get('files'), ScanFileList):
+                    self.scan_store.RemoveFileList(folder['files'])
+                if CalcStat is False:
+                    folder['files'] = self.scan_store.CreateFileList(Files)
+                else:
+                    files = self.scan_store.CreateFileList()
+                    target_files = {}
+                    if folder['target'] is not None:
+                        target_files = FolderTree.GetTree(folder['target']).FindFiles(folder['target'])
+                    source_files = None
+                    if Compare==CompareMode.MTIME:
+                        source_files = FolderTree.GetTree(Folder).FindFiles(Folder)
+                    for file in Files:
+                        stat = 'NEW'
+                        if file[0] in target_files:
+                            target_stat = target_files[file[0]]
+                            if file[1] != target_stat[0]:
+                                stat = 'MOD'
+                            elif source_files is not None and file[0] in source_files and FileHasher.IsNewer(source_files[file[0]][1], target_stat[1]):
+                                stat = 'MOD'
+                            else:
+                                stat = 'SAME'
+                        files.Append(file[0], file[1], stat)
+                    folder['files'] = files
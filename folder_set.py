@@ -7,8 +7,10 @@ from m9lib import uFolder
 
 from folder_section import *
 from folder_scan import *
+from folder_tree import *
+from rule_profile import *
 
-import re, fnmatch
+import re, fnmatch, time
 from enum import IntEnum
 
 '''
@@ -36,26 +38,159 @@ class FolderSetCondition(IntEnum):
     LASTLY = 4      # end of a path?
     TRUE = 5        # always True
 
+class FolderRuleIndex:
+    # folder rules compiled into indexes, so that matching a folder does not depend on the number of rules
+    # - PATH: hash of full paths
+    # - LASTLY: trie of terminating path components, in reverse order
+    # - MATCH, REGEX: a combined regular expression applied to the folder name
+    # a folder is satisfied when any rule matches; the outcome is recursive when any recursive rule matches
+
+    def __init__(self, Filters:list):
+        self.true = None
+        self.paths = {}
+        self.lastly = {}
+        self.names = [[], []]
+        self.name_tests = [[], []]
+
+        for filter in Filters:
+            recurse = filter['recurse'] is True
+            match filter['cond']:
+                case FolderSetCondition.TRUE:
+                    self.true = recurse or self.true is True
+                case FolderSetCondition.PATH:
+                    self.paths[filter['path']] = recurse or self.paths.get(filter['path']) is True
+                case FolderSetCondition.MATCH:
+                    self.names[recurse].append(SyncUtils.MaskPattern(filter['match']))
+                case FolderSetCondition.REGEX:
+                    if filter['regex'].groups==0 and filter['regex'].flags==re.UNICODE:
+                        self.names[recurse].append(f"(?:{filter['regex'].pattern})")
+                    else:
+                        self.name_tests[recurse].append(filter['regex'])
+                    self.__add_lastly(filter['lastly'], recurse)
+                case FolderSetCondition.LASTLY:
+                    self.__add_lastly(filter['lastly'], recurse)
+
+        self.name_regex = [self.__combine(self.names[x], self.name_tests[x]) for x in range(2)]
+
+    def __combine(self, in_patterns, in_tests):
+        # combines name patterns into a single regular expression; patterns are tested individually if they cannot be combined
+        if len(in_patterns)==0:
+            return None
+        try:
+            return re.compile("|".join(in_patterns))
+        except re.error:
+            in_tests.extend([re.compile(p) for p in in_patterns])
+            return None
+
+    def __add_lastly(self, in_lastly:str, in_recurse:bool):
+        # a trie node is [{component: node}, satisfied, recurse]
+        children = self.lastly
+        for part in reversed(in_lastly[1:].split('\\')):
+            node = children.setdefault(part, [{}, False, False])
+            children = node[0]
+        node[1] = True
+        node[2] = node[2] or in_recurse
+
+    def Evaluate(self, Path:str)->tuple|None:
+        # returns (satisfied, recurse), or None when no rule matches
+        satisfied = False
+        recurse = False
+
+        if self.true is not None:
+            satisfied = True
+            recurse = self.true
+
+        if recurse is False and Path in self.paths:
+            satisfied = True
+            recurse = self.paths[Path]
+
+        if recurse is False and len(self.lastly)>0:
+            parts = Path.casefold().split('\\')
+            node = self.lastly
+            for x in range(len(parts)-1, 0, -1):
+                if parts[x] not in node:
+                    break
+                entry = node[parts[x]]
+                if entry[1]:
+                    satisfied = True
+                    recurse = recurse or entry[2]
+                node = entry[0]
+
+        if recurse is False:
+            name = os.path.basename(Path)
+            for x in (1, 0):
+                if satisfied and x==0:
+                    break
+                if (self.name_regex[x] is not None and self.name_regex[x].match(name)) or any([t.match(name) for t in self.name_tests[x]]):
+                    satisfied = True
+                    recurse = x==1
+                    break
+
+        if satisfied:
+            return (satisfied, recurse)
+        return None
+
+class FolderIndex:
+    # a tree of folders from a folder list; the parent of a folder is its nearest ancestor in the list
+    # children are kept in list order
+
+    def __init__(self, Folders:list):
+        self.folders = Folders
+        self.roots = []
+        self.children = [[] for _ in Folders]
+        index = {}
+        for x, path in enumerate(Folders):
+            index.setdefault(path, x)
+
+        for x, path in enumerate(Folders):
+            parent = None
+            current = path
+            while True:
+                up = os.path.dirname(current)
+                if up == current or up == '':
+                    break
+                if up in index:
+                    parent = index[up]
+                    break
+                current = up
+            if parent is None:
+                self.roots.append(x)
+            else:
+                self.children[parent].append(x)
+
+    def GetFolder(self, Index:int)->str:
+        return self.folders[Index]
+
+    def GetRoots(self)->list:
+        return self.roots
+
+    def GetChildren(self, Index:int)->list:
+        return self.children[Index]
+
 class FolderSet:
-    def __init__(self, RootPath:str|FolderSection, Rules:uConfigSection|list=None, Exclude:list=None, ApplyTags=True):
+    def __init__(self, RootPath:str|FolderSection, Rules:uConfigSection|list=None, Exclude:list=None, ApplyTags=True, Kind:str="folder exclude"):
         # paths included in Exclude will be excluded from the scan
         # if Section is None, then all subfolders will be included
+        # Kind describes Rules in a rule profile
+        self.kind = Kind
         self.root = SyncUtils.NormalizePath(RootPath) if isinstance(RootPath,str) else RootPath.GetPath()
         self.folders = []
         self.folder_tags = {}
+        self.tag_sets = {}
         self.filters = []
-        self.exclude = []
+        self.exclude = set()
         if isinstance(Exclude, list):
             for path in Exclude:
-                self.exclude.append(SyncUtils.NormalizePath(path))
+                self.exclude.add(SyncUtils.NormalizePath(path))
 
         if Rules is None:
-            self.__append_path(RootPath)
-            subfolders = uFolder.FindFiles(RootPath, Recurse=True, Files=False, Folders=True)
+            self.__append_path(self.root)
+            subfolders = FolderTree.GetTree(self.root).FindFolders(self.root, Recurse=True)
             for subfolder in subfolders:
-                self.__append_path(SyncUtils.NormalizePath(subfolder))
+                self.__append_path(self.__normalize_subfolder(subfolder))
         else:
             self.filters = self.__process_filter_rules(Rules)
+            self.filter_index = FolderRuleIndex(self.filters)
             self.start_filter_recursion()
 
             if ApplyTags:
@@ -72,7 +207,7 @@ class FolderSet:
     def GetFoldersWithTags(self)->list:
         return [{'folder':f, 'tags':self.GetFolderTags(f)} for f in self.folders]
     
-    def GetFolderTags(self, inFolderPath)->set:
+    def GetFolderTags(self, inFolderPath)->frozenset:
         if inFolderPath in self.folder_tags:
             return self.folder_tags[inFolderPath]
         return None
@@ -92,23 +227,17 @@ class FolderSet:
                     SyncUtils.Logger.WriteWarning(f"Folder filter failed interpretation: {line}")
         return filters
 
+    def __normalize_subfolder(self, inPath)->str:
+        # subfolders are found under a normalized folder; only linked folders need to be resolved
+        return SyncUtils.NormalizeChild(os.path.dirname(inPath), os.path.basename(inPath), FolderTree.GetTree(inPath).IsLinked(inPath))
+
     def __in_exclude(self, inPath)->bool:
-        for ex in self.exclude:
-            # if SyncUtils.PathIsUnder(ex, inPath, SameIsUnder=True):
-            if ex==inPath:
-                return True
-        return False
+        return inPath in self.exclude
     
     def __append_path(self, inPath):
         if self.__in_exclude(inPath) is False:
             self.folders.append(inPath)
 
-    def __apply_path_tag(self, inPath, inTag):
-        if inPath in self.folder_tags:
-            self.folder_tags[inPath].update({inTag})
-        else:
-            self.folder_tags[inPath] = {inTag}
-
     def __interpret_filter(self, inFilter)->dict|bool:
         split = self.split_filter(inFilter)
         if split is False:
@@ -170,7 +299,7 @@ class FolderSet:
 
     def split_filter(self, inFilter:str)->dict|bool:
         # splits a string filter string into a dict describing the filter
-        split = {'cond':None, 'recurse':True, 'tag':None}
+        split = {'cond':None, 'recurse':True, 'tag':None, 'text':inFilter.strip()}
         fsplit=inFilter.split('|')
         for x in range(len(fsplit)):
             part = fsplit[x].strip()
@@ -228,49 +357,80 @@ class FolderSet:
         if os.path.isdir(self.root):
             self.recurse_filter(self.root)
 
-    def recurse_filter(self, inPath)->list:
+    def profile_filter(self, inPath, inFilter, inKind)->tuple|None:
+        # evaluate_filter(), counted and timed in the active rule profile
+        start = time.perf_counter()
+        test = self.evaluate_filter(inPath, inFilter)
+        profile = RuleProfile.Active
+        profile.AddRule(profile.GetRule(inKind, inFilter['text']), test is not None, time.perf_counter()-start)
+        return test
+
+    def profile_filters(self, inPath)->tuple|None:
+        # FolderRuleIndex.Evaluate(), evaluating every filter in turn
         satisfied = False
         recurse = False
         for filter in self.filters:
-            if satisfied is False or filter['recurse'] is True:
-                test = self.evaluate_filter(inPath, filter)
-                if test is not None:
-                    satisfied = True
-                    if test[0] is True:
-                        recurse = True
-                        break
+            test = self.profile_filter(inPath, filter, self.kind)
+            if test is not None:
+                satisfied = True
+                recurse = recurse or test[0] is True
+        if satisfied:
+            return (satisfied, recurse)
+        return None
+
+    def recurse_filter(self, inPath)->list:
+        # a folder is satisfied when any filter matches; subfolders are included when any recursive filter matches
+        test = self.filter_index.Evaluate(inPath) if RuleProfile.Active is None else self.profile_filters(inPath)
+        satisfied = test is not None
+        recurse = satisfied and test[1]
 
         if satisfied:
             self.__append_path(inPath)
             if recurse:
-                subfolders = uFolder.FindFiles(inPath, Recurse=True, Files=False, Folders=True)
+                subfolders = FolderTree.GetTree(inPath).FindFolders(inPath, Recurse=True)
                 for subfolder in subfolders:
-                    self.__append_path(SyncUtils.NormalizePath(subfolder))
+                    self.__append_path(self.__normalize_subfolder(subfolder))
                 return
 
-        subfolders = uFolder.FindFiles(inPath, Recurse=False, Files=False, Folders=True)
+        subfolders = FolderTree.GetTree(inPath).FindFolders(inPath)
         for subfolder in subfolders:
-            self.recurse_filter(SyncUtils.NormalizePath(subfolder))
+            self.recurse_filter(self.__normalize_subfolder(subfolder))
 
     def start_folder_tags_recursion(self, inFilters=None):
+        # applies tags in a single depth-first pass over the folder tree
+        # a tag applies to a folder when a filter matches the folder, or a recursive filter matches an ancestor
         if inFilters is None:
             inFilters = self.filters
-        for filter in inFilters:
-            if filter['tag'] is not None:
-                scan_folders = self.folders
-                self.recurse_apply_tags(scan_folders, filter)
-
-    def recurse_apply_tags(self, inFolders, filter):
-        for x in range(len(inFolders)):
-            path = inFolders[x]
-            test = self.evaluate_filter(path, filter)
-            if test is not None:
-                if test[0] is False:
-                    self.__apply_path_tag(path, test[1])
-                else:
-                    for path2 in inFolders:
-                        if path2.startswith(path):
-                            self.__apply_path_tag(path2, test[1])
-                    folders = [inFolders[y] for y in range(len(inFolders)) if y>x and inFolders[y].startswith(path) is False]
-                    self.recurse_apply_tags(folders, filter)
-                    return
+        tag_filters = [filter for filter in inFilters if filter['tag'] is not None]
+        if len(tag_filters)==0:
+            return
+
+        profile = RuleProfile.Active
+        index = FolderIndex(self.folders)
+        empty = self.__intern_tags(frozenset())
+        stack = [(x, empty) for x in reversed(index.GetRoots())]
+        while len(stack)>0:
+            x, inherited = stack.pop()
+            path = index.GetFolder(x)
+            tags = inherited
+            passed = inherited
+            for filter in tag_filters:
+                if filter['tag'] in passed or (filter['tag'] in tags and filter['recurse'] is False):
+                    continue
+                test = self.evaluate_filter(path, filter) if profile is None else self.profile_filter(path, filter, "folder tag")
+                if test is not None:
+                    tags = self.__intern_tags(tags | {test[1]})
+                    if test[0] is True:
+                        passed = self.__intern_tags(passed | {test[1]})
+
+            if len(tags)>0:
+                if path in self.folder_tags:
+                    tags = self.__intern_tags(self.folder_tags[path] | tags)
+                self.folder_tags[path] = tags
+
+            for child in reversed(index.GetChildren(x)):
+                stack.append((child, passed))
+
+    def __intern_tags(self, in_tags:frozenset)->frozenset:
+        # folders with the same tags share a single frozenset
+        return self.tag_sets.setdefault(in_tags, in_tags)
@@ -0,0 +1,366 @@
+# Copyright (c) 2025 M. Fairbanks
+#
+# This source code is licensed under the Apache License, Version 2.0, found in the
+# LICENSE file in the root directory of this source tree.
+
+import os
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+
+'''
+A FolderTree is an in-memory snapshot of a folder tree, built by a single os.scandir() walk.
+
+Each folder in the snapshot records:
+- Subfolder names, in directory order
+- Files, with cached (size, mtime) taken from the directory entry
+
+Snapshots are shared through FolderTree.GetTree(), so every scan stage reads the same walk of a root.
+Symbolic links to folders are listed, but not followed.  A folder that is not part of a snapshot is
+scanned (without recursion) the first time it is requested.
+
+When a ScanCache is set, the names of a folder whose modification time is unchanged are read from the cache instead of
+being listed.  Each file is still read with os.stat(), since rewriting a file in place does not change the modification
+time of its folder.  With TrustFiles, the cached size and mtime of files are also reused, and a file rewritten in place is
+not detected.
+
+A snapshot taken by a scan worker process is returned as compact columns by GetColumns(), and added to the main process
+by FromColumns().  With a ScanCache, each folder records whether it was listed, read from the cache, or read from the
+cache with changed files, so that the main process updates its cache as if it had walked the folder.
+
+A ScanScheduler walks several roots at the same time, on a pool of threads.  Roots are usually on different devices
+(source, target, clean folder), so walking them together takes about as long as the slowest walk.
+'''
+
+class FolderTree:
+    Trees:dict = {}
+    Cache = None
+    TrustFiles:bool = False
+
+    # cache state of a folder in columns
+    CacheNone = 0       # no scan cache
+    CacheListed = 1     # listed, and written to the cache
+    CacheReused = 2     # read from the cache, unchanged
+    CacheUpdated = 3    # read from the cache, with changed files written to the cache
+
+    def __init__(self, RootPath:str):
+        self.root = RootPath
+        self.folders = {}
+        self.cache_state = {}   # folder path: (folder mtime, cache state)
+        self.stats = {'folders_listed':0, 'folders_cached':0, 'files_listed':0, 'stat_calls':0}
+        if FolderTree.Cache is not None:
+            FolderTree.Cache.AddRoot(RootPath)
+        self.__walk(RootPath)
+
+    @classmethod
+    def GetTree(cls, Path:str):
+        # returns the snapshot containing Path; the path is walked if no snapshot covers it
+        path = Path
+        while True:
+            if path in cls.Trees:
+                return cls.Trees[path]
+            parent = os.path.dirname(path)
+            if parent == path or parent == '':
+                break
+            path = parent
+
+        tree = FolderTree(Path)
+        cls.Trees[Path] = tree
+        return tree
+
+    @classmethod
+    def FromColumns(cls, Columns:dict):
+        # adds a snapshot from GetColumns(), such as from a scan worker process; returns the snapshot
+        tree = cls.__new__(cls)
+        tree.root = Columns['root']
+        tree.folders = {}
+        tree.cache_state = {}
+        tree.stats = dict(Columns['stats'])
+        cache = FolderTree.Cache
+        if cache is not None:
+            cache.AddRoot(tree.root)
+
+        names, sizes, mtimes = Columns['names'], Columns['sizes'], Columns['mtimes']
+        offset = 0
+        for x, path in enumerate(Columns['paths']):
+            end = offset+Columns['counts'][x]
+            node = (Columns['subfolders'][x], dict(zip(names[offset:end], zip(sizes[offset:end], mtimes[offset:end]))), set(Columns['links'][x]))
+            offset = end
+            tree.folders[path] = node
+            state = Columns['states'][x]
+            if cache is not None and state!=FolderTree.CacheNone:
+                cache.MergeFolder(path, Columns['folder_mtimes'][x], None if state==FolderTree.CacheReused else node, state!=FolderTree.CacheListed)
+
+        return cls.Trees.setdefault(tree.root, tree)
+
+    @classmethod
+    def DiscardTree(cls, Path:str, Recurse:bool=False):
+        # discards the snapshot of a root, such as a target folder that was changed by synchronization
+        # with Recurse, snapshots of roots under the path are also discarded
+        cls.Trees.pop(Path, None)
+        if Recurse:
+            prefix = os.path.join(Path, '')
+            for root in [root for root in cls.Trees if root.startswith(prefix)]:
+                del cls.Trees[root]
+
+    @classmethod
+    def RefreshFolder(cls, Path:str)->bool:
+        # lists a folder again after it has changed; returns True when subfolders changed
+        return cls.GetTree(Path).Refresh(Path)
+
+    @classmethod
+    def Reset(cls):
+        # discards all snapshots
+        cls.Trees = {}
+
+    @classmethod
+    def SetCache(cls, Cache, TrustFiles:bool=False):
+        # ScanCache used when listing folders, or None
+        # with TrustFiles, files of unchanged folders are not read, and a file rewritten in place is not detected
+        cls.Cache = Cache
+        cls.TrustFiles = TrustFiles
+
+    def GetStats(self)->dict:
+        # returns counts of folders listed, folders read from the scan cache, files listed and stat calls
+        return self.stats
+
+    def GetRoot(self)->str:
+        return self.root
+
+    def GetColumns(self)->dict:
+        # returns the snapshot as compact columns: one entry per folder, and files of all folders in folder order
+        columns = {'root':self.root, 'stats':self.stats, 'paths':[], 'subfolders':[], 'links':[], 'counts':array('q'),
+                   'names':[], 'sizes':array('q'), 'mtimes':array('d'), 'folder_mtimes':array('q'), 'states':array('b')}
+        for path, node in self.folders.items():
+            if node is None:
+                continue
+            columns['paths'].append(path)
+            columns['subfolders'].append(node[0])
+            columns['links'].append(list(node[2]))
+            columns['counts'].append(len(node[1]))
+            for name, (size, mtime) in node[1].items():
+                columns['names'].append(name)
+                columns['sizes'].append(size)
+                columns['mtimes'].append(mtime)
+            mtime, state = self.cache_state.get(path, (0, FolderTree.CacheNone))
+            columns['folder_mtimes'].append(mtime)
+            columns['states'].append(state)
+        return columns
+
+    def HasFolder(self, Path:str)->bool:
+        return self.__get_node(Path) is not None
+
+    def Refresh(self, Path:str)->bool:
+        # lists a folder of the snapshot again; returns True when subfolders changed
+        old_node = self.folders.get(Path)
+        node = self.__scan_folder(Path)
+        self.folders[Path] = node
+        old_names = set() if old_node is None else set(old_node[0])
+        names = set() if node is None else set(node[0])
+
+        # subfolders that were removed are discarded
+        for name in old_names-names:
+            prefix = os.path.join(Path, name)
+            for path in [p for p in self.folders if p==prefix or p.startswith(os.path.join(prefix, ''))]:
+                del self.folders[path]
+
+        # a new or removed folder is updated in its parent
+        parent_node = self.folders.get(os.path.dirname(Path))
+        if Path != self.root and parent_node is not None:
+            name = os.path.basename(Path)
+            if node is not None and name not in parent_node[0]:
+                parent_node[0].append(name)
+            elif node is None and name in parent_node[0]:
+                parent_node[0].remove(name)
+
+        return old_names!=names or (old_node is None)!=(node is None)
+
+    def FindFolders(self, Path:str, Recurse:bool=False)->list:
+        # returns subfolder paths, in the same order as a top-down os.walk()
+        ret_folders = []
+        if Recurse:
+            for path in self.__walk_folders(Path):
+                node = self.__get_node(path)
+                ret_folders.extend([os.path.join(path, name) for name in node[0]])
+        else:
+            node = self.__get_node(Path)
+            if node is not None:
+                ret_folders = [os.path.join(Path, name) for name in node[0]]
+
+        return ret_folders
+
+    def IsLinked(self, Path:str)->bool:
+        # True when a folder is a symbolic link in its parent folder
+        node = self.__get_node(os.path.dirname(Path))
+        return node is not None and os.path.basename(Path) in node[2]
+
+    def FindFiles(self, Path:str)->dict:
+        # returns {name: (size, mtime)} for files in a folder
+        node = self.__get_node(Path)
+        if node is None:
+            return {}
+        return node[1]
+
+    def GetFile(self, Path:str, Name:str)->tuple|None:
+        # returns (size, mtime) for a file, or None if the file does not exist
+        node = self.__get_node(Path)
+        if node is None:
+            return None
+        return node[1].get(Name)
+
+    def WalkFiles(self, Path:str):
+        # yields (folder path, {name: (size, mtime)}) for every folder under Path that contains files
+        for path in self.__walk_folders(Path):
+            node = self.__get_node(path)
+            if len(node[1])>0:
+                yield (path, node[1])
+
+    def __walk_folders(self, in_path):
+        # yields folder paths top-down, without following links
+        if self.__get_node(in_path) is None:
+            return
+        stack = [in_path]
+        while len(stack)>0:
+            path = stack.pop()
+            node = self.__get_node(path)
+            if node is None:
+                continue
+            yield path
+            for name in reversed(node[0]):
+                if name not in node[2]:
+                    stack.append(os.path.join(path, name))
+
+    def __walk(self, in_root):
+        stack = [in_root]
+        while len(stack)>0:
+            path = stack.pop()
+            node = self.__scan_folder(path)
+            if node is None:
+                continue
+            self.folders[path] = node
+            for name in reversed(node[0]):
+                if name not in node[2]:
+                    stack.append(os.path.join(path, name))
+
+    def __get_node(self, in_path):
+        if in_path in self.folders:
+            return self.folders[in_path]
+        node = self.__scan_folder(in_path)
+        self.folders[in_path] = node
+        return node
+
+    def __scan_folder(self, in_path):
+        # returns ([subfolder names], {file name: (size, mtime)}, {linked subfolder names})
+        cache = FolderTree.Cache
+        if cache is not None:
+            self.stats['stat_calls'] += 1
+            try:
+                mtime = os.stat(in_path).st_mtime_ns
+            except OSError:
+                return None
+            node = cache.GetFolder(in_path, mtime)
+            if node is not None:
+                self.stats['folders_cached'] += 1
+                if FolderTree.TrustFiles:
+                    self.cache_state[in_path] = (mtime, FolderTree.CacheReused)
+                    return node
+                return self.__stat_files(in_path, mtime, node)
+
+        folders = []
+        files = {}
+        links = set()
+        try:
+            with os.scandir(in_path) as it:
+                for entry in it:
+                    try:
+                        if entry.is_dir():
+                            folders.append(entry.name)
+                            if entry.is_symlink():
+                                links.add(entry.name)
+                        elif entry.is_file():
+                            self.stats['stat_calls'] += 1
+                            stat = entry.stat()
+                            files[entry.name] = (stat.st_size, stat.st_mtime)
+                    except OSError:
+                        pass
+        except OSError:
+            return None
+
+        self.stats['folders_listed'] += 1
+        self.stats['files_listed'] += len(files)
+
+        if cache is not None:
+            cache.SetFolder(in_path, mtime, (folders, files, links))
+            self.cache_state[in_path] = (mtime, FolderTree.CacheListed)
+
+        return (folders, files, links)
+
+    def __stat_files(self, in_path, in_mtime, in_node):
+        # reads the size and mtime of each file of a cached folder; the cache is updated when a file changed
+        folders, cached_files, links = in_node
+        files = {}
+        for name in cached_files:
+            try:
+                self.stats['stat_calls'] += 1
+                stat = os.stat(os.path.join(in_path, name))
+                files[name] = (stat.st_size, stat.st_mtime)
+            except OSError:
+                pass
+        self.stats['files_listed'] += len(files)
+
+        node = (folders, files, links)
+        if files!=cached_files:
+            FolderTree.Cache.SetFolder(in_path, in_mtime, node)
+            self.cache_state[in_path] = (in_mtime, FolderTree.CacheUpdated)
+        else:
+            self.cache_state[in_path] = (in_mtime, FolderTree.CacheReused)
+        return node
+
+class ScanScheduler:
+    def __init__(self):
+        self.executor = None
+        self.pending = []
+
+    def Start(self, Paths:list):
+        # starts walking each path that is not already part of a snapshot, or under another path
+        paths = []
+        for path in Paths:
+            if path is None or path in paths:
+                continue
+            if any([ScanScheduler.__is_under(path, other) for other in Paths if other is not None and other!=path]):
+                continue
+            if ScanScheduler.__has_tree(path):
+                continue
+            paths.append(path)
+
+        if len(paths)>0:
+            self.executor = ThreadPoolExecutor(max_workers=len(paths))
+            self.pending = [(path, self.executor.submit(FolderTree, path)) for path in paths]
+
+    def Join(self)->int:
+        # waits for walks to complete and adds snapshots, in the order paths were specified; returns the number of snapshots added
+        count = 0
+        for path, future in self.pending:
+            if path not in FolderTree.Trees:
+                FolderTree.Trees[path] = future.result()
+                count += 1
+        self.pending = []
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+        return count
+
+    @staticmethod
+    def __is_under(in_path, in_root)->bool:
+        root = os.path.join(in_root, '')
+        return in_path.startswith(root)
+
+    @staticmethod
+    def __has_tree(in_path)->bool:
+        path = in_path
+        while True:
+            if path in FolderTree.Trees:
+                return True
+            parent = os.path.dirname(path)
+            if parent == path or parent == '':
+                return False
+            path = parent
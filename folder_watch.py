@@ -0,0 +1,174 @@
+# Copyright (c) 2025 M. Fairbanks
+#
+# This source code is licensed under the Apache License, Version 2.0, found in the
+# LICENSE file in the root directory of this source tree.
+
+import os, sys, time, select, struct, ctypes, ctypes.util
+
+'''
+A FolderWatch reports folders that change under a set of root folders, using Linux inotify.
+
+Every folder under a root is watched.  Events are collected into batches:
+- A batch starts with the first event, and ends when no event is received for Delay seconds
+- A batch also ends MaxDelay seconds after it started, so that constant changes are still synchronized
+
+Each batch reports:
+- Folders where a file was created, modified, removed or renamed
+- Folders where a subfolder was created, removed or renamed; new subfolders are watched, and reported as changed
+- Overflow, when the kernel event queue overflowed and changes may have been missed
+'''
+
+class FolderWatch:
+    IN_MODIFY = 0x00000002
+    IN_ATTRIB = 0x00000004
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_DELETE_SELF = 0x00000400
+    IN_MOVE_SELF = 0x00000800
+    IN_Q_OVERFLOW = 0x00004000
+    IN_IGNORED = 0x00008000
+    IN_ONLYDIR = 0x01000000
+    IN_ISDIR = 0x40000000
+    IN_NONBLOCK = 0x00000800
+    IN_CLOEXEC = 0x00080000
+
+    WatchMask = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR
+    EventHeader = struct.Struct('iIII')
+
+    def __init__(self, Delay:float=2.0, MaxDelay:float=None):
+        self.delay = Delay
+        self.max_delay = MaxDelay if MaxDelay is not None else max(Delay*10, 10.0)
+        self.watches = {}       # watch descriptor: folder path
+        self.paths = {}         # folder path: watch descriptor
+        self.failed = []        # folders that could not be watched
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.fd = self.libc.inotify_init1(FolderWatch.IN_NONBLOCK | FolderWatch.IN_CLOEXEC)
+        if self.fd<0:
+            raise OSError(ctypes.get_errno(), f"inotify_init1 failed: {os.strerror(ctypes.get_errno())}")
+
+    @staticmethod
+    def IsSupported()->bool:
+        if sys.platform.startswith('linux') is False:
+            return False
+        libc = ctypes.util.find_library('c')
+        return libc is not None and hasattr(ctypes.CDLL(libc), 'inotify_init1')
+
+    def GetWatchCount(self)->int:
+        return len(self.watches)
+
+    def GetFailures(self)->list:
+        # returns folders that could not be watched, such as when fs.inotify.max_user_watches is exceeded
+        return self.failed
+
+    def AddTree(self, Path:str)->list:
+        # watches a folder and its subfolders; returns the folders watched
+        added = []
+        for folder, subfolders, _ in os.walk(Path):
+            if self.__add_watch(folder):
+                added.append(folder)
+            else:
+                subfolders.clear()
+        return added
+
+    def Wait(self, Timeout:float=None)->tuple|None:
+        # waits for a batch of changes; returns (changed folders, subfolders changed, overflow), or None after Timeout seconds without changes
+        changed = set()
+        structure = set()
+        overflow = False
+        start = time.monotonic()
+        first = None
+        while True:
+            now = time.monotonic()
+            if first is None:
+                wait = 1.0 if Timeout is None else min(1.0, max(0.0, start+Timeout-now))
+            else:
+                wait = max(0.0, min(self.delay, first+self.max_delay-now))
+
+            ready, _, _ = select.select([self.fd], [], [], wait)
+            if len(ready)==0:
+                if first is not None:
+                    break
+                if Timeout is not None and time.monotonic()-start>=Timeout:
+                    return None
+                continue
+
+            if first is None:
+                first = time.monotonic()
+            overflow = self.__read_events(changed, structure) or overflow
+            if time.monotonic()-first>=self.max_delay:
+                break
+
+        return (changed, structure, overflow)
+
+    def Close(self):
+        if self.fd>=0:
+            os.close(self.fd)
+            self.fd = -1
+        self.watches = {}
+        self.paths = {}
+
+    def __add_watch(self, in_path)->bool:
+        if in_path in self.paths:
+            return True
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(in_path), FolderWatch.WatchMask)
+        if wd<0:
+            self.failed.append(in_path)
+            return False
+        self.watches[wd] = in_path
+        self.paths[in_path] = wd
+        return True
+
+    def __remove_tree(self, in_path):
+        # stops watching a folder that was moved, and its subfolders; the new location is watched by its parent
+        prefix = os.path.join(in_path, '')
+        for path in [p for p in self.paths if p==in_path or p.startswith(prefix)]:
+            wd = self.paths.pop(path)
+            self.watches.pop(wd, None)
+            self.libc.inotify_rm_watch(self.fd, wd)
+
+    def __read_events(self, in_changed:set, in_structure:set)->bool:
+        # reads available events; returns True on queue overflow
+        overflow = False
+        try:
+            data = os.read(self.fd, 65536)
+        except BlockingIOError:
+            return False
+
+        offset = 0
+        while offset+FolderWatch.EventHeader.size<=len(data):
+            wd, mask, _, length = FolderWatch.EventHeader.unpack_from(data, offset)
+            offset += FolderWatch.EventHeader.size
+            name = os.fsdecode(data[offset:offset+length].rstrip(b'\0'))
+            offset += length
+
+            if mask & FolderWatch.IN_Q_OVERFLOW:
+                overflow = True
+                continue
+
+            folder = self.watches.get(wd)
+            if folder is None:
+                continue
+
+            if mask & FolderWatch.IN_IGNORED:
+                del self.watches[wd]
+                self.paths.pop(folder, None)
+                continue
+
+            if mask & (FolderWatch.IN_DELETE_SELF | FolderWatch.IN_MOVE_SELF):
+                in_structure.add(os.path.dirname(folder))
+                in_changed.add(os.path.dirname(folder))
+                if mask & FolderWatch.IN_MOVE_SELF:
+                    self.__remove_tree(folder)
+                continue
+
+            in_changed.add(folder)
+            if mask & FolderWatch.IN_ISDIR:
+                in_structure.add(folder)
+                if mask & (FolderWatch.IN_CREATE | FolderWatch.IN_MOVED_TO):
+                    # files may be created before the new folder is watched
+                    in_changed.update(self.AddTree(os.path.join(folder, name)))
+
+        return overflow
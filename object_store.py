@@ -0,0 +1,114 @@
+# Copyright (c) 2025 M. Fairbanks
+#
+# This source code is licensed under the Apache License, Version 2.0, found in the
+# LICENSE file in the root directory of this source tree.
+
+import os, threading
+
+from file_compare import FileHasher
+from file_copy import *
+
+'''
+An ObjectStore keeps file contents once, by content hash, and places target files as hardlinks to stored contents.
+
+Contents are stored as objects in a folder under the target path, named by content hash:
+- {store}/ab/cdef0123...: the contents of every file with hash abcdef0123...
+- A target file is a hardlink to its object, so duplicate files use one copy of the data
+- A new object is copied to a temporary file in the store, then renamed, so an object is never partially written
+
+An object that is not linked from any target or clean file is removed by Prune().  When a file system does not
+support a hardlink, such as when an object has too many links, the object is copied to the target file instead.
+'''
+
+class ObjectStore:
+    FolderName = ".sync-objects"
+    TempPrefix = "tmp-"
+
+    def __init__(self, TargetPath:str):
+        self.path = os.path.join(TargetPath, ObjectStore.FolderName)
+        self.lock = threading.Lock()
+        self.added_objects = 0
+        self.added_bytes = 0
+        self.linked_files = 0
+        self.linked_bytes = 0
+        self.copied_links = 0
+
+    def GetPath(self)->str:
+        return self.path
+
+    def GetStats(self)->dict:
+        return {'added_objects':self.added_objects, 'added_bytes':self.added_bytes, 'linked_files':self.linked_files, 'linked_bytes':self.linked_bytes, 'copied_links':self.copied_links}
+
+    def GetObjectPath(self, Digest:str)->str:
+        return os.path.join(self.path, Digest[:2], Digest[2:])
+
+    def StoreFile(self, Source:str, Target:str, Copier:FileCopier)->CopyMethod|None:
+        # places Target with the contents of Source; returns the method used to copy a new object, or None when the contents were already stored
+        source_stat = os.stat(Source)
+        digest = FileHasher.HashFile(Source, source_stat.st_size)
+        if digest is None:
+            raise OSError(f"Unable to read source file: {Source}")
+
+        method = None
+        object_file = self.GetObjectPath(digest)
+        if os.path.isfile(object_file):
+            # the modification time of an object is the last time it was stored, so that MTIME compares it as current
+            os.utime(object_file)
+        else:
+            object_file, method = self.__add_object(Source, source_stat, digest, Copier)
+
+        self.__link(object_file, Target, Copier)
+        with self.lock:
+            if method is None:
+                self.linked_files += 1
+                self.linked_bytes += source_stat.st_size
+            else:
+                self.added_objects += 1
+                self.added_bytes += source_stat.st_size
+        return method
+
+    def Prune(self)->tuple:
+        # removes objects that are not linked from any file, and temporary files; returns (files, bytes) removed
+        files = 0
+        size = 0
+        if os.path.isdir(self.path) is False:
+            return (files, size)
+        for folder_path, _, folder_files in os.walk(self.path):
+            for name in folder_files:
+                filepath = os.path.join(folder_path, name)
+                try:
+                    stat = os.stat(filepath)
+                    if stat.st_nlink<=1 or name.startswith(ObjectStore.TempPrefix):
+                        os.remove(filepath)
+                        files += 1
+                        size += stat.st_size
+                except OSError:
+                    pass
+        return (files, size)
+
+    def __add_object(self, in_source, in_stat, in_digest, in_copier)->tuple:
+        # returns (object file, method)
+        os.makedirs(self.path, exist_ok=True)
+        temp_file = os.path.join(self.path, f"{ObjectStore.TempPrefix}{os.getpid()}-{threading.get_ident()}")
+        method = in_copier.Copy(in_source, temp_file)
+        source_stat = os.stat(in_source)
+        if (source_stat.st_size, source_stat.st_mtime_ns)!=(in_stat.st_size, in_stat.st_mtime_ns):
+            # the source file changed while it was copied; the copy is stored by its own contents
+            in_digest = FileHasher.HashFile(temp_file)
+            if in_digest is None:
+                raise OSError(f"Unable to read copied file: {temp_file}")
+
+        object_file = self.GetObjectPath(in_digest)
+        os.makedirs(os.path.dirname(object_file), exist_ok=True)
+        os.replace(temp_file, object_file)
+        return (object_file, method)
+
+    def __link(self, in_object, in_target, in_copier):
+        # an existing target file is replaced
+        temp_file = f"{in_target}.{ObjectStore.TempPrefix}link"
+        if os.path.lexists(temp_file):
+            os.remove(temp_file)
+        if in_copier.Link(in_object, temp_file) is not None:
+            with self.lock:
+                self.copied_links += 1
+        os.replace(temp_file, in_target)
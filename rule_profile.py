@@ -0,0 +1,87 @@
+# Copyright (c) 2025 M. Fairbanks
+#
+# This source code is licensed under the Apache License, Version 2.0, found in the
+# LICENSE file in the root directory of this source tree.
+
+'''
+A RuleProfile counts how often folder and file rules are evaluated and matched, and the time spent evaluating them.
+
+While a profile is active (RuleProfile.Active), rules are evaluated one condition at a time rather than through
+combined indexes, so that the cost of each rule and condition is measured.  Results are the same, but evaluation is
+slower; profiling is meant for tuning rules, not for every run.
+
+Statistics are kept for each rule, by folder section and kind of rule:
+- folder exclude, folder tag: evaluated once per folder
+- file include, file exclude: folder conditions (TAG, NTAG, NO_TAG, PARENT) are evaluated once per folder,
+  then name and size conditions once per file
+
+A rule is matched when all of its conditions are satisfied.  A condition is counted when it is evaluated; conditions
+after a condition that is not satisfied are not evaluated.
+'''
+
+class RuleProfile:
+    Active = None
+
+    def __init__(self):
+        self.section = None
+        self.rules = {}         # (section, kind, rule): {'evaluated', 'matched', 'seconds', 'conditions'}
+        self.size_tests = 0
+        self.stat_calls = 0
+
+    @classmethod
+    def SetSection(cls, Section:str):
+        # rules evaluated from now on are counted for a folder section
+        if cls.Active is not None:
+            cls.Active.section = Section
+
+    def GetRule(self, Kind:str, Rule:str)->dict:
+        key = (self.section, Kind, Rule)
+        if key not in self.rules:
+            self.rules[key] = {'evaluated':0, 'matched':0, 'seconds':0.0, 'conditions':{}}
+        return self.rules[key]
+
+    def AddCondition(self, RuleStats:dict, Condition:str, Matched:bool, Seconds:float):
+        condition = RuleStats['conditions'].setdefault(Condition, [0, 0, 0.0])
+        condition[0] += 1
+        condition[1] += 1 if Matched else 0
+        condition[2] += Seconds
+        RuleStats['seconds'] += Seconds
+
+    def AddRule(self, RuleStats:dict, Matched:bool, Seconds:float=0.0):
+        # Seconds of a rule evaluated as a whole; time of conditions is added by AddCondition
+        RuleStats['evaluated'] += 1
+        RuleStats['matched'] += 1 if Matched else 0
+        RuleStats['seconds'] += Seconds
+
+    def AddSizeTest(self):
+        # a SIZE_GT or SIZE_LT condition was evaluated
+        self.size_tests += 1
+
+    def AddStatCall(self):
+        # a file size was read from disk to evaluate a size condition
+        self.stat_calls += 1
+
+    def GetRules(self)->list:
+        # returns [(section, kind, rule, stats)], most expensive first
+        ranked = sorted(self.rules.items(), key=lambda item: item[1]['seconds'], reverse=True)
+        return [(key[0], key[1], key[2], stats) for key, stats in ranked]
+
+    def WriteReport(self, Logger, Limit:int=None):
+        # writes a table of rules ranked by evaluation time, with the conditions of each rule
+        rules = self.GetRules()
+        total = sum([stats['seconds'] for _, _, _, stats in rules])
+        Logger.WriteLine("")
+        Logger.WriteLine(f"[+GREEN]=== Rule profile: {len(rules)} rules; {total:.3f} sec[+]")
+        Logger.WriteLine(f"{'seconds':>9} {'evaluated':>10} {'matched':>10}  section / kind / rule")
+        for section, kind, rule, stats in rules[:Limit]:
+            color = "RED" if stats['matched']==0 else "VIOLET"
+            Logger.WriteLine(f"{stats['seconds']:9.4f} {stats['evaluated']:10} {stats['matched']:10}  [+{color}]{section} / {kind} / {rule}[+]")
+            for condition, counts in stats['conditions'].items():
+                Logger.WriteLine(f"{counts[2]:9.4f} {counts[0]:10} {counts[1]:10}    - {condition}")
+
+        never = [rule for _, _, rule, stats in rules if stats['matched']==0]
+        if len(never)>0:
+            Logger.WriteLine(f"[+RED]{len(never)} rules never matched[+]")
+        Logger.WriteLine(f"{self.size_tests} size conditions evaluated; {self.stat_calls} stat calls to read file size (other sizes are from the folder snapshot)")
+        if Limit is not None and len(rules)>Limit:
+            Logger.WriteLine(f"{len(rules)-Limit} rules not shown")
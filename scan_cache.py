@@ -0,0 +1,128 @@
+# Copyright (c) 2025 M. Fairbanks
+#
+# This source code is licensed under the Apache License, Version 2.0, found in the
+# LICENSE file in the root directory of this source tree.
+
+import os, json, sqlite3, pathlib, threading
+
+'''
+A ScanCache is an on-disk store of folder listings, used to avoid listing folders that have not changed since the last run.
+
+Each folder is stored by path with:
+- The folder modification time (nanoseconds)
+- Subfolder names and linked subfolder names
+- Files, with (size, mtime)
+
+Content hashes are stored by path, and are reused while the file size, modification time and inode are unchanged.
+
+A folder listing is reused when the folder modification time is unchanged.  Adding, removing or renaming a file
+changes the folder modification time, but rewriting a file in place does not, so the size and mtime of a file in a
+reused listing are only current when they are read again (see FolderTree.TrustFiles).
+
+A scan worker process opens the cache with ReadOnly, so that only the main process writes to it.  Folders listed or
+reused by a worker are added to the cache of the main process with MergeFolder().
+'''
+
+class ScanCache:
+    Version = 1
+
+    def __init__(self, Filepath:str, ReadOnly:bool=False):
+        self.filepath = Filepath
+        self.read_only = ReadOnly
+        self.lock = threading.Lock()
+        self.run = 0
+        self.roots = []
+        self.hits = 0
+        self.misses = 0
+        if ReadOnly:
+            self.db = sqlite3.connect(pathlib.Path(os.path.abspath(Filepath)).as_uri()+"?mode=ro", uri=True, check_same_thread=False)
+        else:
+            self.db = sqlite3.connect(Filepath, check_same_thread=False)
+            self.__init_schema()
+
+    def __init_schema(self):
+        with self.lock:
+            self.db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+            row = self.db.execute("SELECT value FROM meta WHERE key='version'").fetchone()
+            if row is None or int(row[0])!=ScanCache.Version:
+                self.db.execute("DROP TABLE IF EXISTS folders")
+                self.db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('version', ?)", (str(ScanCache.Version),))
+            self.db.execute("CREATE TABLE IF NOT EXISTS folders (path TEXT PRIMARY KEY, mtime INTEGER, listing TEXT, run INTEGER)")
+            self.db.execute("CREATE TABLE IF NOT EXISTS hashes (path TEXT PRIMARY KEY, size INTEGER, mtime INTEGER, inode INTEGER, digest TEXT, run INTEGER)")
+            row = self.db.execute("SELECT value FROM meta WHERE key='run'").fetchone()
+            self.run = 1 if row is None else int(row[0])+1
+            self.db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('run', ?)", (str(self.run),))
+            self.db.commit()
+
+    def GetFilepath(self)->str:
+        return self.filepath
+
+    def GetStats(self)->tuple:
+        # returns (folders reused, folders listed)
+        return (self.hits, self.misses)
+
+    def AddRoot(self, Path:str):
+        # records a root that was walked this run; unseen folders under a root are purged on Close()
+        with self.lock:
+            if Path not in self.roots:
+                self.roots.append(Path)
+
+    def GetFolder(self, Path:str, Mtime:int)->tuple|None:
+        # returns ([subfolder names], {file name: (size, mtime)}, {linked subfolder names}) when the folder is unchanged
+        with self.lock:
+            row = self.db.execute("SELECT mtime, listing FROM folders WHERE path=?", (Path,)).fetchone()
+            if row is None or row[0]!=Mtime:
+                self.misses += 1
+                return None
+            if self.read_only is False:
+                self.db.execute("UPDATE folders SET run=? WHERE path=?", (self.run, Path))
+            self.hits += 1
+
+        listing = json.loads(row[1])
+        files = {name:tuple(stat) for name, stat in listing['files'].items()}
+        return (listing['folders'], files, set(listing['links']))
+
+    def SetFolder(self, Path:str, Mtime:int, Node:tuple):
+        if self.read_only:
+            return
+        listing = json.dumps({'folders':Node[0], 'files':Node[1], 'links':list(Node[2])})
+        with self.lock:
+            self.db.execute("INSERT OR REPLACE INTO folders (path, mtime, listing, run) VALUES (?, ?, ?, ?)", (Path, Mtime, listing, self.run))
+
+    def MergeFolder(self, Path:str, Mtime:int, Node:tuple|None, Reused:bool):
+        # adds a folder scanned by a worker process; Node is None when the cached listing was reused unchanged
+        with self.lock:
+            if Reused:
+                self.hits += 1
+            else:
+                self.misses += 1
+            if Node is None:
+                self.db.execute("UPDATE folders SET run=? WHERE path=?", (self.run, Path))
+        if Node is not None:
+            self.SetFolder(Path, Mtime, Node)
+
+    def GetHash(self, Path:str, Size:int, Mtime:int, Inode:int)->str|None:
+        # returns the content hash of a file when size, mtime and inode are unchanged
+        with self.lock:
+            row = self.db.execute("SELECT size, mtime, inode, digest FROM hashes WHERE path=?", (Path,)).fetchone()
+            if row is None or row[0]!=Size or row[1]!=Mtime or row[2]!=Inode:
+                return None
+            self.db.execute("UPDATE hashes SET run=? WHERE path=?", (self.run, Path))
+        return row[3]
+
+    def SetHash(self, Path:str, Size:int, Mtime:int, Inode:int, Digest:str):
+        with self.lock:
+            self.db.execute("INSERT OR REPLACE INTO hashes (path, size, mtime, inode, digest, run) VALUES (?, ?, ?, ?, ?, ?)", (Path, Size, Mtime, Inode, Digest, self.run))
+
+    def Close(self):
+        # purges folders that were not seen under a walked root, and commits
+        if self.read_only:
+            self.db.close()
+            return
+        with self.lock:
+            for root in self.roots:
+                prefix = os.path.join(root, '')
+                self.db.execute("DELETE FROM folders WHERE run<>? AND (path=? OR substr(path, 1, ?)=?)", (self.run, root, len(prefix), prefix))
+                self.db.execute("DELETE FROM hashes WHERE run<>? AND substr(path, 1, ?)=?", (self.run, len(prefix), prefix))
+            self.db.commit()
+            self.db.close()
@@ -0,0 +1,111 @@
+# Copyright (c) 2025 M. Fairbanks
+#
+# This source code is licensed under the Apache License, Version 2.0, found in the
+# LICENSE file in the root directory of this source tree.
+
+from array import array
+
+'''
+A ScanStore holds the scanned files of a folder section in compact columns, rather than a tuple per file.
+
+Each scanned folder has a ScanFileList with:
+- File names, shared with the folder snapshot
+- File sizes, as a 64-bit integer array
+- File status, as a byte array of status codes
+
+Status strings ('NEW', 'MOD', 'SAME', '*MOVE') are referenced by a fixed code; any other status is a ValueError.
+Per-status file counts and sizes are updated as files are added and status changes, so totals do not walk the files.
+
+A ScanFileList behaves as a list of (name, size, status) tuples; a file without status is (name, size).
+'''
+
+class ScanStore:
+    Status:tuple = ('', 'NEW', 'MOD', 'SAME', '*MOVE')
+    StatusCodes:dict = {status:code for code, status in enumerate(Status)}
+
+    def __init__(self):
+        self.counts = array('q', [0]*len(ScanStore.Status))
+        self.sizes = array('q', [0]*len(ScanStore.Status))
+
+    @staticmethod
+    def GetStatusCode(Status:str)->int:
+        code = ScanStore.StatusCodes.get(Status)
+        if code is None:
+            raise ValueError(f"Unknown scan status: {Status}")
+        return code
+
+    def CreateFileList(self, Files:list=None):
+        # returns an empty ScanFileList, or a ScanFileList of (name, size[, status]) tuples
+        files = ScanFileList(self)
+        if Files is not None:
+            for file in Files:
+                files.Append(file[0], file[1], file[2] if len(file)>2 else '')
+        return files
+
+    def RemoveFileList(self, Files):
+        # removes files of a ScanFileList from totals, when a folder is scanned again
+        for size, code in zip(Files.sizes, Files.codes):
+            self.update_totals(code, -1, -size)
+
+    def GetTotals(self, Status:str)->tuple:
+        # returns (file count, total size) of files with the specified status; a status that is not stored has no files
+        code = ScanStore.StatusCodes.get(Status)
+        if code is None:
+            return (0, 0)
+        return (self.counts[code], self.sizes[code])
+
+    def GetFileCount(self)->int:
+        return sum(self.counts)
+
+    def update_totals(self, in_code, in_count, in_size):
+        self.counts[in_code] += in_count
+        self.sizes[in_code] += in_size
+
+class ScanFileList:
+    __slots__ = ('store', 'names', 'sizes', 'codes')
+
+    def __init__(self, Store:ScanStore):
+        self.store = Store
+        self.names = []
+        self.sizes = array('q')
+        self.codes = array('B')
+
+    def Append(self, Name:str, Size:int, Status:str=''):
+        code = ScanStore.GetStatusCode(Status)
+        self.names.append(Name)
+        self.sizes.append(Size)
+        self.codes.append(code)
+        self.store.update_totals(code, 1, Size)
+
+    def GetStatus(self, Index:int)->str:
+        return ScanStore.Status[self.codes[Index]]
+
+    def SetStatus(self, Index:int, Status:str):
+        code = ScanStore.GetStatusCode(Status)
+        size = self.sizes[Index]
+        self.store.update_totals(self.codes[Index], -1, -size)
+        self.store.update_totals(code, 1, size)
+        self.codes[Index] = code
+
+    def __len__(self):
+        return len(self.names)
+
+    def __getitem__(self, Index:int)->tuple:
+        code = self.codes[Index]
+        if code==0:
+            return (self.names[Index], self.sizes[Index])
+        return (self.names[Index], self.sizes[Index], ScanStore.Status[code])
+
+    def __setitem__(self, Index:int, File:tuple):
+        # the file name and size are unchanged; status is updated
+        if File[0]!=self.names[Index] or File[1]!=self.sizes[Index]:
+            raise ValueError(f"Scan file mismatch: {File[0]} ({File[1]}) replaces {self.names[Index]} ({self.sizes[Index]})")
+        self.SetStatus(Index, File[2] if len(File)>2 else '')
+
+    def __iter__(self):
+        status = ScanStore.Status
+        for name, size, code in zip(self.names, self.sizes, self.codes):
+            if code==0:
+                yield (name, size)
+            else:
+                yield (name, size, status[code])
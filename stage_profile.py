@@ -0,0 +1,64 @@
+# Copyright (c) 2025 M. Fairbanks
+#
+# This source code is licensed under the Apache License, Version 2.0, found in the
+# LICENSE file in the root directory of this source tree.
+
+import os, cProfile, tracemalloc
+
+'''
+A StageProfiler runs cProfile and tracemalloc for each stage of a run, and writes the results to a folder.
+
+For each stage, two files are written, named with the run prefix (such as a {TSM} timestamp) and the stage name:
+- {prefix}-{stage}.prof: cProfile statistics, for pstats or a viewer such as snakeviz
+- {prefix}-{stage}.snapshot: tracemalloc snapshot of memory allocated during the stage and still held when it ended
+
+A stage entered while another stage is profiled is part of the outer stage.  A stage entered again writes files with
+a numbered suffix.
+
+Only the current process is profiled; folders scanned by worker processes (ScanWorkers) are not included.
+'''
+
+class StageProfiler:
+    TraceFrames = 10
+
+    def __init__(self, Folder:str, Prefix:str):
+        self.folder = Folder
+        self.prefix = Prefix
+        self.active = None
+        self.profile = None
+        self.counts = {}
+        self.files = []
+        os.makedirs(Folder, exist_ok=True)
+
+    def GetFiles(self)->list:
+        # returns files written
+        return self.files
+
+    def Start(self, Stage:str)->bool:
+        # returns False when another stage is being profiled
+        if self.active is not None:
+            return False
+        self.active = Stage
+        tracemalloc.start(StageProfiler.TraceFrames)
+        self.profile = cProfile.Profile()
+        self.profile.enable()
+        return True
+
+    def Stop(self, Stage:str):
+        if self.active!=Stage:
+            return
+        self.profile.disable()
+        snapshot = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+
+        count = self.counts.get(Stage, 0)+1
+        self.counts[Stage] = count
+        name = f"{self.prefix}-{Stage}" if count==1 else f"{self.prefix}-{Stage}-{count}"
+        prof_file = os.path.join(self.folder, f"{name}.prof")
+        snapshot_file = os.path.join(self.folder, f"{name}.snapshot")
+        self.profile.dump_stats(prof_file)
+        snapshot.dump(snapshot_file)
+        self.files.extend([prof_file, snapshot_file])
+
+        self.profile = None
+        self.active = None
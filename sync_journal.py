@@ -0,0 +1,130 @@
+# Copyright (c) 2025 M. Fairbanks
+#
+# This source code is licensed under the Apache License, Version 2.0, found in the
+# LICENSE file in the root directory of this source tree.
+
+import os, json, time
+
+'''
+A SyncJournal is an append-only record of the file operations of a synchronization, used to resume an interrupted synchronization.
+
+The journal is a text file with one JSON record per line:
+- plan: mode, target path and clean path of the synchronization, and the time it started
+- task: a planned operation, with id, action, source file, target file and size
+- done: id of a completed operation
+- complete: the synchronization completed
+
+Every planned operation is written to disk before the first operation is performed.  Completed operations are appended as
+they complete, and written to disk at least every SyncInterval seconds.  A partially written last line is ignored when
+the journal is read, and discarded when the journal is reopened.  After a crash, recently completed operations may not be
+recorded as done, so a resumed synchronization confirms each pending operation before performing it.
+'''
+
+class SyncJournal:
+    SyncInterval = 1.0
+
+    def __init__(self, Filepath:str):
+        self.filepath = Filepath
+        self.file = None
+        self.valid_size = 0
+        self.last_sync = 0
+        self.plan = None
+        self.tasks = {}
+        self.done = set()
+        self.complete = False
+
+    def GetFilepath(self)->str:
+        return self.filepath
+
+    def Start(self, Plan:dict, Tasks:list):
+        # starts a new journal, replacing an existing journal; tasks are numbered from zero in the order listed
+        self.Close()
+        self.file = open(self.filepath, 'w', encoding='utf-8')
+        self.plan = {**Plan, 'start':time.time()}
+        self.tasks = {}
+        self.done = set()
+        self.complete = False
+        self.__write({'type':'plan', **self.plan})
+        for task_id, task in enumerate(Tasks):
+            self.tasks[task_id] = task
+            self.__write({'type':'task', 'id':task_id, 'action':int(task[0]), 'source':task[1], 'target':task[2], 'size':task[3]})
+        self.__sync(True)
+
+    def Load(self)->bool:
+        # reads an existing journal; returns False if there is no journal
+        if os.path.isfile(self.filepath) is False:
+            return False
+
+        self.plan = None
+        self.tasks = {}
+        self.done = set()
+        self.complete = False
+        self.valid_size = 0
+        with open(self.filepath, 'rb') as file:
+            for line in file:
+                try:
+                    if line.endswith(b"\n") is False:
+                        raise ValueError()
+                    record = json.loads(line)
+                except ValueError:
+                    break
+                self.valid_size += len(line)
+                match record.get('type'):
+                    case 'plan':
+                        self.plan = {k:v for k,v in record.items() if k!='type'}
+                    case 'task':
+                        self.tasks[record['id']] = (record['action'], record['source'], record['target'], record['size'])
+                    case 'done':
+                        self.done.add(record['id'])
+                    case 'complete':
+                        self.complete = True
+
+        return self.plan is not None
+
+    def Reopen(self):
+        # appends to a loaded journal, after discarding a partially written record
+        self.Close()
+        os.truncate(self.filepath, self.valid_size)
+        self.file = open(self.filepath, 'a', encoding='utf-8')
+
+    def GetPlan(self)->dict|None:
+        return self.plan
+
+    def GetStartTime(self)->float:
+        return self.plan.get('start', 0) if self.plan else 0
+
+    def IsComplete(self)->bool:
+        return self.complete
+
+    def GetTaskCount(self)->int:
+        return len(self.tasks)
+
+    def GetPendingTasks(self)->list:
+        # returns [(id, task)] of tasks that were not completed, in the order planned
+        return [(task_id, self.tasks[task_id]) for task_id in sorted(self.tasks.keys()) if task_id not in self.done]
+
+    def TaskDone(self, TaskId:int):
+        self.done.add(TaskId)
+        self.__write({'type':'done', 'id':TaskId})
+        self.__sync()
+
+    def Complete(self):
+        self.complete = True
+        self.__write({'type':'complete'})
+        self.__sync(True)
+
+    def Close(self):
+        if self.file is not None:
+            self.__sync(True)
+            self.file.close()
+            self.file = None
+
+    def __write(self, in_record:dict):
+        self.file.write(json.dumps(in_record)+"\n")
+
+    def __sync(self, in_force=False):
+        now = time.monotonic()
+        if in_force or now-self.last_sync>=SyncJournal.SyncInterval:
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.last_sync = now
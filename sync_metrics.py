@@ -0,0 +1,126 @@
+# Copyright (c) 2025 M. Fairbanks
+#
+# This source code is licensed under the Apache License, Version 2.0, found in the
+# LICENSE file in the root directory of this source tree.
+
+import os, sys, json, time
+from contextlib import contextmanager
+
+'''
+A SyncMetrics collects measurements of a run, and writes them as a structured record for monitoring.
+
+Measurements are:
+- Stages: wall time of each stage, such as folder_scan, file_scan, remove, mover, csv and sync
+- Values: counts and sizes for the run, such as files copied and retries
+- Folder values: counts, sizes and times for each source folder section, by SourceFolder id
+
+A filepath ending in ".prom" is written in the Prometheus text format, for the node exporter textfile collector.
+Other filepaths are written as JSON.  The file is written to a temporary file and then renamed, so a reader never
+sees a partial record.
+
+With a StageProfiler (SetProfiler), each stage is also profiled with cProfile and tracemalloc.
+'''
+
+class SyncMetrics:
+    Prefix = "sync_files"
+
+    def __init__(self):
+        self.start = time.time()
+        self.stages = {}        # stage: {'seconds', 'count'}
+        self.values = {}        # name: value
+        self.folders = {}       # SourceFolder id: {name: value}
+        self.info = {}          # name: string
+        self.profiler = None
+
+    def SetProfiler(self, Profiler):
+        # a StageProfiler started and stopped with each stage, or None
+        self.profiler = Profiler
+
+    @contextmanager
+    def Stage(self, Name:str):
+        # measures the wall time of a stage; a stage entered again is added to its total
+        profiled = self.profiler is not None and self.profiler.Start(Name)
+        start = time.perf_counter()
+        try:
+            yield self
+        finally:
+            stage = self.stages.setdefault(Name, {'seconds':0.0, 'count':0})
+            stage['seconds'] += time.perf_counter()-start
+            stage['count'] += 1
+            if profiled:
+                self.profiler.Stop(Name)
+
+    def GetStageSeconds(self, Name:str)->float:
+        return self.stages[Name]['seconds'] if Name in self.stages else 0.0
+
+    def SetInfo(self, Name:str, Value:str):
+        self.info[Name] = Value
+
+    def Add(self, Name:str, Value:int|float=1, SourceFolder:str=None):
+        values = self.values if SourceFolder is None else self.folders.setdefault(SourceFolder, {})
+        values[Name] = values.get(Name, 0)+Value
+
+    def Set(self, Name:str, Value:int|float, SourceFolder:str=None):
+        values = self.values if SourceFolder is None else self.folders.setdefault(SourceFolder, {})
+        values[Name] = Value
+
+    def GetValue(self, Name:str, SourceFolder:str=None):
+        values = self.values if SourceFolder is None else self.folders.get(SourceFolder, {})
+        return values.get(Name, 0)
+
+    def GetRecord(self)->dict:
+        record = {'start':self.start, 'end':time.time(), **self.info}
+        record['stages'] = {name:stage['seconds'] for name, stage in self.stages.items()}
+        record['values'] = dict(self.values)
+        peak_rss = SyncMetrics.PeakRSS()
+        if peak_rss is not None:
+            record['values']['peak_rss_bytes'] = peak_rss
+        record['folders'] = {folder:dict(values) for folder, values in self.folders.items()}
+        return record
+
+    def Write(self, Filepath:str):
+        record = self.GetRecord()
+        temp_file = Filepath+".tmp"
+        with open(temp_file, 'w', encoding='utf-8') as file:
+            if Filepath.lower().endswith(".prom"):
+                file.write(SyncMetrics.__prometheus(record))
+            else:
+                json.dump(record, file, indent=2)
+                file.write("\n")
+        os.replace(temp_file, Filepath)
+
+    @staticmethod
+    def PeakRSS()->int|None:
+        # returns peak resident memory of the process in bytes, where available
+        try:
+            import resource
+        except ImportError:
+            return None
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return rss if sys.platform=="darwin" else rss*1024
+
+    @staticmethod
+    def __prometheus(in_record:dict)->str:
+        prefix = SyncMetrics.Prefix
+        info = ",".join([f"{k}=\"{SyncMetrics.__escape(v)}\"" for k, v in in_record.items() if isinstance(v, str)])
+        lines = [f"# TYPE {prefix}_info gauge", f"{prefix}_info{{{info}}} 1"]
+        lines += [f"# TYPE {prefix}_start_time_seconds gauge", f"{prefix}_start_time_seconds {in_record['start']}"]
+        lines += [f"# TYPE {prefix}_end_time_seconds gauge", f"{prefix}_end_time_seconds {in_record['end']}"]
+        lines.append(f"# TYPE {prefix}_stage_seconds gauge")
+        for name, seconds in in_record['stages'].items():
+            lines.append(f"{prefix}_stage_seconds{{stage=\"{name}\"}} {seconds}")
+        for name, value in in_record['values'].items():
+            lines += [f"# TYPE {prefix}_{name} gauge", f"{prefix}_{name} {value}"]
+        folder_names = []
+        for values in in_record['folders'].values():
+            folder_names += [name for name in values if name not in folder_names]
+        for name in folder_names:
+            lines.append(f"# TYPE {prefix}_folder_{name} gauge")
+            for folder, values in in_record['folders'].items():
+                if name in values:
+                    lines.append(f"{prefix}_folder_{name}{{source_folder=\"{SyncMetrics.__escape(folder)}\"}} {values[name]}")
+        return "\n".join(lines)+"\n"
+
+    @staticmethod
+    def __escape(in_value:str)->str:
+        return str(in_value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
@@ -0,0 +1,133 @@
+# Copyright (c) 2025 M. Fairbanks
+#
+# This source code is licensed under the Apache License, Version 2.0, found in the
+# LICENSE file in the root directory of this source tree.
+
+import os, time, shutil
+
+'''
+A SyncSnapshot is a dated folder of a snapshot synchronization, in the style of rsnapshot.
+
+Each snapshot is a complete copy of the source folders, in its own folder under the target path:
+- Source files are compared to the previous snapshot, which is the last snapshot created
+- Unchanged files are hardlinks to files of the previous snapshot; only NEW and MOD files are copied
+- Misplaced files are linked from their place in the previous snapshot
+
+A snapshot is written to a folder named {name}.partial, and renamed when it is complete, so an interrupted snapshot is
+never used as a previous snapshot.
+
+Complete snapshots are recorded in an index file under the target path, one line per snapshot: {name}\t{creation time}.
+Snapshots are ordered by creation time rather than by name, so any SnapshotName may be used.  A folder that is not
+in the index, such as an object store or a folder added by hand, is not a snapshot, and is never expired.
+'''
+
+class SyncSnapshot:
+    PartialSuffix = ".partial"
+    IndexName = ".sync-snapshots"
+
+    def __init__(self, TargetPath:str, Name:str):
+        self.target_path = TargetPath
+        self.created = time.time()
+        snapshots = SyncSnapshot.ListSnapshots(TargetPath)
+        self.previous = os.path.join(TargetPath, snapshots[-1]) if len(snapshots)>0 else None
+
+        # a name that is already used, such as from two runs in the same second, gets a numbered suffix
+        name = Name
+        index = 0
+        while os.path.exists(os.path.join(TargetPath, name)) or os.path.exists(os.path.join(TargetPath, name+SyncSnapshot.PartialSuffix)):
+            index += 1
+            name = f"{Name}-{index:03d}"
+        self.name = name
+        self.path = os.path.join(TargetPath, name)
+        self.partial_path = self.path+SyncSnapshot.PartialSuffix
+
+    def GetPath(self)->str:
+        return self.path
+
+    def GetPartialPath(self)->str:
+        return self.partial_path
+
+    def GetPrevious(self)->str|None:
+        return self.previous
+
+    def GetComparePath(self)->str:
+        # source folders are compared to the previous snapshot; the first snapshot is compared to the empty new snapshot
+        return self.previous if self.previous is not None else self.partial_path
+
+    def MapPath(self, ComparePath:str)->str:
+        # returns the path in the new snapshot of a path under the compare path
+        relpath = os.path.relpath(ComparePath, self.GetComparePath())
+        return self.partial_path if relpath=='.' else os.path.join(self.partial_path, relpath)
+
+    def Complete(self):
+        os.makedirs(self.partial_path, exist_ok=True)
+        os.rename(self.partial_path, self.path)
+        self.__discard_partial_line()
+        with open(SyncSnapshot.GetIndexPath(self.target_path), 'a', encoding='utf-8') as file:
+            file.write(f"{self.name}\t{self.created}\n")
+
+    def __discard_partial_line(self):
+        # a partially written last line of the index, such as from a crash, is removed before a line is added
+        index_path = SyncSnapshot.GetIndexPath(self.target_path)
+        if os.path.isfile(index_path):
+            with open(index_path, 'rb') as file:
+                data = file.read()
+            if len(data)>0 and data.endswith(b"\n") is False:
+                os.truncate(index_path, data.rfind(b"\n")+1)
+
+    def DiscardPartial(self)->list:
+        # removes partial snapshots of interrupted runs; returns paths removed
+        removed = []
+        for name in sorted(os.listdir(self.target_path)):
+            path = os.path.join(self.target_path, name)
+            if name.endswith(SyncSnapshot.PartialSuffix) and path!=self.partial_path and os.path.isdir(path):
+                shutil.rmtree(path)
+                removed.append(path)
+        return removed
+
+    def Expire(self, Keep:int)->list:
+        # removes the oldest snapshots, keeping the newest Keep snapshots; returns paths removed
+        removed = []
+        snapshots = SyncSnapshot.ListSnapshots(self.target_path)
+        for name in snapshots[:max(0, len(snapshots)-Keep)]:
+            path = os.path.join(self.target_path, name)
+            shutil.rmtree(path)
+            removed.append(path)
+
+        # the index is written again with the remaining snapshots
+        created = SyncSnapshot.__read_index(self.target_path)
+        index_path = SyncSnapshot.GetIndexPath(self.target_path)
+        with open(index_path+".tmp", 'w', encoding='utf-8') as file:
+            for name in SyncSnapshot.ListSnapshots(self.target_path):
+                file.write(f"{name}\t{created[name]}\n")
+        os.replace(index_path+".tmp", index_path)
+        return removed
+
+    @staticmethod
+    def GetIndexPath(TargetPath:str)->str:
+        return os.path.join(TargetPath, SyncSnapshot.IndexName)
+
+    @staticmethod
+    def ListSnapshots(TargetPath:str)->list:
+        # returns names of complete snapshots in the index that still exist, oldest first
+        created = SyncSnapshot.__read_index(TargetPath)
+        names = [name for name in created if os.path.isdir(os.path.join(TargetPath, name))]
+        return sorted(names, key=lambda name: (created[name], name))
+
+    @staticmethod
+    def __read_index(in_target_path)->dict:
+        # returns {name: creation time}; a line that cannot be read, such as a partially written line, is ignored
+        created = {}
+        try:
+            with open(SyncSnapshot.GetIndexPath(in_target_path), encoding='utf-8') as file:
+                for line in file:
+                    if line.endswith("\n") is False:
+                        continue
+                    try:
+                        name, timestamp = line.rstrip("\n").rsplit("\t", 1)
+                        created[name] = float(timestamp)
+                    except ValueError:
+                        pass
+        except FileNotFoundError:
+            pass
+        return created
@@ -5,32 +5,88 @@
 
 from m9lib import uConfig, uLogger, uConfigSection
 
-import os, pathlib
+import os, pathlib, fnmatch, functools
 
 class SyncUtils:
     Logger:uLogger = None
+    NormalPaths:dict = {}
+    NormalPathsLimit:int = 65536
 
     @staticmethod
     def NormalizePath(Path:str|tuple)->str:
+        # paths are resolved once; results are kept until ResetPaths(), or until NormalPathsLimit newer paths are kept
         if isinstance(Path, tuple):
             Path = os.path.join(Path[1], Path[0])
-        return str(pathlib.Path(Path).resolve())
+        normal = SyncUtils.NormalPaths.get(Path)
+        if normal is None:
+            normal = str(pathlib.Path(Path).resolve())
+            SyncUtils.keep_path(Path, normal)
+            SyncUtils.keep_path(normal, normal)
+        return normal
 
     @staticmethod
-    def PathIsUnder(RootPath:str, ChildPath:str, SameIsUnder=False)->bool:
+    def NormalizeChild(ParentPath:str, Name:str, Linked:bool=False)->str:
+        # normalizes a folder found in a normalized parent folder
+        # only a linked folder is resolved; otherwise the path is joined
+        path = os.path.join(ParentPath, Name)
+        if Linked:
+            return SyncUtils.NormalizePath(path)
+        SyncUtils.keep_path(path, path)
+        return path
+
+    @staticmethod
+    def keep_path(in_path:str, in_normal:str):
+        # the oldest paths are discarded, so that a long run such as watch mode does not keep every path it has seen
+        paths = SyncUtils.NormalPaths
+        if in_path in paths:
+            return
+        paths[in_path] = in_normal
+        while len(paths)>SyncUtils.NormalPathsLimit:
+            try:
+                del paths[next(iter(paths))]
+            except (KeyError, StopIteration, RuntimeError):
+                break
+
+    @staticmethod
+    def ResetPaths():
+        # discards normalized paths and path comparisons
+        SyncUtils.NormalPaths = {}
+        SyncUtils.is_under.cache_clear()
+
+    @staticmethod
+    def PathIsUnder(RootPath:str, ChildPath:str, SameIsUnder=False, Normalized=False)->bool:
+        # when Normalized is True, ChildPath is already normalized
         try:
             RootPath = SyncUtils.NormalizePath(RootPath)
-            ChildPath = SyncUtils.NormalizePath(ChildPath)
+            if Normalized is False:
+                ChildPath = SyncUtils.NormalizePath(ChildPath)
             if RootPath == ChildPath:
                 return SameIsUnder
-            else:
-                common_path = os.path.commonpath([RootPath, ChildPath])
-                if common_path == RootPath:
-                    return True
+            return SyncUtils.is_under(RootPath, ChildPath)
         except:
             pass
         return False
+
+    @staticmethod
+    @functools.lru_cache(maxsize=65536)
+    def is_under(in_root:str, in_child:str)->bool:
+        # compares normalized paths; equivalent to os.path.commonpath([in_root, in_child]) == in_root
+        root = os.path.normcase(in_root)
+        child = os.path.normcase(in_child)
+        if root == child:
+            return True
+        if root.endswith(os.sep) is False:
+            root += os.sep
+        return child.startswith(root)
     
+    @staticmethod
+    def MaskPattern(Mask:str)->str:
+        # regular expression equivalent to fnmatch.fnmatch(), which ignores case where the file system does
+        pattern = fnmatch.translate(Mask)
+        if os.path.normcase('A')=='a':
+            pattern = f"(?i:{pattern})"
+        return pattern
+
     @staticmethod
     def CombineConfigurationList(Config:uConfig, List:str|list, SectionName:str)->list:
         '''
@@ -62,3 +118,29 @@ class SyncUtils:
     @staticmethod
     def CombineFileSetRules(Config:uConfig, Rules:str|list):
         return SyncUtils.CombineConfigurationList(Config, Rules, "FileSet")
+
+class SyncLogBuffer:
+    # records log messages written in a worker process, to be written to the log by the main process
+
+    def __init__(self):
+        self.messages = []
+
+    def WriteLine(self, Text:str):
+        self.messages.append(('WriteLine', Text))
+
+    def WriteDetails(self, Text:str):
+        self.messages.append(('WriteDetails', Text))
+
+    def WriteWarning(self, Text:str):
+        self.messages.append(('WriteWarning', Text))
+
+    def WriteError(self, Text:str):
+        self.messages.append(('WriteError', Text))
+
+    def GetMessages(self)->list:
+        return self.messages
+
+    @staticmethod
+    def Replay(Messages:list, Logger:uLogger):
+        for method, text in Messages:
+            getattr(Logger, method)(text)
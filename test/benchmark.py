@@ -0,0 +1,276 @@
+import os, sys, json, time, random, shutil, argparse, platform, subprocess, tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from m9lib import uControl, uLoggerLevel
+
+import folder_scan
+from c_file_sync import *
+
+'''
+Benchmark of synchronization stages on synthetic source and target trees.
+
+Trees are generated from a seed, so the same arguments always produce the same trees:
+- The source tree has --depth levels of --fanout subfolders, with --files files in each folder
+- File sizes are log-uniform between --min-size and --max-size; files are sparse, so large trees are cheap to create
+- The target tree is a copy of the source tree, except for --changed (MOD), --moved (misplaced) and --new (not copied)
+  percentages of files, and --removed percentage of extra target files
+- --rules adds include file rules and exclude folder rules, for rule complexity
+
+Each run performs a SYNC, timing these stages:
+- folder_set: FolderSet evaluation of folder rules and tags
+- scan_files: FileSetRules.ScanFiles
+- calc_remove_files, calc_mover_files, generate_csv, perform_synchronization
+
+With --memory, the peak of memory allocated during each stage is measured with tracemalloc, which slows every stage.
+Results are appended to --output as one JSON record per run, to track performance over time.
+
+Example:
+    python test/benchmark.py --depth 3 --fanout 8 --files 20 --changed 5 --moved 2 --repeat 3
+'''
+
+class StageTimer:
+    def __init__(self, Memory:bool=False):
+        self.memory = Memory
+        self.stages = {}
+        self.active = None
+
+    def Wrap(self, Name:str, Func):
+        # returns Func, timed as stage Name; calls of a stage within another stage are counted by the outer stage
+        def staged(*args, **kwargs):
+            if self.active is not None:
+                return Func(*args, **kwargs)
+            self.active = Name
+            if self.memory:
+                tracemalloc.reset_peak()
+                start_memory = tracemalloc.get_traced_memory()[0]
+            start = time.perf_counter()
+            try:
+                return Func(*args, **kwargs)
+            finally:
+                stage = self.stages.setdefault(Name, {'calls':0, 'seconds':0.0, 'peak_bytes':0})
+                stage['calls'] += 1
+                stage['seconds'] += time.perf_counter()-start
+                if self.memory:
+                    stage['peak_bytes'] = max(stage['peak_bytes'], tracemalloc.get_traced_memory()[1]-start_memory)
+                self.active = None
+        return staged
+
+    def GetStages(self)->dict:
+        return self.stages
+
+class SyntheticTree:
+    def __init__(self, Args):
+        self.args = Args
+        self.random = random.Random(Args.seed)
+        self.extensions = [f"x{i:02d}" for i in range(max(4, Args.rules))]
+        self.folders = []
+        self.files = []         # (relative folder, name, size)
+
+    def Generate(self, Root:str):
+        source_path = os.path.join(Root, "source")
+        target_path = os.path.join(Root, "target")
+        self.__plan_folders("", 0)
+        for folder in self.folders:
+            for index in range(self.args.files):
+                name = f"file{index:05d}.{self.random.choice(self.extensions)}"
+                self.files.append((folder, name, self.__file_size()))
+
+        for folder in self.folders:
+            os.makedirs(os.path.join(source_path, folder), exist_ok=True)
+        for folder, name, size in self.files:
+            SyntheticTree.WriteFile(os.path.join(source_path, folder, name), size)
+
+        self.GenerateTarget(target_path)
+
+    def GenerateTarget(self, TargetPath:str):
+        # target files are chosen from a separate seed, so the target is the same for each repeat
+        target_random = random.Random(self.args.seed+1)
+        if os.path.isdir(TargetPath):
+            shutil.rmtree(TargetPath)
+        for folder in self.folders:
+            os.makedirs(os.path.join(TargetPath, folder), exist_ok=True)
+
+        for folder, name, size in self.files:
+            roll = target_random.uniform(0, 100)
+            if roll<self.args.new:
+                continue
+            roll -= self.args.new
+            if roll<self.args.changed:
+                size += 1
+            elif roll-self.args.changed<self.args.moved:
+                # a misplaced file has the same name and size, in another folder
+                folder = os.path.join(target_random.choice(self.folders), "misplaced", folder)
+                os.makedirs(os.path.join(TargetPath, folder), exist_ok=True)
+            SyntheticTree.WriteFile(os.path.join(TargetPath, folder, name), size)
+
+        removed = int(len(self.files)*self.args.removed/100)
+        for index in range(removed):
+            SyntheticTree.WriteFile(os.path.join(TargetPath, target_random.choice(self.folders), f"removed{index:05d}.dat"), target_random.randint(0, 4096))
+
+    def GetFileCount(self)->int:
+        return len(self.files)
+
+    def GetFolderCount(self)->int:
+        return len(self.folders)
+
+    def GetTotalSize(self)->int:
+        return sum([file[2] for file in self.files])
+
+    def __plan_folders(self, in_folder, in_depth):
+        self.folders.append(in_folder)
+        if in_depth<self.args.depth:
+            for index in range(self.args.fanout):
+                self.__plan_folders(os.path.join(in_folder, f"folder{in_depth}-{index:03d}"), in_depth+1)
+
+    def __file_size(self)->int:
+        low = max(1, self.args.min_size)
+        high = max(low, self.args.max_size)
+        return int(low*((high/low)**self.random.random()))
+
+    @staticmethod
+    def WriteFile(Filepath:str, Size:int):
+        with open(Filepath, 'wb') as file:
+            file.truncate(Size)
+
+def write_config(in_args, in_root)->str:
+    # writes a configuration file for a SYNC of the synthetic trees
+    include_rules = ",".join([f"*.x{i:02d}|SIZE_LT:{in_args.max_size}" for i in range(in_args.rules)])
+    exclude_rules = ",".join([f"skip{i:02d}*" for i in range(in_args.rules)])
+    lines = [
+        "[FileSync]",
+        f"Logfile = {os.path.join(in_root, 'benchmark.log')}",
+        "Execute = run",
+        "",
+        "[FileSyncCommand:run]",
+        "Mode=SYNC",
+        "SourceFolders=bench",
+        f"TargetPath={os.path.join(in_root, 'target')}",
+        f"CleanPath={os.path.join(in_root, 'clean')}",
+        f"OutputCSV={os.path.join(in_root, 'benchmark.csv')}",
+        f"CompareMode={in_args.compare}",
+        f"CopyWorkers={in_args.copy_workers}",
+        "",
+        "[SourceFolder:bench]",
+        f"Path={os.path.join(in_root, 'source')}",
+    ]
+    if in_args.rules>0:
+        lines += ["DefaultRule=EXCLUDE", f"IncludeFiles={include_rules}", f"ExcludeFolders={exclude_rules}"]
+
+    config_file = os.path.join(in_root, "benchmark.ini")
+    with open(config_file, 'w') as file:
+        file.write("\n".join(lines)+"\n")
+    return config_file
+
+def install_stages(in_timer:StageTimer)->list:
+    # wraps stage functions; returns a list of (owner, attribute, original) to restore
+    stages = [
+        (folder_scan, 'scan_folder_set', 'folder_set'),
+        (FileSetRules, 'ScanFiles', 'scan_files'),
+        (FileSyncCommand, '_FileSyncCommand__calc_remove_files', 'calc_remove_files'),
+        (FileSyncCommand, '_FileSyncCommand__calc_mover_files', 'calc_mover_files'),
+        (FileSyncCommand, '_FileSyncCommand__generate_csv', 'generate_csv'),
+        (FileSyncCommand, '_FileSyncCommand__perform_synchronization', 'perform_synchronization'),
+    ]
+    restore = []
+    for owner, attribute, name in stages:
+        original = getattr(owner, attribute)
+        restore.append((owner, attribute, original))
+        setattr(owner, attribute, in_timer.Wrap(name, original))
+    return restore
+
+def run_once(in_args, in_config)->dict:
+    timer = StageTimer(in_args.memory)
+    restore = install_stages(timer)
+    if in_args.memory:
+        tracemalloc.start()
+    try:
+        start = time.perf_counter()
+        control = uControl("FileSync", in_config)
+        control.GetLogger().SetWriteLevel(Level=uLoggerLevel.INFO)
+        control.GetLogger().SetPrint(Print=False)
+        control.Execute()
+        total = time.perf_counter()-start
+    finally:
+        if in_args.memory:
+            tracemalloc.stop()
+        for owner, attribute, original in restore:
+            setattr(owner, attribute, original)
+
+    return {'total_seconds':total, 'stages':timer.GetStages()}
+
+def max_rss_bytes()->int|None:
+    try:
+        import resource
+    except ImportError:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform=="darwin" else rss*1024
+
+def git_commit()->str|None:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark synchronization stages on synthetic trees")
+    parser.add_argument("--root", default=os.path.join("test", "bench"), help="folder for synthetic trees; replaced by each benchmark")
+    parser.add_argument("--output", default=os.path.join("test", "bench-results.jsonl"), help="results file; one JSON record is appended per run")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--depth", type=int, default=3, help="levels of subfolders")
+    parser.add_argument("--fanout", type=int, default=5, help="subfolders in each folder")
+    parser.add_argument("--files", type=int, default=20, help="files in each folder")
+    parser.add_argument("--min-size", type=int, default=100)
+    parser.add_argument("--max-size", type=int, default=1024*1024)
+    parser.add_argument("--rules", type=int, default=4, help="number of include file rules and exclude folder rules")
+    parser.add_argument("--changed", type=float, default=5.0, help="percentage of files modified in source")
+    parser.add_argument("--moved", type=float, default=2.0, help="percentage of files misplaced in target")
+    parser.add_argument("--new", type=float, default=5.0, help="percentage of files not in target")
+    parser.add_argument("--removed", type=float, default=2.0, help="extra target files, as a percentage of source files")
+    parser.add_argument("--compare", default="SIZE", choices=["SIZE", "MTIME", "HASH"])
+    parser.add_argument("--copy-workers", type=int, default=1)
+    parser.add_argument("--repeat", type=int, default=1, help="runs; the target tree is generated again for each run")
+    parser.add_argument("--memory", action="store_true", help="measure peak memory of each stage with tracemalloc")
+    args = parser.parse_args()
+
+    root = os.path.abspath(args.root)
+    if os.path.isdir(root):
+        shutil.rmtree(root)
+    os.makedirs(root)
+
+    start = time.perf_counter()
+    tree = SyntheticTree(args)
+    tree.Generate(root)
+    print(f"Generated {tree.GetFileCount()} files in {tree.GetFolderCount()} folders ({time.perf_counter()-start:.1f} sec)")
+    config = write_config(args, root)
+
+    for run in range(args.repeat):
+        if run>0:
+            tree.GenerateTarget(os.path.join(root, "target"))
+        shutil.rmtree(os.path.join(root, "clean"), ignore_errors=True)
+
+        result = run_once(args, config)
+        record = {
+            'time': time.strftime("%Y-%m-%dT%H:%M:%S"),
+            'commit': git_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'run': run+1,
+            'params': {k:v for k,v in vars(args).items() if k not in ['root', 'output', 'repeat']},
+            'folders': tree.GetFolderCount(),
+            'files': tree.GetFileCount(),
+            'bytes': tree.GetTotalSize(),
+            'max_rss_bytes': max_rss_bytes(),
+            **result,
+        }
+        with open(args.output, 'a') as file:
+            file.write(json.dumps(record)+"\n")
+
+        print(f"Run {run+1}: {result['total_seconds']:.3f} sec")
+        for name, stage in result['stages'].items():
+            memory = f"; peak {stage['peak_bytes']/(1024*1024):.1f} mb" if args.memory else ""
+            print(f"- {name}: {stage['seconds']:.3f} sec ({stage['calls']} calls{memory})")
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,6 @@
 import unittest
 import os,shutil
+import threading,time,_thread
 
 from m9lib import uControl, uConfig, uCSV
 
@@ -93,6 +94,22 @@ class Test_Template(uTestCase):
         self.run_command("test-17-parent-folder.ini")
         self.check_results("test-17-parent-folder.csv", {'NEW': 2, 'SAME': 2, 'MOD': 2, 'SKIP': 20, 'REMOVE': 0})
 
+    def test_sibling_folders(self):
+        # folder tags apply by folder, so that "foo" does not tag the sibling folder "foobar"
+        siblings = self.GetTestFolder("siblings")
+        for subfolder, filename in [("foo", "a.txt"), (os.path.join("foo", "sub"), "b.txt"), ("foobar", "c.txt"), (os.path.join("foobar", "sub"), "d.txt")]:
+            os.makedirs(os.path.join(siblings, subfolder), exist_ok=True)
+            with open(os.path.join(siblings, subfolder, filename), "w") as file:
+                file.write(filename)
+
+        self.run_command("test-18-sibling-folders.ini")
+        self.check_results("test-18-sibling-folders.csv", {'NEW': 2, 'SAME': 0, 'MOD': 0, 'SKIP': 2, 'REMOVE': 0})
+        status = self.check_status("test-18-sibling-folders.csv")
+        self.assertEqual(status.get('a.txt'), 'NEW')
+        self.assertEqual(status.get('b.txt'), 'NEW')
+        self.assertEqual(status.get('c.txt'), 'SKIP')
+        self.assertEqual(status.get('d.txt'), 'SKIP')
+
     def test_backup(self):
         self.run_command("test-21-backup-review.ini")
         all_files_1 = self.check_files(r'test\run\target')
@@ -150,6 +167,157 @@ class Test_Template(uTestCase):
         self.assertTrue('black_cat-001.jpg' in clean_files)
         pass
 
+    @unittest.skipUnless(FolderWatch.IsSupported(), "Watch mode requires Linux inotify")
+    def test_watch(self):
+        # files created, modified and removed while watching are synchronized
+        # a batch reported as an overflow drops its changes, which are found by walking all folders again
+        source = self.GetTestFolder(os.path.join("watch", "source"))
+        target = self.GetTestFolder(os.path.join("watch", "target"))
+        clean = self.GetTestFolder(os.path.join("watch", "clean"))
+        os.makedirs(source)
+        self.write_file(os.path.join(source, "first.txt"), "first")
+
+        watching = threading.Event()
+        overflow = threading.Event()
+        wait = FolderWatch.Wait
+        def wait_overflow(watch, Timeout=None):
+            watching.set()
+            batch = wait(watch, Timeout)
+            if batch is not None and overflow.is_set():
+                overflow.clear()
+                return (set(), set(), True)
+            return batch
+
+        results = {}
+        def change_files():
+            try:
+                results['watch'] = watching.wait(30)
+                self.write_file(os.path.join(source, "new.txt"), "new")
+                results['create'] = self.wait_for(lambda: self.read_file(os.path.join(target, "new.txt"))=="new")
+                self.write_file(os.path.join(source, "new.txt"), "modified")
+                results['modify'] = self.wait_for(lambda: self.read_file(os.path.join(target, "new.txt"))=="modified")
+                os.remove(os.path.join(source, "first.txt"))
+                results['remove'] = self.wait_for(lambda: os.path.isfile(os.path.join(target, "first.txt")) is False)
+                overflow.set()
+                self.write_file(os.path.join(source, "missed.txt"), "missed")
+                results['overflow'] = self.wait_for(lambda: self.read_file(os.path.join(target, "missed.txt"))=="missed")
+            finally:
+                _thread.interrupt_main()
+
+        FolderWatch.Wait = wait_overflow
+        thread = threading.Thread(target=change_files)
+        thread.start()
+        try:
+            self.run_command("test-28-watch.ini")
+        finally:
+            FolderWatch.Wait = wait
+            thread.join()
+
+        self.check_results("test-28-watch.csv", {'NEW': 1, 'SAME': 0, 'MOD': 0, 'REMOVE': 0})
+        self.assertTrue(results.get('watch'))
+        self.assertTrue(results.get('create'))
+        self.assertTrue(results.get('modify'))
+        self.assertTrue(results.get('remove'))
+        self.assertTrue(os.path.isfile(os.path.join(clean, "first.txt")))
+        self.assertTrue(results.get('overflow'))
+        self.assertEqual(sorted(self.check_files(target)), ['missed.txt', 'new.txt'])
+
+    def test_resume(self):
+        # a resumed synchronization performs only pending operations, and discards a partially written journal record
+        source = self.GetTestFolder(os.path.join("resume", "source"))
+        target = self.GetTestFolder(os.path.join("resume", "target"))
+        clean = self.GetTestFolder(os.path.join("resume", "clean"))
+        os.makedirs(source)
+        os.makedirs(target)
+        for filename in ["done.txt", "torn.txt", "pending.txt"]:
+            self.write_file(os.path.join(source, filename), filename)
+        self.write_file(os.path.join(target, "stale.txt"), "stale")
+
+        journal_path = self.GetTestFolder(os.path.join("resume", "journal.txt"))
+        journal = SyncJournal(journal_path)
+        journal.Start({'mode':"SYNC", 'target':SyncUtils.NormalizePath(target), 'clean':SyncUtils.NormalizePath(clean)}, [
+            (CopyAction.COPY, os.path.join(source, "done.txt"), os.path.join(target, "done.txt"), 8),
+            (CopyAction.COPY, os.path.join(source, "torn.txt"), os.path.join(target, "torn.txt"), 8),
+            (CopyAction.COPY, os.path.join(source, "pending.txt"), os.path.join(target, "pending.txt"), 11),
+            (CopyAction.MOVE, os.path.join(target, "missing.txt"), os.path.join(target, "moved.txt"), 7),
+            (CopyAction.CLEAN, os.path.join(target, "stale.txt"), os.path.join(target, "stale.txt"), 5)])
+        journal.TaskDone(0)
+        journal.Close()
+        torn = '{"type": "done", "id": 1'
+        with open(journal_path, "a") as file:
+            file.write(torn)
+
+        self.run_command("test-29-resume.ini")
+        self.assertEqual(sorted(self.check_files(target)), ['pending.txt', 'torn.txt'])
+        self.assertEqual(sorted(self.check_files(clean)), ['stale.txt'])
+        with open(journal_path) as file:
+            text = file.read()
+        self.assertTrue(text.endswith("\n"))
+        self.assertFalse(torn+"\n" in text)
+        journal = SyncJournal(journal_path)
+        self.assertTrue(journal.Load())
+        self.assertTrue(journal.IsComplete())
+        self.assertEqual(len(journal.GetPendingTasks()), 0)
+
+    def test_object_store(self):
+        # duplicate files are hardlinks to one stored object; Prune() removes only objects that are no longer linked
+        source = self.GetTestFolder(os.path.join("store", "source"))
+        target = self.GetTestFolder(os.path.join("store", "target"))
+        os.makedirs(os.path.join(source, "copies"))
+        self.write_file(os.path.join(source, "dup.txt"), "duplicate")
+        self.write_file(os.path.join(source, "copies", "dup.txt"), "duplicate")
+        self.write_file(os.path.join(source, "unique.txt"), "unique")
+
+        self.run_command("test-30-object-store.ini")
+        self.check_results("test-30-object-store.csv", {'NEW': 3, 'SAME': 0, 'MOD': 0, 'REMOVE': 0})
+        dup_stat = os.stat(os.path.join(target, "dup.txt"))
+        self.assertEqual(dup_stat.st_ino, os.stat(os.path.join(target, "copies", "dup.txt")).st_ino)
+        self.assertNotEqual(dup_stat.st_ino, os.stat(os.path.join(target, "unique.txt")).st_ino)
+
+        store = ObjectStore(target)
+        dup_object = store.GetObjectPath(FileHasher.HashFile(os.path.join(source, "dup.txt")))
+        unique_object = store.GetObjectPath(FileHasher.HashFile(os.path.join(source, "unique.txt")))
+        self.assertTrue(os.path.samefile(dup_object, os.path.join(target, "dup.txt")))
+        os.remove(os.path.join(target, "unique.txt"))
+        self.assertEqual(store.Prune(), (1, 6))
+        self.assertFalse(os.path.isfile(unique_object))
+        self.assertTrue(os.path.isfile(dup_object))
+
+    def test_snapshot(self):
+        # snapshots are ordered by creation time; KeepSnapshots removes only the oldest snapshot
+        source = self.GetTestFolder(os.path.join("snapshot", "source"))
+        target = self.GetTestFolder(os.path.join("snapshot", "target"))
+        os.makedirs(source)
+        os.makedirs(os.path.join(target, "manual"))
+        self.write_file(os.path.join(source, "same.txt"), "same")
+        for run in range(3):
+            self.write_file(os.path.join(source, "changed.txt"), "changed"*(run+1))
+            self.run_command("test-31-snapshot.ini")
+
+        self.assertEqual(SyncSnapshot.ListSnapshots(target), ['snap-001', 'snap-002'])
+        self.assertFalse(os.path.isdir(os.path.join(target, "snap")))
+        self.assertTrue(os.path.isdir(os.path.join(target, "manual")))
+        self.assertEqual(self.read_file(os.path.join(target, "snap-002", "changed.txt")), "changed"*3)
+        self.assertEqual(self.read_file(os.path.join(target, "snap-001", "changed.txt")), "changed"*2)
+        self.assertEqual(os.stat(os.path.join(target, "snap-001", "same.txt")).st_ino, os.stat(os.path.join(target, "snap-002", "same.txt")).st_ino)
+
+    def test_delta(self):
+        # a modified file is written from blocks of the source file that differ, and blocks of the previous target file that match
+        source = self.GetTestFolder(os.path.join("delta", "source"))
+        target = self.GetTestFolder(os.path.join("delta", "target"))
+        clean = self.GetTestFolder(os.path.join("delta", "clean"))
+        os.makedirs(source)
+        os.makedirs(target)
+        previous = "".join([f"{x:07d}\n" for x in range(300000)])
+        modified = previous[:1000000]+"changed"+previous[1000007:]+"appended"
+        self.write_file(os.path.join(target, "large.txt"), previous)
+        self.write_file(os.path.join(source, "large.txt"), modified)
+
+        self.run_command("test-32-delta.ini")
+        self.check_results("test-32-delta.csv", {'NEW': 0, 'SAME': 0, 'MOD': 1, 'REMOVE': 0})
+        self.assertEqual(self.read_file(os.path.join(target, "large.txt")), modified)
+        self.assertEqual(self.read_file(os.path.join(clean, "large.txt")), previous)
+
     def check_results(self, filename, expected):
         csv = uCSV()
         csv.ReadFile(os.path.join(self.test_output, filename))
@@ -166,6 +334,33 @@ class Test_Template(uTestCase):
                 self.assertEqual(expected[stat], results[stat], stat)
         pass
 
+    def check_status(self, filename)->dict:
+        # returns the status of each file in a result file, by file name
+        csv = uCSV()
+        csv.ReadFile(os.path.join(self.test_output, filename))
+        return {row[1]:row[3] for row in csv.GetRows()}
+
+    def write_file(self, filepath, text):
+        with open(filepath, "w") as file:
+            file.write(text)
+
+    def read_file(self, filepath):
+        # returns the text of a file, or None when the file does not exist
+        try:
+            with open(filepath) as file:
+                return file.read()
+        except OSError:
+            return None
+
+    def wait_for(self, condition, timeout=30)->bool:
+        # waits for a condition to be True; returns False after timeout seconds
+        end = time.monotonic()+timeout
+        while condition() is False:
+            if time.monotonic()>end:
+                return False
+            time.sleep(0.1)
+        return True
+
     def check_files(self, filepath, recurse=True):
         return [f[0] for f in uFolder.FindFiles(filepath, Recurse=recurse)]
 